@@ -7,18 +7,23 @@ from flask import (
     flash,
     session,
     jsonify,
+    Response,
+    stream_with_context,
+    send_file,
+    abort,
 )
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 import os
-import secrets
+import time
 from functools import wraps
 import pandas as pd
 from openpyxl import Workbook
 
 app = Flask(__name__)
-app.config["SECRET_KEY"] = secrets.token_hex(16)
+# Must be the same for every worker and host; without it a key is generated
+# once in the instance folder
+app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
 
 # 👉 Use DATABASE_URL from Render if it exists; otherwise, use local SQLite
 db_url = os.getenv("DATABASE_URL", "sqlite:///attendance.db")
@@ -30,6 +35,86 @@ if db_url.startswith("postgres://"):
 app.config["SQLALCHEMY_DATABASE_URI"] = db_url
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# Optional read replica for heavy read-only pages and exports
+replica_url = os.getenv("REPLICA_DATABASE_URL")
+if replica_url:
+    app.config["SQLALCHEMY_BINDS"] = {
+        "replica": replica_url.replace("postgres://", "postgresql://", 1)
+    }
+app.config["REPLICA_MAX_LAG"] = float(os.getenv("REPLICA_MAX_LAG", "5"))
+app.config["REPLICA_STICKY_SECONDS"] = int(os.getenv("REPLICA_STICKY_SECONDS", "10"))
+
+# Password hashing cost; existing hashes are upgraded on the next login
+app.config["PASSWORD_HASH_METHOD"] = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+app.config["PASSWORD_HASH_WORKERS"] = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+app.config["PASSWORD_HASH_MAX_PENDING"] = int(
+    os.getenv("PASSWORD_HASH_MAX_PENDING", "8")
+)
+
+# Background thread that moves sessions scheduled -> active -> completed
+app.config["SESSION_SCHEDULER_ENABLED"] = (
+    os.getenv("SESSION_SCHEDULER_ENABLED", "1") == "1"
+)
+
+# Per-caller token buckets and in-flight caps on hot write endpoints
+app.config["RATE_LIMIT_ENABLED"] = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+app.config["RATE_LIMIT_STORAGE"] = os.getenv("RATE_LIMIT_STORAGE")
+
+# Rotating check-in codes shown by the lecturer; CHECKIN_SECRET must be the
+# same on every host, otherwise a per-host key is kept in the instance folder.
+# Students must enter the code unless CHECKIN_REQUIRE_CODE=0
+app.config["CHECKIN_SECRET"] = os.getenv("CHECKIN_SECRET")
+app.config["CHECKIN_CODE_PERIOD"] = int(os.getenv("CHECKIN_CODE_PERIOD", "30"))
+app.config["CHECKIN_REQUIRE_CODE"] = os.getenv("CHECKIN_REQUIRE_CODE", "1") == "1"
+
+# Read receipts are spooled locally and written to the database in batches
+app.config["READ_RECEIPT_FLUSH_INTERVAL"] = float(
+    os.getenv("READ_RECEIPT_FLUSH_INTERVAL", "1.0")
+)
+app.config["READ_RECEIPT_MAX_PENDING"] = int(
+    os.getenv("READ_RECEIPT_MAX_PENDING", "5000")
+)
+
+# Attendance change feed; recent events are held back until their
+# transactions have surely committed
+app.config["ATTENDANCE_EVENTS_SETTLE_SECONDS"] = float(
+    os.getenv("ATTENDANCE_EVENTS_SETTLE_SECONDS", "2")
+)
+
+# Live pages may hold a request (?wait=) until their data changes;
+# gunicorn.conf.py turns this off for sync workers
+app.config["LONG_POLL_MAX_WAIT"] = float(os.getenv("LONG_POLL_MAX_WAIT", "25"))
+app.config["LONG_POLL_INTERVAL"] = float(os.getenv("LONG_POLL_INTERVAL", "1"))
+
+# Prometheus metrics at /metrics, behind a bearer token if one is set and
+# otherwise only for scrapes from this host
+app.config["METRICS_TOKEN"] = os.getenv("METRICS_TOKEN")
+app.config["METRICS_FLUSH_INTERVAL"] = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+# Admins can profile a single request with ?_profile=1 or an X-Profile: 1 header
+app.config["PROFILING_ENABLED"] = os.getenv("PROFILING_ENABLED", "1") == "1"
+app.config["PROFILE_KEEP"] = int(os.getenv("PROFILE_KEEP", "50"))
+
+# Always-on tracemalloc with per-endpoint peaks; requests that peak above
+# the ceiling are logged
+app.config["MEMORY_TRACKING"] = os.getenv("MEMORY_TRACKING", "0") == "1"
+app.config["MEMORY_CEILING_MB"] = float(os.getenv("MEMORY_CEILING_MB", "0")) or None
+
+# Per-user .ics feeds of class sessions; tokens are signed with
+# CALENDAR_SECRET, or a key generated once in the instance folder
+app.config["CALENDAR_SECRET"] = os.getenv("CALENDAR_SECRET")
+app.config["CALENDAR_PAST_DAYS"] = int(os.getenv("CALENDAR_PAST_DAYS", "30"))
+app.config["CALENDAR_UID_DOMAIN"] = os.getenv("CALENDAR_UID_DOMAIN")
+
+# SESSION_STORE=local keeps session data in a local SQLite file, with only a
+# signed id in the cookie; "cookie" keeps it all in the signed cookie
+app.config["SESSION_STORE"] = os.getenv("SESSION_STORE", "cookie")
+app.config["SESSION_TTL"] = int(os.getenv("SESSION_TTL", str(7 * 24 * 60 * 60)))
+app.config["ROLE_CACHE_TTL"] = int(os.getenv("ROLE_CACHE_TTL", "300"))
+
+# Responses smaller than this are not worth compressing
+app.config["COMPRESS_MIN_SIZE"] = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+
 
 from models import (
     db,
@@ -40,13 +125,61 @@ from models import (
     ClassSession,
     Announcement,
     AnnouncementRead,
+    AttendanceRollup,
+    PurgeJob,
 )
 
+from hashing import hasher, HashingBusy
+from search import search_index, SEARCH_KINDS
+import archive
+from http_cache import http_cache
+from fragment_cache import fragment_cache
+from lifecycle import scheduler
+import attendance_bulk
+import attendance_events
+import listing
+import register
+import exports
+import conflicts
+from ratelimit import limiter
+from checkin import checkin_codes, enrollment_cache
+from dbutil import insert_for
+from purge import purger, job_progress
+from replica import replica
+from metrics import metrics
+from profiling import profiler
+from longpoll import longpoll
+from read_receipts import read_receipts
+from unread import unread_counters
+from overview import student_overview
+from calendar_feed import calendar_feed
+from session_store import session_store
+
 db.init_app(app)
+replica.init_app(app)
+profiler.init_app(app)
+hasher.init_app(app)
+http_cache.init_app(app)
 
 with app.app_context():
     db.create_all()
 
+search_index.init_app(app)
+fragment_cache.init_app(app)
+scheduler.init_app(app)
+limiter.init_app(app)
+checkin_codes.init_app(app)
+enrollment_cache.init_app(app)
+purger.init_app(app)
+longpoll.init_app(app)
+attendance_events.init_app(app)
+metrics.init_app(app)
+read_receipts.init_app(app)
+unread_counters.init_app(app)
+student_overview.init_app(app)
+calendar_feed.init_app(app)
+session_store.init_app(app)
+
 
 def login_required(f):
     @wraps(f)
@@ -63,8 +196,7 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if "user_id" not in session:
             return redirect(url_for("login"))
-        user = User.query.get(session["user_id"])
-        if not user or user.role != "admin":
+        if session_store.role(session["user_id"]) != "admin":
             flash("Access denied. Admin privileges required.", "error")
             return redirect(url_for("dashboard"))
         return f(*args, **kwargs)
@@ -72,6 +204,15 @@ def admin_required(f):
     return decorated_function
 
 
+def busy_response(error):
+    """JSON 503 telling the client when to retry an overloaded operation"""
+    return (
+        jsonify({"success": False, "message": str(error)}),
+        503,
+        {"Retry-After": str(error.retry_after)},
+    )
+
+
 @app.route("/")
 def index():
     if "user_id" in session:
@@ -80,6 +221,23 @@ def index():
 
 
 @app.route("/login", methods=["GET", "POST"])
+# A whole campus can share one NAT address, so the per-address limit only
+# stops floods; guessing at one account is limited wherever it comes from
+@limiter.limit(
+    "login-address",
+    rate=2,
+    burst=100,
+    template="auth/login.html",
+    key_func=lambda: request.remote_addr,
+)
+@limiter.limit(
+    "login",
+    rate=0.2,
+    burst=5,
+    concurrency=8,
+    template="auth/login.html",
+    key_func=lambda: request.form.get("matric_number"),
+)
 def login():
     if request.method == "POST":
         matric_number = request.form["matric_number"]
@@ -87,7 +245,21 @@ def login():
 
         user = User.query.filter_by(matric_number=matric_number).first()
 
-        if user and check_password_hash(user.password, password):
+        try:
+            valid = user is not None and hasher.verify_password(user.password, password)
+        except HashingBusy:
+            flash("Server is busy, please try again in a moment.", "error")
+            return render_template("auth/login.html"), 503
+
+        if valid:
+            # Upgrade the stored hash if the configured cost has changed
+            if hasher.needs_rehash(user.password):
+                try:
+                    user.password = hasher.hash_password(password)
+                    db.session.commit()
+                except HashingBusy:
+                    db.session.rollback()
+
             session["user_id"] = user.id
             session["user_role"] = user.role
             session["user_name"] = user.full_name
@@ -115,10 +287,16 @@ def signup():
             flash("Matric number already exists.", "error")
             return render_template("auth/signup.html")
 
+        try:
+            password_hash = hasher.hash_password(password)
+        except HashingBusy:
+            flash("Server is busy, please try again in a moment.", "error")
+            return render_template("auth/signup.html"), 503
+
         user = User(
             full_name=full_name,
             matric_number=matric_number,
-            password=generate_password_hash(password),
+            password=password_hash,
             role="student",
         )
 
@@ -133,55 +311,44 @@ def signup():
 
 @app.route("/dashboard")
 @login_required
+@replica.reads
 def dashboard():
     user = User.query.get(session["user_id"])
 
     if user.role == "admin":
         return redirect(url_for("admin_dashboard"))
 
-    # Student dashboard data
-    enrollments = Enrollment.query.filter_by(user_id=user.id).all()
-    courses_count = len(enrollments)
-
-    # Calculate average attendance
-    total_classes = 0
-    attended_classes = 0
-
-    for enrollment in enrollments:
-        course_records = AttendanceRecord.query.filter_by(
-            user_id=user.id, course_id=enrollment.course_id
-        ).all()
+    # Same cached payload as /api/me/overview, rendered server-side
+    overview = student_overview.build(user.id)
+    lecturers = {c["id"]: c["lecturer_name"] for c in overview["courses"]}
 
-        total_classes += len(course_records)
-        attended_classes += len([r for r in course_records if r.status == "present"])
-
-    avg_attendance = round(
-        (attended_classes / total_classes * 100) if total_classes > 0 else 0, 1
-    )
-
-    # Get upcoming classes
-    today = datetime.now().date()
-    upcoming_sessions = (
-        ClassSession.query.filter(
-            ClassSession.date >= today,
-            ClassSession.course_id.in_([e.course_id for e in enrollments]),
+    now = datetime.now()
+    upcoming_sessions = []
+    for s in overview["upcoming_sessions"]:
+        start = datetime.strptime(f"{s['date']} {s['start_time']}", "%Y-%m-%d %H:%M")
+        end = datetime.strptime(f"{s['date']} {s['end_time']}", "%Y-%m-%d %H:%M")
+        upcoming_sessions.append(
+            {
+                **s,
+                "lecturer_name": lecturers.get(s["course_id"]),
+                "start": start,
+                "end": end,
+                "is_active": start <= now <= end,
+            }
         )
-        .order_by(ClassSession.date, ClassSession.start_time)
-        .limit(5)
-        .all()
-    )
 
     return render_template(
         "student/dashboard.html",
         user=user,
-        courses_count=courses_count,
-        avg_attendance=avg_attendance,
+        courses_count=len(overview["courses"]),
+        avg_attendance=overview["attendance_rate"],
         upcoming_sessions=upcoming_sessions,
     )
 
 
 @app.route("/admin/dashboard")
 @admin_required
+@replica.reads
 def admin_dashboard():
     user = User.query.get(session["user_id"])
 
@@ -304,8 +471,25 @@ def api_join_course():
         return jsonify({"success": False, "message": str(e)})
 
 
+def _session_running(session_id):
+    """(course_id, is running now) for a class session, or None if there is
+    no such session; cancelled sessions never count as running"""
+    # Today's sessions are answered from the scheduler's index
+    indexed = scheduler.lookup(session_id)
+    if indexed:
+        return indexed
+    class_session = ClassSession.query.get(session_id)
+    if not class_session:
+        return None
+    return (
+        class_session.course_id,
+        class_session.status != "cancelled" and class_session.is_active(),
+    )
+
+
 @app.route("/api/mark-attendance", methods=["POST"])
 @login_required
+@limiter.limit("mark-attendance", rate=0.2, burst=3, concurrency=16)
 def api_mark_attendance():
     try:
         data = request.get_json()
@@ -313,47 +497,65 @@ def api_mark_attendance():
 
         if not session_id:
             return jsonify({"success": False, "message": "Session ID is required"})
+        session_id = int(session_id)
+        code = data.get("code")
+        user_id = session["user_id"]
+
+        if code:
+            # A valid rotating code proves the student is in the room now
+            if not checkin_codes.verify(session_id, code):
+                return jsonify(
+                    {"success": False, "message": "Invalid or expired check-in code"}
+                )
+        elif app.config["CHECKIN_REQUIRE_CODE"]:
+            return jsonify(
+                {
+                    "success": False,
+                    "code_required": True,
+                    "message": "Enter the check-in code shown in class",
+                }
+            )
 
-        class_session = ClassSession.query.get(session_id)
-        if not class_session:
+        found = _session_running(session_id)
+        if found is None:
             return jsonify({"success": False, "message": "Class session not found"})
+        course_id, active = found
 
-        # Check if session is active
-        if not class_session.is_active():
+        # Check if session is active, code or no code
+        if not active:
             return jsonify(
                 {"success": False, "message": "Class session is not currently active"}
             )
 
         # Check if student is enrolled in the course
-        enrollment = Enrollment.query.filter_by(
-            user_id=session["user_id"], course_id=class_session.course_id
-        ).first()
-
-        if not enrollment:
+        if not enrollment_cache.is_enrolled(user_id, course_id):
             return jsonify({"success": False, "message": "Not enrolled in this course"})
 
-        existing_record = AttendanceRecord.query.filter_by(
-            user_id=session["user_id"], class_session_id=session_id
-        ).first()
+        # The unique (user, session) constraint makes retries harmless
+        inserted = db.session.execute(
+            insert_for(AttendanceRecord)
+            .values(
+                user_id=user_id,
+                course_id=course_id,
+                class_session_id=session_id,
+                status="present",
+                timestamp=datetime.utcnow(),
+                marked_by="student",
+            )
+            .on_conflict_do_nothing(index_elements=["user_id", "class_session_id"])
+            .returning(*attendance_events.RETURNED)
+        ).all()
+        attendance_events.log("insert", inserted)
+        db.session.commit()
 
-        if existing_record:
+        if not inserted:
             return jsonify(
                 {
                     "success": False,
                     "message": "Attendance already marked for this session",
                 }
             )
-
-        attendance = AttendanceRecord(
-            user_id=session["user_id"],
-            course_id=class_session.course_id,
-            class_session_id=session_id,
-            status="present",
-            marked_by="student",
-        )
-
-        db.session.add(attendance)
-        db.session.commit()
+        metrics.checkins.inc()
 
         return jsonify({"success": True, "message": "Attendance marked successfully"})
 
@@ -407,22 +609,7 @@ def admin_exports():
 @app.route("/api/courses")
 @login_required
 def api_courses():
-    courses = Course.query.all()
-    return jsonify(
-        {
-            "success": True,
-            "courses": [
-                {
-                    "id": c.id,
-                    "course_code": c.course_code,
-                    "course_title": c.course_title,
-                    "lecturer_name": c.lecturer_name,
-                    "join_code": c.join_code,
-                }
-                for c in courses
-            ],
-        }
-    )
+    return listing.json_response(courses=listing.courses())
 
 
 @app.route("/api/admin/create-course", methods=["POST"])
@@ -461,50 +648,129 @@ def api_admin_create_course():
         return jsonify({"success": False, "message": str(e)})
 
 
+def _new_class_session(data):
+    return ClassSession(
+        course_id=data["course_id"],
+        date=datetime.strptime(data["date"], "%Y-%m-%d").date(),
+        start_time=datetime.strptime(data["start_time"], "%H:%M").time(),
+        end_time=datetime.strptime(data["end_time"], "%H:%M").time(),
+        location=data.get("location", ""),
+        status="scheduled",
+    )
+
+
+def _schedule_conflict_response(e):
+    return jsonify(
+        {
+            "success": False,
+            "message": f"Schedule conflict: {e}",
+            "conflicts": e.conflicts,
+        }
+    )
+
+
 @app.route("/api/admin/schedule-class", methods=["POST"])
 @admin_required
 def api_admin_schedule_class():
     try:
         data = request.get_json()
 
-        session = ClassSession(
-            course_id=data["course_id"],
-            date=datetime.strptime(data["date"], "%Y-%m-%d").date(),
-            start_time=datetime.strptime(data["start_time"], "%H:%M").time(),
-            end_time=datetime.strptime(data["end_time"], "%H:%M").time(),
-            location=data.get("location", ""),
-            status="scheduled",
+        session = _new_class_session(data)
+        conflicts.check(
+            session.course_id,
+            session.date,
+            session.start_time,
+            session.end_time,
+            session.location,
         )
 
         db.session.add(session)
         db.session.commit()
+        scheduler.refresh()
 
         return jsonify({"success": True, "message": "Class scheduled successfully"})
 
+    except conflicts.ScheduleConflict as e:
+        return _schedule_conflict_response(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({"success": False, "message": str(e)})
 
 
+def _export_filters():
+    start_date = request.args.get("start_date")
+    end_date = request.args.get("end_date")
+    return {
+        "course_id": request.args.get("course_id"),
+        "student_id": request.args.get("student_id"),
+        "start_date": (
+            datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None
+        ),
+        "end_date": (
+            datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
+        ),
+        "status": request.args.get("status"),
+    }
+
+
+def _export_filename(extension):
+    course_id = request.args.get("course_id")
+    start_date = request.args.get("start_date")
+    end_date = request.args.get("end_date")
+
+    filename = "attendance_export"
+    if course_id:
+        course = Course.query.get(course_id)
+        filename += f"_{course.course_code}" if course else ""
+    if start_date or end_date:
+        filename += f"_{start_date or 'start'}_to_{end_date or 'end'}"
+    return f"{filename}.{extension}"
+
+
 @app.route("/api/admin/export-attendance")
 @admin_required
+@replica.reads
 def api_admin_export_attendance():
+    """Attendance records as a styled XLSX workbook, or with
+    ?format=csv|ndjson|parquet streamed straight from the database"""
+    export_format = request.args.get("format", "xlsx")
+    if export_format == "xlsx":
+        return _export_attendance_xlsx()
+
+    try:
+        chunks = exports.stream(export_format, **_export_filters())
+        return Response(
+            stream_with_context(chunks),
+            mimetype=exports.MIMETYPES[export_format],
+            headers={
+                "Content-Disposition": f"attachment; filename={_export_filename(export_format)}"
+            },
+        )
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+
+
+# Column widths for the XLSX export. Write-only sheets need them before the
+# first row, so they can't be fitted to the data
+XLSX_COLUMN_WIDTHS = {"A": 12, "B": 13, "C": 32, "D": 28, "E": 16, "F": 10, "G": 13}
+
+
+@metrics.export_seconds.time(format="xlsx")
+def _export_attendance_xlsx():
     try:
         from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
         from openpyxl.styles import Font, PatternFill, Alignment
         from io import BytesIO
 
-        # Get filter parameters
-        course_id = request.args.get("course_id")
-        student_id = request.args.get("student_id")
-        start_date = request.args.get("start_date")
-        end_date = request.args.get("end_date")
-        status_filter = request.args.get("status")
+        filters = _export_filters()
 
-        # Create workbook
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Attendance Report"
+        # Write-only mode streams rows to a temporary file as they are added
+        # instead of keeping a styled cell object for each one
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Attendance Report")
+        for column, width in XLSX_COLUMN_WIDTHS.items():
+            ws.column_dimensions[column].width = width
 
         # Headers
         headers = [
@@ -516,124 +782,275 @@ def api_admin_export_attendance():
             "Status",
             "Time Marked",
         ]
-        ws.append(headers)
-
-        # Style headers
         header_font = Font(bold=True, color="FFFFFF")
         header_fill = PatternFill(
             start_color="366092", end_color="366092", fill_type="solid"
         )
-
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num)
+        header_cells = []
+        for header in headers:
+            cell = WriteOnlyCell(ws, value=header)
             cell.font = header_font
             cell.fill = header_fill
             cell.alignment = Alignment(horizontal="center")
+            header_cells.append(cell)
+        ws.append(header_cells)
+
+        # Live records, then archived terms when the date range reaches back
+        # that far, read in batches from a server-side cursor
+        for batch in exports.batches(**filters):
+            for date, code, title, name, matric, status, timestamp in batch:
+                ws.append(
+                    [
+                        date.strftime("%Y-%m-%d"),
+                        code,
+                        title,
+                        name,
+                        matric,
+                        status.upper(),
+                        timestamp.strftime("%H:%M:%S") if timestamp else "",
+                    ]
+                )
 
-        # Build query with filters
-        query = (
-            db.session.query(AttendanceRecord)
-            .join(User)
-            .join(Course)
-            .join(ClassSession)
+        # Save to memory
+        output = BytesIO()
+        wb.save(output)
+
+        return Response(
+            output.getvalue(),
+            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers={
+                "Content-Disposition": f"attachment; filename={_export_filename('xlsx')}"
+            },
         )
 
-        # Apply filters
-        if course_id:
-            query = query.filter(AttendanceRecord.course_id == course_id)
-        if student_id:
-            query = query.filter(AttendanceRecord.user_id == student_id)
-        if start_date:
-            query = query.filter(
-                ClassSession.date >= datetime.strptime(start_date, "%Y-%m-%d").date()
-            )
-        if end_date:
-            query = query.filter(
-                ClassSession.date <= datetime.strptime(end_date, "%Y-%m-%d").date()
-            )
-        if status_filter:
-            query = query.filter(AttendanceRecord.status == status_filter)
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
 
-        records = query.order_by(ClassSession.date.desc()).all()
 
-        # Add data rows
-        for record in records:
-            ws.append(
-                [
-                    record.class_session.date.strftime("%Y-%m-%d"),
-                    record.course.course_code,
-                    record.course.course_title,
-                    record.user.full_name,
-                    record.user.matric_number,
-                    record.status.upper(),
-                    record.timestamp.strftime("%H:%M:%S"),
-                ]
-            )
+@app.route("/api/admin/export-register")
+@admin_required
+@replica.reads
+def api_admin_export_register():
+    """Students x class sessions attendance grid for one course, by archived
+    term or date range, as a two-sheet XLSX or a CSV of the grid"""
+    try:
+        course_id = request.args.get("course_id", type=int)
+        if not course_id:
+            return jsonify({"success": False, "message": "course_id is required"})
+        export_format = request.args.get("format", "xlsx")
+        if export_format not in ("xlsx", "csv"):
+            return jsonify({"success": False, "message": "format must be xlsx or csv"})
 
-        # Auto-adjust column widths
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = max_length + 2
-            ws.column_dimensions[column].width = adjusted_width
+        start_date = request.args.get("start_date")
+        end_date = request.args.get("end_date")
 
-        # Save to memory
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
+        # Timed by hand: the CSV is still being generated after we return
+        started = time.perf_counter()
+        grid = register.build(
+            course_id,
+            term=request.args.get("term"),
+            start_date=(
+                datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None
+            ),
+            end_date=(
+                datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
+            ),
+        )
 
-        from flask import Response
+        if export_format == "csv":
 
-        filename = "attendance_export"
-        if course_id:
-            course = Course.query.get(course_id)
-            filename += f"_{course.course_code}" if course else ""
-        if start_date or end_date:
-            filename += f"_{start_date or 'start'}_to_{end_date or 'end'}"
-        filename += ".xlsx"
+            def chunks():
+                try:
+                    yield from grid.csv_chunks()
+                finally:
+                    metrics.export_seconds.observe(
+                        time.perf_counter() - started, format="register_csv"
+                    )
+
+            return Response(
+                stream_with_context(chunks()),
+                mimetype="text/csv",
+                headers={
+                    "Content-Disposition": f"attachment; filename={grid.filename('csv')}"
+                },
+            )
 
+        body = grid.to_xlsx()
+        metrics.export_seconds.observe(
+            time.perf_counter() - started, format="register_xlsx"
+        )
         return Response(
-            output.getvalue(),
+            body,
             mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={filename}"},
+            headers={
+                "Content-Disposition": f"attachment; filename={grid.filename('xlsx')}"
+            },
         )
 
     except Exception as e:
         return jsonify({"success": False, "message": str(e)})
 
 
-@app.route("/api/class-sessions", methods=["GET", "POST"])
+@app.route("/api/admin/rate-limits")
 @admin_required
-def api_manage_class_sessions():
+def api_admin_rate_limits():
+    try:
+        return jsonify({"success": True, "endpoints": limiter.counters()})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+
+
+@app.route("/api/admin/profiles")
+@admin_required
+def api_admin_profiles():
+    try:
+        return jsonify({"success": True, "profiles": profiler.recent()})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+
+
+@app.route("/api/admin/profiles/<profile_id>")
+@admin_required
+def api_admin_profile(profile_id):
+    summary = profiler.summary(profile_id)
+    if summary is None:
+        abort(404)
+    return jsonify({"success": True, "profile": summary})
+
+
+@app.route("/api/admin/profiles/<profile_id>/download")
+@admin_required
+def api_admin_profile_download(profile_id):
+    path = profiler.artifact(profile_id)
+    if path is None:
+        abort(404)
+    return send_file(
+        path,
+        mimetype="application/octet-stream",
+        as_attachment=True,
+        download_name=f"{profile_id}.prof",
+    )
+
+
+@app.route("/api/admin/memory")
+@admin_required
+def api_admin_memory():
+    try:
+        return jsonify(
+            {
+                "success": True,
+                "pid": os.getpid(),
+                "tracking": profiler.track_memory,
+                "endpoints": profiler.memory_peaks(),
+            }
+        )
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+
+
+@app.route("/api/admin/archive", methods=["GET", "POST"])
+@admin_required
+def api_admin_archive():
     if request.method == "GET":
         try:
-            sessions = ClassSession.query.order_by(
-                ClassSession.date.desc(), ClassSession.start_time
-            ).all()
+            return jsonify({"success": True, "terms": archive.list_terms()})
+        except Exception as e:
+            return jsonify({"success": False, "message": str(e)})
+
+    try:
+        data = request.get_json()
+
+        result = archive.archive_term(
+            data["term"],
+            datetime.strptime(data["start_date"], "%Y-%m-%d").date(),
+            datetime.strptime(data["end_date"], "%Y-%m-%d").date(),
+        )
+
+        return jsonify(
+            {"success": True, "message": "Term archived successfully", **result}
+        )
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
 
-            sessions_data = []
-            for session in sessions:
-                sessions_data.append(
-                    {
-                        "id": session.id,
-                        "course_id": session.course_id,
-                        "course_code": session.course.course_code,
-                        "course_title": session.course.course_title,
-                        "date": session.date.isoformat(),
-                        "start_time": session.start_time.strftime("%H:%M"),
-                        "end_time": session.end_time.strftime("%H:%M"),
-                        "location": session.location,
-                        "status": session.status,
-                    }
-                )
 
-            return jsonify({"success": True, "sessions": sessions_data})
+@app.route("/api/admin/archive/rollups")
+@admin_required
+@replica.reads
+def api_admin_archive_rollups():
+    try:
+        query = db.session.query(AttendanceRollup, Course.course_code).join(
+            Course, AttendanceRollup.course_id == Course.id
+        )
+
+        term = request.args.get("term")
+        course_id = request.args.get("course_id")
+        student_id = request.args.get("student_id")
+        if term:
+            query = query.filter(AttendanceRollup.term == term)
+        if course_id:
+            query = query.filter(AttendanceRollup.course_id == course_id)
+        if student_id:
+            query = query.filter(AttendanceRollup.user_id == student_id)
+
+        rollups = [
+            {
+                "term": rollup.term,
+                "course_id": rollup.course_id,
+                "course_code": course_code,
+                "user_id": rollup.user_id,
+                "session_count": rollup.session_count,
+                "present_count": rollup.present_count,
+                "absent_count": rollup.absent_count,
+                "attendance_rate": round(
+                    (
+                        rollup.present_count / rollup.session_count * 100
+                        if rollup.session_count
+                        else 0
+                    ),
+                    1,
+                ),
+            }
+            for rollup, course_code in query.order_by(
+                AttendanceRollup.term, AttendanceRollup.course_id
+            )
+        ]
+
+        return jsonify({"success": True, "rollups": rollups})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+
+
+@app.route("/api/admin/schedule-conflicts")
+@admin_required
+@replica.reads
+def api_admin_schedule_conflicts():
+    """Groups of overlapping sessions sharing a room or a course, from today
+    (or ?start_date=) up to ?end_date="""
+    try:
+        start_date = request.args.get("start_date")
+        end_date = request.args.get("end_date")
+        clusters = conflicts.find_all(
+            start_date=(
+                datetime.strptime(start_date, "%Y-%m-%d").date()
+                if start_date
+                else datetime.now().date()
+            ),
+            end_date=(
+                datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
+            ),
+        )
+        return jsonify({"success": True, "count": len(clusters), "conflicts": clusters})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+
+
+@app.route("/api/class-sessions", methods=["GET", "POST"])
+@admin_required
+@replica.reads
+def api_manage_class_sessions():
+    if request.method == "GET":
+        try:
+            return listing.json_response(sessions=listing.class_sessions())
         except Exception as e:
             return jsonify({"success": False, "message": str(e)})
 
@@ -641,21 +1058,32 @@ def api_manage_class_sessions():
         try:
             data = request.get_json()
 
-            session = ClassSession(
-                course_id=data["course_id"],
-                date=datetime.strptime(data["date"], "%Y-%m-%d").date(),
-                start_time=datetime.strptime(data["start_time"], "%H:%M").time(),
-                end_time=datetime.strptime(data["end_time"], "%H:%M").time(),
-                location=data.get("location", ""),
-                status="scheduled",
-            )
+            # A whole timetable can be posted as {"sessions": [...]}; it is
+            # checked against itself and the existing schedule in one pass
+            # and saved only if nothing clashes
+            items = data["sessions"] if "sessions" in data else [data]
+            sessions = [_new_class_session(item) for item in items]
+            index = conflicts.ScheduleIndex.load(s.date for s in sessions)
+            for s in sessions:
+                index.check(s.course_id, s.date, s.start_time, s.end_time, s.location)
 
-            db.session.add(session)
+            db.session.add_all(sessions)
             db.session.commit()
+            scheduler.refresh()
 
+            if "sessions" in data:
+                return jsonify(
+                    {
+                        "success": True,
+                        "message": f"{len(sessions)} class sessions created successfully",
+                        "created": len(sessions),
+                    }
+                )
             return jsonify(
                 {"success": True, "message": "Class session created successfully"}
             )
+        except conflicts.ScheduleConflict as e:
+            return _schedule_conflict_response(e)
         except Exception as e:
             db.session.rollback()
             return jsonify({"success": False, "message": str(e)})
@@ -710,18 +1138,38 @@ def api_manage_class_session(session_id):
             session_obj.location = data.get("location", session_obj.location)
             session_obj.status = data.get("status", session_obj.status)
 
+            if session_obj.status != "cancelled":
+                with db.session.no_autoflush:
+                    conflicts.check(
+                        session_obj.course_id,
+                        session_obj.date,
+                        session_obj.start_time,
+                        session_obj.end_time,
+                        session_obj.location,
+                        exclude=session_obj.id,
+                    )
+
             db.session.commit()
+            scheduler.refresh()
             return jsonify(
                 {"success": True, "message": "Class session updated successfully"}
             )
+        except conflicts.ScheduleConflict as e:
+            db.session.rollback()
+            return _schedule_conflict_response(e)
         except Exception as e:
             db.session.rollback()
             return jsonify({"success": False, "message": str(e)})
 
     elif request.method == "DELETE":
         try:
+            # Removed explicitly so the deletions reach the attendance event log
+            attendance_events.delete_records(
+                AttendanceRecord.class_session_id == session_obj.id
+            )
             db.session.delete(session_obj)
             db.session.commit()
+            scheduler.refresh()
             return jsonify(
                 {"success": True, "message": "Class session deleted successfully"}
             )
@@ -734,31 +1182,19 @@ def api_manage_class_session(session_id):
 @admin_required
 def api_admin_live_attendance(session_id):
     try:
-        session = ClassSession.query.get_or_404(session_id)
-
-        # Get all enrolled students
-        enrollments = Enrollment.query.filter_by(course_id=session.course_id).all()
-        enrolled_students = [e.user for e in enrollments]
-
-        # Get attendance records for this session
-        attendance_records = AttendanceRecord.query.filter_by(
-            class_session_id=session_id
-        ).all()
-        present_students = {
-            r.user_id: r for r in attendance_records if r.status == "present"
-        }
-
-        students_data = []
-        for student in enrolled_students:
-            status = "present" if student.id in present_students else "absent"
-            students_data.append(
-                {
-                    "id": student.id,
-                    "name": student.full_name,
-                    "matric_number": student.matric_number,
-                    "status": status,
-                }
+        # ?since=<version>&wait=<seconds> holds the request until attendance
+        # for this session changes after the version the client already has
+        since = request.args.get("since", type=int)
+        if since is not None:
+            longpoll.wait_for(
+                [("attendance", session_id)],
+                lambda: attendance_events.changed_since(session_id, since),
             )
+        version = attendance_events.latest_id()
+
+        session = ClassSession.query.get_or_404(session_id)
+        students_data = listing.live_roster(session_id, session.course_id)
+        checkin_code, checkin_expires_in = checkin_codes.current(session_id)
 
         return jsonify(
             {
@@ -767,9 +1203,12 @@ def api_admin_live_attendance(session_id):
                     "course_code": session.course.course_code,
                     "course_title": session.course.course_title,
                 },
-                "total_enrolled": len(enrolled_students),
-                "present_count": len(present_students),
+                "total_enrolled": len(students_data),
+                "present_count": listing.present_count(session_id),
                 "students": students_data,
+                "checkin_code": checkin_code,
+                "checkin_expires_in": checkin_expires_in,
+                "version": version,
             }
         )
 
@@ -777,8 +1216,100 @@ def api_admin_live_attendance(session_id):
         return jsonify({"success": False, "message": str(e)})
 
 
+@app.route("/api/attendance/bulk-update", methods=["POST"])
+@admin_required
+def api_attendance_bulk_update():
+    try:
+        data = request.get_json()
+        changed = attendance_bulk.set_status(data.get("record_ids", []), data["status"])
+
+        return jsonify({"success": True, "updated": len(changed), "records": changed})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)})
+
+
+@app.route("/api/attendance/<int:record_id>/toggle", methods=["POST"])
+@admin_required
+def api_attendance_toggle(record_id):
+    try:
+        changed = attendance_bulk.toggle(record_id)
+        if not changed:
+            return jsonify({"success": False, "message": "Attendance record not found"})
+
+        return jsonify(
+            {"success": True, "new_status": changed[0]["status"], "records": changed}
+        )
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)})
+
+
+@app.route("/api/attendance/<int:record_id>", methods=["DELETE"])
+@admin_required
+def api_attendance_delete(record_id):
+    try:
+        removed = attendance_bulk.remove(record_id)
+        if not removed:
+            return jsonify({"success": False, "message": "Attendance record not found"})
+
+        return jsonify({"success": True, "records": removed})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)})
+
+
+@app.route("/api/class-sessions/<int:session_id>/attendance", methods=["POST"])
+@admin_required
+def api_mark_session_attendance(session_id):
+    """Mark every enrolled student present or absent for one session"""
+    try:
+        data = request.get_json()
+        changed = attendance_bulk.mark_session(session_id, data["status"])
+
+        return jsonify({"success": True, "updated": len(changed), "records": changed})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)})
+
+
+@app.route("/api/attendance/events")
+@admin_required
+@replica.reads
+def api_attendance_events():
+    """Attendance changes after the `since` event id, one JSON object per line"""
+    try:
+        since = request.args.get("since", 0, type=int)
+        limit = min(request.args.get("limit", 1000, type=int), 10000)
+        events = attendance_events.stream(
+            since, limit, app.config["ATTENDANCE_EVENTS_SETTLE_SECONDS"]
+        )
+        return Response(stream_with_context(events), mimetype="application/x-ndjson")
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+
+
+@app.route("/api/admin/session/<int:session_id>/checkin-code")
+@admin_required
+def api_admin_checkin_code(session_id):
+    found = _session_running(session_id)
+    if found is None:
+        abort(404)
+
+    try:
+        if not found[1]:
+            return jsonify(
+                {"success": False, "message": "Class session is not currently active"}
+            )
+        code, expires_in = checkin_codes.current(session_id)
+        return jsonify({"success": True, "code": code, "expires_in": expires_in})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+
+
 @app.route("/api/course/<int:course_id>/details")
 @login_required
+@replica.reads
 def api_course_details(course_id):
     try:
         course = Course.query.get_or_404(course_id)
@@ -829,6 +1360,7 @@ def api_course_details(course_id):
 
 @app.route("/api/course/<int:course_id>/weekly-attendance")
 @login_required
+@replica.reads
 def api_course_weekly_attendance(course_id):
     try:
         course = Course.query.get_or_404(course_id)
@@ -908,8 +1440,18 @@ def api_manage_course(course_id):
             return jsonify({"success": False, "message": "Admin access required"})
 
         try:
-            db.session.delete(course)
-            db.session.commit()
+            job = purger.delete("course", course.id)
+            if job:
+                return (
+                    jsonify(
+                        {
+                            "success": True,
+                            "message": "Course deletion started",
+                            "job": job_progress(job),
+                        }
+                    ),
+                    202,
+                )
             return jsonify({"success": True, "message": "Course deleted successfully"})
         except Exception as e:
             db.session.rollback()
@@ -921,27 +1463,9 @@ def api_manage_course(course_id):
 def api_manage_students():
     if request.method == "GET":
         try:
-            course_id = request.args.get("course")
-            if course_id:
-                # Filter students by course enrollment
-                enrollments = Enrollment.query.filter_by(course_id=course_id).all()
-                students = [e.user for e in enrollments]
-            else:
-                students = User.query.filter_by(role="student").all()
-
-            students_data = []
-            for student in students:
-                students_data.append(
-                    {
-                        "id": student.id,
-                        "full_name": student.full_name,
-                        "matric_number": student.matric_number,
-                        "created_at": student.created_at.isoformat(),
-                        "enrollment_count": len(student.enrollments),
-                    }
-                )
-
-            return jsonify({"success": True, "students": students_data})
+            # Filter students by course enrollment if asked
+            course_id = request.args.get("course", type=int)
+            return listing.json_response(students=listing.students(course_id))
         except Exception as e:
             return jsonify({"success": False, "message": str(e)})
 
@@ -958,7 +1482,7 @@ def api_manage_students():
             student = User(
                 full_name=data["full_name"],
                 matric_number=data["matric_number"],
-                password=generate_password_hash(data["password"]),
+                password=hasher.hash_password(data["password"]),
                 role="student",
             )
 
@@ -975,6 +1499,9 @@ def api_manage_students():
 
             db.session.commit()
             return jsonify({"success": True, "message": "Student added successfully"})
+        except HashingBusy as e:
+            db.session.rollback()
+            return busy_response(e)
         except Exception as e:
             db.session.rollback()
             return jsonify({"success": False, "message": str(e)})
@@ -1020,24 +1547,47 @@ def api_manage_student(student_id):
             student.matric_number = data.get("matric_number", student.matric_number)
 
             if "password" in data and data["password"]:
-                student.password = generate_password_hash(data["password"])
+                student.password = hasher.hash_password(data["password"])
 
             db.session.commit()
             return jsonify({"success": True, "message": "Student updated successfully"})
+        except HashingBusy as e:
+            db.session.rollback()
+            return busy_response(e)
         except Exception as e:
             db.session.rollback()
             return jsonify({"success": False, "message": str(e)})
 
     elif request.method == "DELETE":
         try:
-            db.session.delete(student)
-            db.session.commit()
+            job = purger.delete("student", student.id)
+            if job:
+                return (
+                    jsonify(
+                        {
+                            "success": True,
+                            "message": "Student deletion started",
+                            "job": job_progress(job),
+                        }
+                    ),
+                    202,
+                )
             return jsonify({"success": True, "message": "Student deleted successfully"})
         except Exception as e:
             db.session.rollback()
             return jsonify({"success": False, "message": str(e)})
 
 
+@app.route("/api/admin/purge-jobs/<int:job_id>")
+@admin_required
+def api_admin_purge_job(job_id):
+    try:
+        job = PurgeJob.query.get_or_404(job_id)
+        return jsonify({"success": True, "job": job_progress(job)})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+
+
 @app.route("/api/students/<int:student_id>/enrollments")
 @admin_required
 def api_student_enrollments(student_id):
@@ -1187,6 +1737,22 @@ def api_delete_enrollment(student_id, course_id):
         return jsonify({"success": False, "message": str(e)})
 
 
+@app.route("/api/search")
+@admin_required
+def api_search():
+    try:
+        query = request.args.get("q", "").strip()
+        kinds = request.args.get("type")
+        kinds = kinds.split(",") if kinds else SEARCH_KINDS
+        limit = min(request.args.get("limit", 20, type=int), 100)
+
+        results = search_index.search(query, kinds=kinds, limit=limit)
+
+        return jsonify({"success": True, "query": query, "results": results})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+
+
 @app.route("/api/change-password", methods=["POST"])
 @login_required
 def api_change_password():
@@ -1202,15 +1768,18 @@ def api_change_password():
 
         user = User.query.get(session["user_id"])
 
-        if not check_password_hash(user.password, current_password):
+        if not hasher.verify_password(user.password, current_password):
             return jsonify(
                 {"success": False, "message": "Current password is incorrect"}
             )
 
-        user.password = generate_password_hash(new_password)
+        user.password = hasher.hash_password(new_password)
         db.session.commit()
 
         return jsonify({"success": True, "message": "Password changed successfully"})
+    except HashingBusy as e:
+        db.session.rollback()
+        return busy_response(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({"success": False, "message": str(e)})
@@ -1221,54 +1790,25 @@ def api_change_password():
 def api_announcements():
     try:
         user_id = session["user_id"]
-        user = User.query.get(user_id)
+        role = session_store.role(user_id)
 
-        # Get announcements visible to this user
-        if user.role == "admin":
-            announcements = Announcement.query.order_by(
-                Announcement.created_at.desc()
-            ).all()
-        else:
-            # Students see general announcements and course-specific ones
-            enrolled_course_ids = [e.course_id for e in user.enrollments]
-            announcements = (
-                Announcement.query.filter(
-                    db.or_(
-                        Announcement.course_id.is_(None),  # General announcements
-                        Announcement.course_id.in_(
-                            enrolled_course_ids
-                        ),  # Course-specific
-                    )
-                )
-                .order_by(Announcement.created_at.desc())
-                .all()
-            )
+        # Receipts still waiting in the write-behind buffer count as read
+        pending = read_receipts.pending_for(user_id)
+        read_ids = {
+            announcement_id
+            for (announcement_id,) in db.session.query(
+                AnnouncementRead.announcement_id
+            ).filter_by(user_id=user_id)
+        } | pending
 
-        announcements_data = []
-        for announcement in announcements:
-            announcements_data.append(
-                {
-                    "id": announcement.id,
-                    "title": announcement.title,
-                    "content": announcement.content,
-                    "priority": announcement.priority,
-                    "created_at": announcement.created_at.isoformat(),
-                    "author": announcement.author.full_name,
-                    "course_code": (
-                        announcement.course.course_code if announcement.course else None
-                    ),
-                    "is_read": announcement.is_read_by(user_id),
-                }
-            )
+        announcements_data = listing.announcements(user_id, role)
+        for announcement in announcements_data:
+            announcement["is_read"] = announcement["id"] in read_ids
 
-        unread_count = len([a for a in announcements_data if not a["is_read"]])
+        unread_count = unread_counters.count(user_id, pending=pending)
 
-        return jsonify(
-            {
-                "success": True,
-                "announcements": announcements_data,
-                "unread_count": unread_count,
-            }
+        return listing.json_response(
+            announcements=announcements_data, unread_count=unread_count
         )
     except Exception as e:
         return jsonify({"success": False, "message": str(e)})
@@ -1299,24 +1839,78 @@ def api_create_announcement():
         return jsonify({"success": False, "message": str(e)})
 
 
-@app.route("/api/announcements/<int:announcement_id>/read", methods=["POST"])
+@app.route("/api/announcements/unread-count")
 @login_required
-def api_mark_announcement_read(announcement_id):
+def api_unread_announcement_count():
     try:
         user_id = session["user_id"]
 
-        # Check if already marked as read
-        existing = AnnouncementRead.query.filter_by(
-            announcement_id=announcement_id, user_id=user_id
-        ).first()
+        def unread_count():
+            return unread_counters.count(
+                user_id, pending=read_receipts.pending_for(user_id)
+            )
 
-        if not existing:
-            read_record = AnnouncementRead(
-                announcement_id=announcement_id, user_id=user_id
+        # ?unread=<count>&wait=<seconds> holds the request until the count
+        # differs from the one the client already shows: an announcement is
+        # posted or deleted, or the user reads one elsewhere
+        known = request.args.get("unread", type=int)
+        if known is not None:
+            longpoll.wait_for(
+                [("announcements",), ("announcement-reads", user_id)],
+                lambda: unread_count() != known,
             )
-            db.session.add(read_record)
-            db.session.commit()
 
+        return jsonify({"success": True, "unread_count": unread_count()})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)})
+
+
+@app.route("/api/me/overview")
+@login_required
+@replica.reads
+def api_me_overview():
+    """Courses with attendance rates, today's and upcoming sessions and the
+    unread announcement count for the logged-in user"""
+    try:
+        user_id = session["user_id"]
+        unread_count = unread_counters.count(
+            user_id, pending=read_receipts.pending_for(user_id)
+        )
+        return listing.json_response(**student_overview.build(user_id, unread_count))
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)})
+
+
+@app.route("/calendar/<token>.ics")
+@replica.reads
+def calendar_ics(token):
+    """A student's class sessions as an iCalendar feed, for calendar apps to
+    subscribe to; the token in the URL stands in for a login"""
+    user_id = calendar_feed.user_for(token)
+    if user_id is None:
+        abort(404)
+
+    body, etag, last_modified = calendar_feed.build(user_id)
+    response = Response(body or "", mimetype="text/calendar")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    if body is None:
+        response.status_code = 304
+        return response
+    response.last_modified = last_modified
+    return response.make_conditional(request)
+
+
+@app.route("/api/announcements/<int:announcement_id>/read", methods=["POST"])
+@login_required
+@limiter.limit("announcement-read", rate=5, burst=30)
+def api_mark_announcement_read(announcement_id):
+    try:
+        read_receipts.add(announcement_id, session["user_id"])
+        # Other workers see the receipt once it has been flushed
+        longpoll.notify(("announcement-reads", session["user_id"]))
         return jsonify({"success": True, "message": "Announcement marked as read"})
     except Exception as e:
         db.session.rollback()
@@ -1342,15 +1936,22 @@ def api_mark_all_announcements_read():
                 )
             ).all()
 
-        # Mark all as read
-        for announcement in announcements:
-            if not announcement.is_read_by(user_id):
-                read_record = AnnouncementRead(
-                    announcement_id=announcement.id, user_id=user_id
+        # Mark all as read; receipts flushed meanwhile are skipped
+        if announcements:
+            db.session.execute(
+                insert_for(AnnouncementRead)
+                .values(
+                    [
+                        {"announcement_id": announcement.id, "user_id": user_id}
+                        for announcement in announcements
+                    ]
                 )
-                db.session.add(read_record)
+                .on_conflict_do_nothing(index_elements=["announcement_id", "user_id"])
+            )
+        unread_counters.mark_all_read(user_id)
 
         db.session.commit()
+        longpoll.notify(("announcement-reads", user_id))
         return jsonify({"success": True, "message": "All announcements marked as read"})
     except Exception as e:
         db.session.rollback()
@@ -1396,7 +1997,7 @@ if __name__ == "__main__":
                 admin = User(
                     full_name="System Administrator",
                     matric_number="admin@csc",
-                    password=generate_password_hash("admin@csc123"),
+                    password=hasher.hash_password("admin@csc123"),
                     role="admin",
                 )
                 db.session.add(admin)
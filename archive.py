@@ -0,0 +1,254 @@
+"""
+Term archival for attendance data.
+
+Archiving a completed term copies its class sessions and attendance records
+into the archived_* tables, stores per-student rollups and then removes the
+rows from the hot tables, all in one transaction. Everything is done with
+set-based INSERT ... SELECT / DELETE statements so large terms never get
+loaded into Python.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import case, func, insert, select, delete
+
+from calendar_feed import calendar_feed
+from fragment_cache import bump
+from models import (
+    db,
+    User,
+    Course,
+    ClassSession,
+    AttendanceRecord,
+    ArchivedClassSession,
+    ArchivedAttendanceRecord,
+    AttendanceRollup,
+)
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def archive_term(term, start_date, end_date):
+    """Move every session dated within [start_date, end_date] into the archive"""
+    if end_date >= datetime.now().date():
+        raise ArchiveError("Only completed terms can be archived")
+    if start_date > end_date:
+        raise ArchiveError("Start date must be before end date")
+
+    session_ids = select(ClassSession.id).where(
+        ClassSession.date >= start_date, ClassSession.date <= end_date
+    )
+    records_in_term = AttendanceRecord.class_session_id.in_(session_ids)
+
+    try:
+        # Rollups first, while the records are still in the hot table
+        totals = db.session.execute(
+            select(
+                AttendanceRecord.course_id,
+                AttendanceRecord.user_id,
+                func.count(),
+                func.sum(case((AttendanceRecord.status == "present", 1), else_=0)),
+                func.sum(case((AttendanceRecord.status == "absent", 1), else_=0)),
+            )
+            .where(records_in_term)
+            .group_by(AttendanceRecord.course_id, AttendanceRecord.user_id)
+        ).all()
+
+        existing = {
+            (r.course_id, r.user_id): r
+            for r in AttendanceRollup.query.filter_by(term=term).all()
+        }
+        for course_id, user_id, total, present, absent in totals:
+            rollup = existing.get((course_id, user_id))
+            if rollup is None:
+                rollup = AttendanceRollup(
+                    term=term,
+                    course_id=course_id,
+                    user_id=user_id,
+                    session_count=0,
+                    present_count=0,
+                    absent_count=0,
+                )
+                db.session.add(rollup)
+            rollup.session_count += total
+            rollup.present_count += present or 0
+            rollup.absent_count += absent or 0
+
+        db.session.execute(
+            insert(ArchivedClassSession).from_select(
+                [
+                    "id",
+                    "term",
+                    "course_id",
+                    "date",
+                    "start_time",
+                    "end_time",
+                    "location",
+                    "status",
+                    "created_at",
+                ],
+                select(
+                    ClassSession.id,
+                    db.literal(term),
+                    ClassSession.course_id,
+                    ClassSession.date,
+                    ClassSession.start_time,
+                    ClassSession.end_time,
+                    ClassSession.location,
+                    ClassSession.status,
+                    ClassSession.created_at,
+                ).where(ClassSession.id.in_(session_ids)),
+            )
+        )
+        db.session.execute(
+            insert(ArchivedAttendanceRecord).from_select(
+                [
+                    "id",
+                    "term",
+                    "user_id",
+                    "course_id",
+                    "class_session_id",
+                    "status",
+                    "timestamp",
+                    "marked_by",
+                ],
+                select(
+                    AttendanceRecord.id,
+                    db.literal(term),
+                    AttendanceRecord.user_id,
+                    AttendanceRecord.course_id,
+                    AttendanceRecord.class_session_id,
+                    AttendanceRecord.status,
+                    AttendanceRecord.timestamp,
+                    AttendanceRecord.marked_by,
+                ).where(records_in_term),
+            )
+        )
+
+        calendar_feed.touch(
+            *db.session.execute(
+                select(ClassSession.course_id)
+                .where(ClassSession.id.in_(session_ids))
+                .distinct()
+            ).scalars()
+        )
+        records_moved = db.session.execute(
+            delete(AttendanceRecord).where(records_in_term)
+        ).rowcount
+        sessions_moved = db.session.execute(
+            delete(ClassSession).where(
+                ClassSession.date >= start_date, ClassSession.date <= end_date
+            )
+        ).rowcount
+
+        bump("class_session")
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return {
+        "term": term,
+        "sessions_archived": sessions_moved,
+        "records_archived": records_moved,
+        "rollups": len(totals),
+    }
+
+
+def archived_until():
+    """Latest session date held in the archive, or None"""
+    return db.session.query(func.max(ArchivedClassSession.date)).scalar()
+
+
+def list_terms():
+    rows = (
+        db.session.query(
+            ArchivedClassSession.term,
+            func.min(ArchivedClassSession.date),
+            func.max(ArchivedClassSession.date),
+            func.count(ArchivedClassSession.id),
+        )
+        .group_by(ArchivedClassSession.term)
+        .order_by(func.min(ArchivedClassSession.date))
+        .all()
+    )
+    return [
+        {
+            "term": term,
+            "start_date": first.isoformat(),
+            "end_date": last.isoformat(),
+            "session_count": count,
+        }
+        for term, first, last, count in rows
+    ]
+
+
+def export_statement(
+    course_id=None, student_id=None, start_date=None, end_date=None, status=None
+):
+    """SELECT of archived attendance in the attendance export's column order"""
+    query = (
+        select(
+            ArchivedClassSession.date,
+            Course.course_code,
+            Course.course_title,
+            User.full_name,
+            User.matric_number,
+            ArchivedAttendanceRecord.status,
+            ArchivedAttendanceRecord.timestamp,
+        )
+        .join(
+            ArchivedClassSession,
+            ArchivedAttendanceRecord.class_session_id == ArchivedClassSession.id,
+        )
+        .join(User, ArchivedAttendanceRecord.user_id == User.id)
+        .join(Course, ArchivedAttendanceRecord.course_id == Course.id)
+    )
+
+    if course_id:
+        query = query.where(ArchivedAttendanceRecord.course_id == course_id)
+    if student_id:
+        query = query.where(ArchivedAttendanceRecord.user_id == student_id)
+    if start_date:
+        query = query.where(ArchivedClassSession.date >= start_date)
+    if end_date:
+        query = query.where(ArchivedClassSession.date <= end_date)
+    if status:
+        query = query.where(ArchivedAttendanceRecord.status == status)
+
+    return query.order_by(ArchivedClassSession.date.desc())
+
+
+def export_rows(
+    course_id=None, student_id=None, start_date=None, end_date=None, status=None
+):
+    """Archived attendance in the same row layout as the attendance export"""
+    statement = export_statement(
+        course_id=course_id,
+        student_id=student_id,
+        start_date=start_date,
+        end_date=end_date,
+        status=status,
+    )
+    return [
+        [
+            date.strftime("%Y-%m-%d"),
+            course_code,
+            course_title,
+            full_name,
+            matric_number,
+            record_status.upper(),
+            timestamp.strftime("%H:%M:%S"),
+        ]
+        for (
+            date,
+            course_code,
+            course_title,
+            full_name,
+            matric_number,
+            record_status,
+            timestamp,
+        ) in db.session.execute(statement)
+    ]
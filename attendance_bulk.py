@@ -0,0 +1,132 @@
+"""
+Set-based attendance edits for the admin attendance page.
+
+Each operation is a single UPDATE, DELETE or INSERT ... ON CONFLICT
+statement run in one transaction. It returns only the rows it actually
+changed, so the page can patch those rows in place, and logs the same rows
+as attendance events.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import case, delete, select, update
+
+import attendance_events
+from dbutil import insert_for
+from models import db, AttendanceRecord, ClassSession, Enrollment
+
+STATUSES = ("present", "absent")
+
+
+def _rows(rows):
+    return [
+        {
+            "id": row.id,
+            "user_id": row.user_id,
+            "class_session_id": row.class_session_id,
+            "status": row.status,
+            "marked_by": row.marked_by,
+        }
+        for row in rows
+    ]
+
+
+def _check_status(status):
+    if status not in STATUSES:
+        raise ValueError(f"Status must be one of: {', '.join(STATUSES)}")
+
+
+def set_status(record_ids, status):
+    """Set the status of many records; unchanged records are left alone"""
+    _check_status(status)
+    record_ids = [int(i) for i in record_ids]
+    if not record_ids:
+        return []
+
+    result = db.session.execute(
+        update(AttendanceRecord)
+        .where(AttendanceRecord.id.in_(record_ids), AttendanceRecord.status != status)
+        .values(status=status, marked_by="admin")
+        .returning(*attendance_events.RETURNED)
+        .execution_options(synchronize_session=False)
+    ).all()
+    attendance_events.log("update", result)
+    db.session.commit()
+    return _rows(result)
+
+
+def toggle(record_id):
+    result = db.session.execute(
+        update(AttendanceRecord)
+        .where(AttendanceRecord.id == record_id)
+        .values(
+            status=case(
+                (AttendanceRecord.status == "present", "absent"), else_="present"
+            ),
+            marked_by="admin",
+        )
+        .returning(*attendance_events.RETURNED)
+        .execution_options(synchronize_session=False)
+    ).all()
+    attendance_events.log("update", result)
+    db.session.commit()
+    return _rows(result)
+
+
+def remove(record_id):
+    result = db.session.execute(
+        delete(AttendanceRecord)
+        .where(AttendanceRecord.id == record_id)
+        .returning(*attendance_events.RETURNED)
+        .execution_options(synchronize_session=False)
+    ).all()
+    attendance_events.log("delete", result)
+    db.session.commit()
+    return _rows(result)
+
+
+def mark_session(session_id, status):
+    """Give every student enrolled in the session's course the same status"""
+    _check_status(status)
+
+    roster = select(
+        Enrollment.user_id,
+        ClassSession.course_id,
+        ClassSession.id,
+        db.literal(status),
+        db.literal(datetime.utcnow()),
+        db.literal("admin"),
+    ).where(
+        ClassSession.id == session_id, Enrollment.course_id == ClassSession.course_id
+    )
+
+    stmt = insert_for(AttendanceRecord).from_select(
+        [
+            "user_id",
+            "course_id",
+            "class_session_id",
+            "status",
+            "timestamp",
+            "marked_by",
+        ],
+        roster,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "class_session_id"],
+        set_={"status": stmt.excluded.status, "marked_by": stmt.excluded.marked_by},
+        where=AttendanceRecord.status != stmt.excluded.status,
+    ).returning(*attendance_events.RETURNED)
+
+    # Records that already exist are updated by the upsert, the rest inserted
+    existing = set(
+        db.session.execute(
+            select(AttendanceRecord.id).where(
+                AttendanceRecord.class_session_id == session_id
+            )
+        ).scalars()
+    )
+    result = db.session.execute(stmt).all()
+    attendance_events.log("update", [r for r in result if r.id in existing])
+    attendance_events.log("insert", [r for r in result if r.id not in existing])
+    db.session.commit()
+    return _rows(result)
@@ -0,0 +1,154 @@
+"""
+Change log of attendance records for downstream systems.
+
+Every insert, update and delete of an attendance record appends a row to
+attendance_event in the same transaction, carrying the record as it is
+after the change (or as it was, for deletes). Most writers use set-based
+statements with RETURNING and pass the returned rows to log(); ORM writes
+are picked up by a flush hook. Archiving a term moves records rather than
+changing them and is not logged.
+
+Consumers read the log with GET /api/attendance/events?since=<event id>,
+which streams events in id order as NDJSON and is resumed from the last id
+seen. Events younger than ATTENDANCE_EVENTS_SETTLE_SECONDS are held back so
+that a transaction that took an earlier id but commits later is not
+skipped over.
+"""
+
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, func, insert, select
+
+from models import db, AttendanceRecord, AttendanceEvent
+
+RETURNED = (
+    AttendanceRecord.id,
+    AttendanceRecord.user_id,
+    AttendanceRecord.course_id,
+    AttendanceRecord.class_session_id,
+    AttendanceRecord.status,
+    AttendanceRecord.timestamp,
+    AttendanceRecord.marked_by,
+)
+
+PAGE_SIZE = 500
+
+
+def _event(op, row, created_at):
+    return {
+        "op": op,
+        "record_id": row.id,
+        "user_id": row.user_id,
+        "course_id": row.course_id,
+        "class_session_id": row.class_session_id,
+        "status": row.status,
+        "timestamp": row.timestamp,
+        "marked_by": row.marked_by,
+        "created_at": created_at,
+    }
+
+
+def log(op, rows, connection=None):
+    """Append one event per row; rows need the RETURNED columns"""
+    now = datetime.utcnow()
+    events = [_event(op, row, now) for row in rows]
+    if events:
+        (connection or db.session).execute(insert(AttendanceEvent), events)
+
+
+def delete_records(where):
+    """DELETE matching attendance records, logging each one; returns the count"""
+    removed = db.session.execute(
+        delete(AttendanceRecord)
+        .where(where)
+        .returning(*RETURNED)
+        .execution_options(synchronize_session=False)
+    ).all()
+    log("delete", removed)
+    return len(removed)
+
+
+def _after_flush(session, flush_context):
+    changes = []
+    for op, objs in (
+        ("insert", session.new),
+        ("update", session.dirty),
+        ("delete", session.deleted),
+    ):
+        for obj in objs:
+            if isinstance(obj, AttendanceRecord) and (
+                op != "update" or session.is_modified(obj)
+            ):
+                changes.append((op, obj))
+    for op, obj in changes:
+        log(op, [obj], session.connection())
+
+
+def init_app(app):
+    event.listen(db.session, "after_flush", _after_flush)
+
+
+def latest_id():
+    return db.session.query(func.max(AttendanceEvent.id)).scalar() or 0
+
+
+def changed_since(class_session_id, since):
+    """Whether the class session has events after event id `since`"""
+    return db.session.query(
+        select(AttendanceEvent.id)
+        .where(
+            AttendanceEvent.id > since,
+            AttendanceEvent.class_session_id == class_session_id,
+        )
+        .exists()
+    ).scalar()
+
+
+def _as_json(e):
+    return json.dumps(
+        {
+            "id": e.id,
+            "op": e.op,
+            "record_id": e.record_id,
+            "user_id": e.user_id,
+            "course_id": e.course_id,
+            "class_session_id": e.class_session_id,
+            "status": e.status,
+            "timestamp": e.timestamp.isoformat() if e.timestamp else None,
+            "marked_by": e.marked_by,
+            "created_at": e.created_at.isoformat(),
+        }
+    )
+
+
+def stream(since, limit, settle_seconds=0):
+    """NDJSON lines for up to `limit` events after `since`, in id order"""
+    settled = datetime.utcnow() - timedelta(seconds=settle_seconds)
+    # Stop short of the first unsettled event: sending settled events past it
+    # would move the consumer's cursor beyond an id it has not seen yet
+    horizon = db.session.execute(
+        select(func.min(AttendanceEvent.id)).where(
+            AttendanceEvent.id > since, AttendanceEvent.created_at > settled
+        )
+    ).scalar()
+    sent = 0
+    while sent < limit:
+        query = select(AttendanceEvent).where(
+            AttendanceEvent.id > since, AttendanceEvent.created_at <= settled
+        )
+        if horizon is not None:
+            query = query.where(AttendanceEvent.id < horizon)
+        page = (
+            db.session.execute(
+                query.order_by(AttendanceEvent.id).limit(min(PAGE_SIZE, limit - sent))
+            )
+            .scalars()
+            .all()
+        )
+        if not page:
+            break
+        for e in page:
+            yield _as_json(e) + "\n"
+        since = page[-1].id
+        sent += len(page)
@@ -0,0 +1,305 @@
+"""
+iCalendar feed of a student's class sessions.
+
+Each user has a private feed URL, /calendar/<token>.ics, that calendar apps
+subscribe to. The token is an HMAC of the user id, so it is checked without
+touching the database, and it stays valid until CALENDAR_SECRET changes.
+
+The VEVENT lines for a course are built once per course and date window and
+reused until that course's counter in calendar_version moves. The counter
+is bumped after a commit that changes the course or one of its sessions,
+but not by the scheduler's status updates, which don't change the events,
+so one course's edits or classes starting leave every other feed alone. A
+feed request runs one query for the user's enrollments and their counters
+and joins the cached fragments of those courses; courses that miss the
+cache are loaded together in one query. The ETag is derived from the
+enrollments and counters alone, so a calendar app re-checking an unchanged
+feed gets a 304 without a single fragment being looked at.
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from flask import request
+from sqlalchemy import event, func, inspect, literal, select
+
+from checkin import load_or_create_secret
+from dbutil import insert_for
+from models import db, Course, Enrollment, ClassSession, CalendarVersion
+
+# Course columns that show up in the events
+COURSE_FIELDS = ("course_code", "course_title", "lecturer_name")
+TOKEN_LENGTH = 24
+
+# How often calendar apps that honour it should re-check the feed
+REFRESH_INTERVAL = "PT1H"
+
+
+def _escape(text):
+    return (
+        (text or "")
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def _fold(line):
+    """Split a content line into 75-octet pieces, as RFC 5545 requires"""
+    data = line.encode()
+    if len(data) <= 75:
+        return line + "\r\n"
+    pieces = []
+    while data:
+        size = 75 if not pieces else 74
+        # Don't cut a UTF-8 sequence in half
+        while size < len(data) and (data[size] & 0xC0) == 0x80:
+            size -= 1
+        pieces.append(data[:size].decode())
+        data = data[size:]
+    return "\r\n ".join(pieces) + "\r\n"
+
+
+def _stamp(value):
+    return value.strftime("%Y%m%dT%H%M%S")
+
+
+class CalendarFeed:
+    def __init__(self, app=None, max_entries=1024):
+        self.app = None
+        self.max_entries = max_entries
+        self.past_days = 30
+        self.domain = "attendance"
+        self._secret = None
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_entries = app.config.get("CALENDAR_CACHE_SIZE", self.max_entries)
+        self.past_days = app.config.get("CALENDAR_PAST_DAYS", self.past_days)
+        self.domain = app.config.get("CALENDAR_UID_DOMAIN") or self.domain
+        secret = app.config.get("CALENDAR_SECRET")
+        if secret:
+            self._secret = secret.encode()
+        else:
+            self._secret = load_or_create_secret(
+                os.path.join(app.instance_path, "calendar.key")
+            )
+        event.listen(db.session, "after_flush", self._after_flush)
+        event.listen(db.session, "after_commit", self._after_commit)
+        event.listen(db.session, "after_rollback", self._after_rollback)
+        app.jinja_env.globals["calendar_token"] = self.token
+        app.extensions["calendar_feed"] = self
+
+    # Tokens
+
+    def _signature(self, user_id):
+        return hmac.new(
+            self._secret, f"calendar:{user_id}".encode(), hashlib.sha256
+        ).hexdigest()[:TOKEN_LENGTH]
+
+    def token(self, user_id):
+        return f"{user_id}-{self._signature(user_id)}"
+
+    def user_for(self, token):
+        """The user id a feed token was issued to, or None"""
+        user_id, _, signature = (token or "").partition("-")
+        # isdigit() alone accepts digits like "²" that int() rejects
+        if not (user_id.isascii() and user_id.isdigit()):
+            return None
+        if not hmac.compare_digest(self._signature(int(user_id)), signature):
+            return None
+        return int(user_id)
+
+    # Versions
+
+    def _after_flush(self, session, flush_context):
+        changed = set()
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, ClassSession):
+                if obj in session.dirty and not session.is_modified(obj):
+                    continue
+                changed.add(obj.course_id)
+                # A session moved to another course leaves the old one too
+                changed.update(inspect(obj).attrs.course_id.history.deleted)
+            elif isinstance(obj, Course) and obj in session.dirty:
+                attrs = inspect(obj).attrs
+                if any(attrs[f].history.has_changes() for f in COURSE_FIELDS):
+                    changed.add(obj.id)
+        changed.discard(None)
+        if changed:
+            self.touch(*changed, session=session)
+
+    def _after_commit(self, session):
+        course_ids = session.info.pop("calendar_courses", None)
+        if course_ids:
+            # Already committed; a failed bump only delays feed updates
+            try:
+                with db.engine.begin() as conn:
+                    _bump(conn, course_ids)
+            except Exception as e:
+                self.app.logger.warning("Calendar version bump failed: %s", e)
+
+    def _after_rollback(self, session):
+        session.info.pop("calendar_courses", None)
+
+    def touch(self, *course_ids, session=None):
+        """Rebuild these courses' events once the session commits.
+
+        Flushed ORM changes do this automatically; call it after bulk Core
+        statements that change class sessions.
+        """
+        session = session or db.session
+        session.info.setdefault("calendar_courses", set()).update(course_ids)
+
+    # Feed
+
+    def _since(self):
+        return datetime.now().date() - timedelta(days=self.past_days)
+
+    def _courses(self, user_id):
+        """[(course_id, calendar version)] of the user's enrollments"""
+        return [
+            tuple(row)
+            for row in db.session.execute(
+                select(Enrollment.course_id, func.coalesce(CalendarVersion.version, 0))
+                .outerjoin(
+                    CalendarVersion, CalendarVersion.course_id == Enrollment.course_id
+                )
+                .where(Enrollment.user_id == user_id)
+                .order_by(Enrollment.course_id)
+            )
+        ]
+
+    def etag(self, user_id, courses, since):
+        key = repr((user_id, since.isoformat(), courses))
+        return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+    def _events(self, courses, since):
+        """{course_id: (VEVENT text, built at)} for the given
+        (course_id, version) pairs"""
+        versions = dict(courses)
+        found, missing = {}, []
+
+        with self._lock:
+            for course_id, version in courses:
+                fragment = self._fragments.get((course_id, since, version))
+                if fragment is None:
+                    missing.append(course_id)
+                else:
+                    self._fragments.move_to_end((course_id, since, version))
+                    found[course_id] = fragment
+
+        if not missing:
+            return found
+
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        lines = {course_id: [] for course_id in missing}
+        for row in db.session.execute(
+            select(
+                ClassSession.id,
+                ClassSession.course_id,
+                Course.course_code,
+                Course.course_title,
+                Course.lecturer_name,
+                ClassSession.date,
+                ClassSession.start_time,
+                ClassSession.end_time,
+                ClassSession.location,
+                ClassSession.status,
+            )
+            .join(Course, ClassSession.course_id == Course.id)
+            .where(ClassSession.course_id.in_(missing), ClassSession.date >= since)
+            .order_by(ClassSession.date, ClassSession.start_time)
+        ):
+            lines[row.course_id].extend(self._vevent(row, now))
+
+        built = {
+            course_id: ("".join(_fold(line) for line in event_lines), now)
+            for course_id, event_lines in lines.items()
+        }
+        with self._lock:
+            for course_id, fragment in built.items():
+                self._fragments[(course_id, since, versions[course_id])] = fragment
+            while len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+
+        found.update(built)
+        return found
+
+    def _vevent(self, row, now):
+        cancelled = row.status == "cancelled"
+        return [
+            "BEGIN:VEVENT",
+            f"UID:class-session-{row.id}@{self.domain}",
+            f"DTSTAMP:{now.strftime('%Y%m%dT%H%M%SZ')}",
+            f"DTSTART:{_stamp(datetime.combine(row.date, row.start_time))}",
+            f"DTEND:{_stamp(datetime.combine(row.date, row.end_time))}",
+            f"SUMMARY:{_escape(f'{row.course_code}: {row.course_title}')}",
+            f"LOCATION:{_escape(row.location)}",
+            f"DESCRIPTION:{_escape(f'Lecturer: {row.lecturer_name}')}",
+            f"STATUS:{'CANCELLED' if cancelled else 'CONFIRMED'}",
+            "END:VEVENT",
+        ]
+
+    def build(self, user_id):
+        """(ics text, ETag, Last-Modified) for one user's feed, or with a
+        None text when the request's If-None-Match already matches"""
+        since = self._since()
+        courses = self._courses(user_id)
+        etag = self.etag(user_id, courses, since)
+        if request.if_none_match.contains(etag):
+            return None, etag, None
+
+        events = self._events(courses, since)
+        last_modified = max(
+            (built for _, built in events.values()),
+            default=datetime.now(timezone.utc).replace(microsecond=0),
+        )
+        header = [
+            "BEGIN:VCALENDAR",
+            "VERSION:2.0",
+            "PRODID:-//Attendance//Class Sessions//EN",
+            "CALSCALE:GREGORIAN",
+            "METHOD:PUBLISH",
+            "X-WR-CALNAME:Class Sessions",
+            f"REFRESH-INTERVAL;VALUE=DURATION:{REFRESH_INTERVAL}",
+            f"X-PUBLISHED-TTL:{REFRESH_INTERVAL}",
+        ]
+        body = (
+            "".join(_fold(line) for line in header)
+            + "".join(events[course_id][0] for course_id, _ in courses)
+            + "END:VCALENDAR\r\n"
+        )
+        return body, etag, last_modified
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+
+def _bump(conn, course_ids):
+    versions = CalendarVersion.__table__
+    # Only courses that still exist; a deleted course's row went with it
+    stmt = insert_for(CalendarVersion).from_select(
+        ["course_id", "version"],
+        select(Course.id, literal(1)).where(Course.id.in_(sorted(course_ids))),
+    )
+    conn.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["course_id"],
+            set_={"version": versions.c.version + 1},
+        )
+    )
+
+
+calendar_feed = CalendarFeed()
@@ -0,0 +1,175 @@
+"""
+Rotating check-in codes and an in-process enrollment cache.
+
+A check-in code is an HMAC over (session_id, time window), shortened to six
+digits. Admins show the current code in the room. Students send it with
+their check-in, and it is verified without touching the database. Codes
+from the previous window are accepted too, so a code read just before it
+rotates still works.
+
+The enrollment cache keeps the set of enrolled user ids per course. Local
+enrollment writes drop the affected course immediately. Other workers'
+copies expire after ENROLLMENT_CACHE_TTL seconds, and a miss on a copy more
+than a couple of seconds old is re-checked against the database before the
+student is refused.
+"""
+
+import hashlib
+import hmac
+import os
+import secrets
+import struct
+import tempfile
+import threading
+import time
+
+from sqlalchemy import event
+
+from models import db, Enrollment
+
+CODE_DIGITS = 6
+
+
+def load_or_create_secret(path):
+    """Read a secret shared by every worker on this host, creating it once"""
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    secret = secrets.token_bytes(32)
+
+    # Write the whole key under a temporary name and link it into place, so
+    # path only ever appears complete. Linking fails if another worker got
+    # there first, and then its key is the one everybody uses.
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".secret-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(secret)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(temp_path, path)
+        except FileExistsError:
+            with open(path, "rb") as f:
+                return f.read()
+    finally:
+        os.unlink(temp_path)
+    return secret
+
+
+class CheckinCodes:
+    def __init__(self, app=None):
+        self.period = 30
+        self._secret = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.period = app.config.get("CHECKIN_CODE_PERIOD", self.period)
+        secret = app.config.get("CHECKIN_SECRET")
+        if secret:
+            self._secret = secret.encode()
+        else:
+            self._secret = load_or_create_secret(
+                os.path.join(app.instance_path, "checkin.key")
+            )
+        app.extensions["checkin_codes"] = self
+
+    def _window(self, at=None):
+        return int((at or time.time()) // self.period)
+
+    def _code(self, session_id, window):
+        mac = hmac.new(
+            self._secret, struct.pack(">QQ", session_id, window), hashlib.sha256
+        ).digest()
+        # Dynamic truncation, as in HOTP
+        offset = mac[-1] & 0x0F
+        number = struct.unpack(">I", mac[offset : offset + 4])[0] & 0x7FFFFFFF
+        return str(number % 10**CODE_DIGITS).zfill(CODE_DIGITS)
+
+    def current(self, session_id):
+        """(code, seconds until it rotates)"""
+        now = time.time()
+        window = self._window(now)
+        expires_in = int((window + 1) * self.period - now) + 1
+        return self._code(session_id, window), expires_in
+
+    def verify(self, session_id, code):
+        code = str(code or "").strip()
+        window = self._window()
+        return any(
+            hmac.compare_digest(self._code(session_id, w), code)
+            for w in (window, window - 1)
+        )
+
+
+class EnrollmentCache:
+    def __init__(self, app=None):
+        self.ttl = 30
+        self._courses = {}  # course_id -> (user ids, loaded_at)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get("ENROLLMENT_CACHE_TTL", self.ttl)
+        event.listen(db.session, "after_commit", self._after_commit)
+        event.listen(db.session, "after_flush", self._after_flush)
+        event.listen(db.session, "after_rollback", self._after_rollback)
+        app.extensions["enrollment_cache"] = self
+
+    def _after_flush(self, session, flush_context):
+        changed = {
+            obj.course_id
+            for obj in list(session.new) + list(session.deleted)
+            if isinstance(obj, Enrollment)
+        }
+        if changed:
+            session.info.setdefault("enrollment_courses", set()).update(changed)
+
+    def _after_commit(self, session):
+        changed = session.info.pop("enrollment_courses", None)
+        if changed:
+            self.invalidate(*changed)
+
+    def _after_rollback(self, session):
+        session.info.pop("enrollment_courses", None)
+
+    def invalidate(self, *course_ids):
+        with self._lock:
+            if course_ids:
+                for course_id in course_ids:
+                    self._courses.pop(course_id, None)
+            else:
+                self._courses.clear()
+
+    def _load(self, course_id):
+        user_ids = frozenset(
+            user_id
+            for (user_id,) in db.session.query(Enrollment.user_id).filter_by(
+                course_id=course_id
+            )
+        )
+        with self._lock:
+            self._courses[course_id] = (user_ids, time.monotonic())
+        return user_ids
+
+    def is_enrolled(self, user_id, course_id):
+        entry = self._courses.get(course_id)
+        now = time.monotonic()
+        if entry is None or now - entry[1] > self.ttl:
+            return user_id in self._load(course_id)
+        if user_id in entry[0]:
+            return True
+        # Possibly enrolled through another worker since we loaded
+        if now - entry[1] > 2:
+            return user_id in self._load(course_id)
+        return False
+
+
+checkin_codes = CheckinCodes()
+enrollment_cache = EnrollmentCache()
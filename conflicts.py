@@ -0,0 +1,246 @@
+"""
+Class session clash detection.
+
+Two sessions clash when they overlap in time on the same day and share a
+location or a course. Times are half-open, so a class ending at 10:00 and
+the next one starting at 10:00 in the same room is fine. Cancelled
+sessions and sessions without a location never clash on location.
+
+ScheduleIndex keeps, for each (course or location, day), the sessions
+sorted by start time together with the latest end time seen so far, so
+checking a new slot is a dictionary lookup and a binary search. It is
+loaded for just the days being scheduled, in one query, and new sessions
+are added as they are checked, which also catches clashes within a batch.
+
+find_all() goes over every session in a date range once, sorted by
+resource, day and start time, and groups overlapping sessions into
+clusters, instead of comparing every pair.
+"""
+
+from bisect import bisect_left
+from itertools import groupby
+
+from sqlalchemy import or_, select
+
+from models import db, Course, ClassSession
+
+
+class ScheduleConflict(Exception):
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        super().__init__(
+            "; ".join(
+                f"{c['date']} {c['start_time']}-{c['end_time']} clashes with "
+                f"{c['course_code']} ({c['kind']}: {c['resource']})"
+                for c in conflicts
+            )
+        )
+
+
+def normalize_location(location):
+    return " ".join((location or "").split()).casefold() or None
+
+
+def _resources(course_id, location):
+    yield "course", int(course_id)
+    location = normalize_location(location)
+    if location:
+        yield "location", location
+
+
+def _active():
+    return or_(ClassSession.status.is_(None), ClassSession.status != "cancelled")
+
+
+class _Day:
+    """Sessions of one resource on one day, sorted by start time"""
+
+    __slots__ = ("starts", "entries", "reach")
+
+    def __init__(self):
+        self.starts = []
+        self.entries = []
+        # reach[i] is the latest end among entries[: i + 1]
+        self.reach = []
+
+    def add(self, start, end, entry):
+        i = bisect_left(self.starts, start)
+        self.starts.insert(i, start)
+        self.entries.insert(i, (start, end, entry))
+        self.reach.insert(i, max(end, self.reach[i - 1]) if i else end)
+        for j in range(i + 1, len(self.reach)):
+            if self.reach[j] >= self.reach[j - 1]:
+                break
+            self.reach[j] = self.reach[j - 1]
+
+    def overlapping(self, start, end):
+        # Only entries starting before `end` can overlap, and none at or
+        # before a position whose reach is <= `start`
+        j = bisect_left(self.starts, end) - 1
+        found = []
+        while j >= 0 and self.reach[j] > start:
+            if self.entries[j][1] > start:
+                found.append(self.entries[j][2])
+            j -= 1
+        return found
+
+
+class ScheduleIndex:
+    def __init__(self):
+        self._days = {}
+
+    @classmethod
+    def load(cls, dates):
+        """Index of the scheduled sessions on the given days"""
+        index = cls()
+        dates = sorted(set(dates))
+        if not dates:
+            return index
+        for row in db.session.execute(
+            select(
+                ClassSession.id,
+                ClassSession.course_id,
+                Course.course_code,
+                ClassSession.date,
+                ClassSession.start_time,
+                ClassSession.end_time,
+                ClassSession.location,
+            )
+            .join(Course, ClassSession.course_id == Course.id)
+            .where(ClassSession.date.in_(dates), _active())
+        ):
+            index.add(row._asdict())
+        return index
+
+    def add(self, session):
+        for resource in _resources(session["course_id"], session["location"]):
+            day = self._days.setdefault((resource, session["date"]), _Day())
+            day.add(session["start_time"], session["end_time"], session)
+
+    def conflicts(self, course_id, date, start_time, end_time, location, exclude=None):
+        """Indexed sessions that would clash with this slot"""
+        found = []
+        for kind, resource in _resources(course_id, location):
+            day = self._days.get(((kind, resource), date))
+            if day is None:
+                continue
+            for other in day.overlapping(start_time, end_time):
+                if other.get("id") is not None and other["id"] == exclude:
+                    continue
+                found.append(_describe(kind, resource, other))
+        return found
+
+    def check(self, course_id, date, start_time, end_time, location, exclude=None):
+        """Raise ScheduleConflict if the slot clashes, else index it"""
+        if end_time <= start_time:
+            raise ValueError("End time must be after start time")
+        found = self.conflicts(
+            course_id, date, start_time, end_time, location, exclude=exclude
+        )
+        if found:
+            raise ScheduleConflict(found)
+        self.add(
+            {
+                "id": None,
+                "course_id": course_id,
+                "course_code": None,
+                "date": date,
+                "start_time": start_time,
+                "end_time": end_time,
+                "location": location,
+            }
+        )
+
+
+def _describe(kind, resource, session):
+    return {
+        "kind": kind,
+        "resource": (
+            session["course_code"] or resource if kind == "course" else resource
+        ),
+        "session_id": session["id"],
+        "course_code": session["course_code"] or "another session in this batch",
+        "date": session["date"].isoformat(),
+        "start_time": session["start_time"].strftime("%H:%M"),
+        "end_time": session["end_time"].strftime("%H:%M"),
+    }
+
+
+def check(course_id, date, start_time, end_time, location, exclude=None):
+    """Raise ScheduleConflict if a single new or moved session would clash"""
+    ScheduleIndex.load([date]).check(
+        course_id, date, start_time, end_time, location, exclude=exclude
+    )
+
+
+def find_all(start_date=None, end_date=None):
+    """Clusters of overlapping sessions that share a location or a course"""
+    query = (
+        select(
+            ClassSession.id,
+            ClassSession.course_id,
+            Course.course_code,
+            ClassSession.date,
+            ClassSession.start_time,
+            ClassSession.end_time,
+            ClassSession.location,
+        )
+        .join(Course, ClassSession.course_id == Course.id)
+        .where(_active())
+    )
+    if start_date:
+        query = query.where(ClassSession.date >= start_date)
+    if end_date:
+        query = query.where(ClassSession.date <= end_date)
+    rows = [row._asdict() for row in db.session.execute(query)]
+
+    keyed = sorted(
+        (
+            (kind, resource, row["date"], row["start_time"], row["id"]),
+            row,
+        )
+        for row in rows
+        for kind, resource in _resources(row["course_id"], row["location"])
+    )
+
+    clusters = []
+    for (kind, _, date), group in groupby(keyed, key=lambda k: k[0][:3]):
+        cluster, reach = [], None
+        for _, row in group:
+            if cluster and row["start_time"] >= reach:
+                if len(cluster) > 1:
+                    clusters.append(_cluster(kind, date, cluster))
+                cluster = []
+            if not cluster:
+                reach = row["end_time"]
+            cluster.append(row)
+            reach = max(reach, row["end_time"])
+        if len(cluster) > 1:
+            clusters.append(_cluster(kind, date, cluster))
+
+    clusters.sort(key=lambda c: (c["date"], c["start_time"], c["kind"]))
+    return clusters
+
+
+def _cluster(kind, date, sessions):
+    return {
+        "kind": kind,
+        "resource": (
+            sessions[0]["location"].strip()
+            if kind == "location"
+            else sessions[0]["course_code"]
+        ),
+        "date": date.isoformat(),
+        "start_time": sessions[0]["start_time"].strftime("%H:%M"),
+        "end_time": max(s["end_time"] for s in sessions).strftime("%H:%M"),
+        "sessions": [
+            {
+                "id": s["id"],
+                "course_code": s["course_code"],
+                "start_time": s["start_time"].strftime("%H:%M"),
+                "end_time": s["end_time"].strftime("%H:%M"),
+                "location": s["location"],
+            }
+            for s in sessions
+        ],
+    }
@@ -0,0 +1,219 @@
+"""
+Streaming attendance exports: CSV, NDJSON and Parquet.
+
+These take the same filters as the XLSX attendance export (course_id,
+student_id, start_date, end_date, status) and include archived terms the
+same way, but never hold the whole result. Rows are read from a
+server-side cursor YIELD_PER at a time, and each batch is encoded and sent
+before the next one is fetched, so memory use stays flat however many
+records match.
+
+The columns are meant for loading into other tools rather than for
+reading: snake_case names, lower-case statuses and the full time the
+record was marked. Parquet output needs the optional pyarrow package;
+each batch becomes one row group.
+"""
+
+import csv
+import io
+import json
+
+from sqlalchemy import select
+
+import archive
+from metrics import metrics
+from models import db, User, Course, ClassSession, AttendanceRecord
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+YIELD_PER = 2000
+
+COLUMNS = (
+    "date",
+    "course_code",
+    "course_title",
+    "student_name",
+    "matric_number",
+    "status",
+    "marked_at",
+)
+
+MIMETYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class ExportError(Exception):
+    pass
+
+
+def _statements(course_id, student_id, start_date, end_date, status):
+    query = (
+        select(
+            ClassSession.date,
+            Course.course_code,
+            Course.course_title,
+            User.full_name,
+            User.matric_number,
+            AttendanceRecord.status,
+            AttendanceRecord.timestamp,
+        )
+        .join(ClassSession, AttendanceRecord.class_session_id == ClassSession.id)
+        .join(User, AttendanceRecord.user_id == User.id)
+        .join(Course, AttendanceRecord.course_id == Course.id)
+    )
+    if course_id:
+        query = query.where(AttendanceRecord.course_id == course_id)
+    if student_id:
+        query = query.where(AttendanceRecord.user_id == student_id)
+    if start_date:
+        query = query.where(ClassSession.date >= start_date)
+    if end_date:
+        query = query.where(ClassSession.date <= end_date)
+    if status:
+        query = query.where(AttendanceRecord.status == status)
+    yield query.order_by(ClassSession.date.desc())
+
+    # Archived terms only when the date range reaches back that far
+    archive_end = archive.archived_until()
+    if archive_end and (not start_date or start_date <= archive_end):
+        yield archive.export_statement(
+            course_id=course_id,
+            student_id=student_id,
+            start_date=start_date,
+            end_date=end_date,
+            status=status,
+        )
+
+
+def batches(
+    course_id=None, student_id=None, start_date=None, end_date=None, status=None
+):
+    """Lists of up to YIELD_PER rows, in the COLUMNS order"""
+    for statement in _statements(course_id, student_id, start_date, end_date, status):
+        result = db.session.execute(statement.execution_options(yield_per=YIELD_PER))
+        for partition in result.partitions():
+            yield partition
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for batch in batches:
+        writer.writerows(
+            (date.isoformat(), code, title, name, matric, status, _iso(marked_at))
+            for date, code, title, name, matric, status, marked_at in batch
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(batches):
+    for batch in batches:
+        yield "".join(
+            json.dumps(
+                {
+                    "date": date.isoformat(),
+                    "course_code": code,
+                    "course_title": title,
+                    "student_name": name,
+                    "matric_number": matric,
+                    "status": status,
+                    "marked_at": _iso(marked_at),
+                }
+            )
+            + "\n"
+            for date, code, title, name, matric, status, marked_at in batch
+        )
+
+
+class _Sink:
+    """Write-only file that hands over what has been written so far.
+
+    tell() keeps counting across take() calls, since the Parquet footer
+    records byte offsets from the start of the file.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def parquet_chunks(batches):
+    schema = pa.schema(
+        [
+            ("date", pa.date32()),
+            ("course_code", pa.string()),
+            ("course_title", pa.string()),
+            ("student_name", pa.string()),
+            ("matric_number", pa.string()),
+            ("status", pa.string()),
+            ("marked_at", pa.timestamp("us")),
+        ]
+    )
+    sink = _Sink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    for batch in batches:
+        writer.write_table(
+            pa.Table.from_arrays(
+                [
+                    pa.array(column, type=field.type)
+                    for column, field in zip(zip(*batch), schema)
+                ],
+                schema=schema,
+            )
+        )
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+ENCODERS = {"csv": csv_chunks, "ndjson": ndjson_chunks, "parquet": parquet_chunks}
+
+
+def stream(export_format, **filters):
+    """Chunks of the export in `export_format`, fetched as they are sent"""
+    if export_format not in MIMETYPES:
+        raise ExportError(f"Unsupported export format: {export_format}")
+    if export_format == "parquet" and pq is None:
+        raise ExportError("Parquet export needs the pyarrow package")
+    return _timed(ENCODERS[export_format](batches(**filters)), export_format)
+
+
+def _timed(chunks, export_format):
+    with metrics.export_seconds.time(format=export_format):
+        yield from chunks
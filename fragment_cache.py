@@ -0,0 +1,157 @@
+"""
+Template fragment cache.
+
+Expensive template sections are wrapped in a call block:
+
+    {% call cached('course-card', course.id) %} ... {% endcall %}
+
+and rendered at most once per combination of key and data version. Each
+tracked table has a counter in model_version that is bumped once a write to
+it has been committed, so a fragment is reused until something it depends
+on changes, across all workers. The bump runs in its own short transaction
+after the commit, so writers never hold a lock on the shared counter rows.
+A fragment rendered between the commit and the bump is stored under the old
+versions and simply not used again. Reading the counters costs a single
+query per request.
+"""
+
+import threading
+from collections import OrderedDict
+
+from flask import g, has_app_context
+from markupsafe import Markup
+from sqlalchemy import event, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, ModelVersion
+
+# Tables whose contents show up in cached fragments. Every admin fragment
+# reads all three: session and course details, enrollment counts and
+# session counts.
+TRACKED_TABLES = ("course", "class_session", "enrollment")
+
+# Deleting one of these also removes tracked rows through ON DELETE CASCADE,
+# which the session never sees
+CASCADES = {"user": ("enrollment",), "course": ("class_session", "enrollment")}
+
+
+class FragmentCache:
+    def __init__(self, app=None, max_entries=4096):
+        self.app = None
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_entries = app.config.get("FRAGMENT_CACHE_SIZE", self.max_entries)
+
+        with app.app_context():
+            existing = {v.table_name for v in ModelVersion.query.all()}
+            for table in TRACKED_TABLES:
+                if table not in existing:
+                    db.session.add(ModelVersion(table_name=table, version=0))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Another worker seeded the rows first
+                db.session.rollback()
+
+        event.listen(db.session, "after_flush", self._after_flush)
+        event.listen(db.session, "after_commit", self._after_commit)
+        event.listen(db.session, "after_rollback", self._after_rollback)
+        app.jinja_env.globals["cached"] = self.cached
+        app.extensions["fragment_cache"] = self
+
+    # Versions
+
+    def _after_flush(self, session, flush_context):
+        tables = set()
+        for obj in session.new:
+            tables.add(getattr(obj, "__tablename__", None))
+        for obj in session.deleted:
+            table = getattr(obj, "__tablename__", None)
+            tables.add(table)
+            tables.update(CASCADES.get(table, ()))
+        for obj in session.dirty:
+            if session.is_modified(obj):
+                tables.add(getattr(obj, "__tablename__", None))
+        tables.intersection_update(TRACKED_TABLES)
+        if tables:
+            session.info.setdefault("bump_tables", set()).update(tables)
+
+    def _after_commit(self, session):
+        tables = session.info.pop("bump_tables", None)
+        if tables:
+            # The data is committed already; a failed bump only leaves
+            # fragments stale, so don't fail the request over it
+            try:
+                with db.engine.begin() as conn:
+                    _bump(conn, tables)
+            except Exception as e:
+                self.app.logger.warning("Fragment version bump failed: %s", e)
+
+    def _after_rollback(self, session):
+        session.info.pop("bump_tables", None)
+
+    def versions(self):
+        if "model_versions" not in g:
+            g.model_versions = dict(
+                db.session.query(ModelVersion.table_name, ModelVersion.version)
+            )
+        return g.model_versions
+
+    # Cache
+
+    def cached(self, name, *key_parts, depends=TRACKED_TABLES, caller=None):
+        versions = self.versions()
+        key = (name, key_parts, tuple(versions.get(t, 0) for t in depends))
+
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return Markup(html)
+            self.misses += 1
+
+        html = str(caller())
+
+        with self._lock:
+            self._entries[key] = html
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return Markup(html)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def bump(*tables, session=None):
+    """Invalidate fragments built from these tables.
+
+    The ORM does this automatically on flush; call it directly after bulk
+    Core statements that bypass the session's unit of work. Like the
+    automatic bumps it takes effect once the session commits.
+    """
+    (session or db.session).info.setdefault("bump_tables", set()).update(tables)
+
+
+def _bump(conn, tables):
+    versions = ModelVersion.__table__
+    conn.execute(
+        update(versions)
+        .where(versions.c.table_name.in_(sorted(tables)))
+        .values(version=versions.c.version + 1)
+    )
+    if has_app_context():
+        g.pop("model_versions", None)
+
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,70 @@
+"""
+Gunicorn settings, picked up automatically by `gunicorn app:app`.
+
+GUNICORN_WORKER_CLASS (or -k on the command line, which wins) chooses how
+a worker serves concurrent requests:
+
+- gthread (default): GUNICORN_THREADS requests at once per worker; idle
+  keep-alive connections wait in a selector without holding a thread
+- gevent: a greenlet per connection, up to GUNICORN_WORKER_CONNECTIONS per
+  worker, so held long polls cost a few kilobytes each. psycopg2 is made
+  to yield to other greenlets while it waits on PostgreSQL
+- sync: one request at a time per worker, with long polling switched off
+
+The hooks look at the class each worker actually runs, not at this file's
+default, so `gunicorn -k sync --threads 1 app:app` switches long polling
+off as well. (Gunicorn itself runs -k sync as gthread whenever threads is
+above 1, and long polling stays on for those.)
+"""
+
+import os
+import sys
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# Gunicorn would run sync as gthread with more than one thread
+threads = int(os.getenv("GUNICORN_THREADS", "1" if worker_class == "sync" else "32"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "5000"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+
+def post_fork(server, worker):
+    from gunicorn.workers.sync import SyncWorker
+
+    if isinstance(worker, SyncWorker):
+        _disable_long_polling()
+    elif type(worker).__module__ == "gunicorn.workers.ggevent":
+        _make_psycopg2_cooperative()
+
+
+def _disable_long_polling():
+    # A held request would block the whole worker. The app reads this when
+    # it is loaded, which is after the fork unless preload_app is set
+    os.environ["LONG_POLL_MAX_WAIT"] = "0"
+    longpoll = sys.modules.get("longpoll")
+    if longpoll is not None:
+        longpoll.longpoll.max_wait = 0.0
+
+
+def _make_psycopg2_cooperative():
+    try:
+        import psycopg2
+        from psycopg2 import extensions
+    except ImportError:
+        return
+    from gevent.socket import wait_read, wait_write
+
+    def wait(conn, timeout=None):
+        while True:
+            state = conn.poll()
+            if state == extensions.POLL_OK:
+                break
+            elif state == extensions.POLL_READ:
+                wait_read(conn.fileno(), timeout=timeout)
+            elif state == extensions.POLL_WRITE:
+                wait_write(conn.fileno(), timeout=timeout)
+            else:
+                raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+    extensions.set_wait_callback(wait)
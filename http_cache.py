@@ -0,0 +1,178 @@
+"""
+Response compression, ETags and static asset fingerprinting.
+
+- Text responses above COMPRESS_MIN_SIZE are gzip (or brotli, when the
+  brotli package is installed) encoded for clients that accept it.
+- JSON GET responses carry a weak ETag so unchanged payloads come back as
+  304 Not Modified.
+- url_for('static', ...) appends a content hash, and fingerprinted asset
+  requests are served with a one year immutable Cache-Control.
+"""
+
+import gzip
+import hashlib
+import os
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "application/x-ndjson",
+    "text/css",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+    "text/calendar",
+    "text/csv",
+    "image/svg+xml",
+}
+
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class HttpCache:
+    def __init__(self, app=None):
+        self.min_size = 1024
+        self.gzip_level = 6
+        self._asset_hashes = {}
+        self._compressed_assets = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.min_size = app.config.get("COMPRESS_MIN_SIZE", self.min_size)
+        self.gzip_level = app.config.get("COMPRESS_LEVEL", self.gzip_level)
+        self.static_folder = app.static_folder
+
+        app.url_defaults(self._fingerprint_static_url)
+        app.after_request(self._after_request)
+        app.extensions["http_cache"] = self
+
+    # Static fingerprinting
+
+    def asset_hash(self, filename):
+        path = os.path.join(self.static_folder, filename)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        cached = self._asset_hashes.get(filename)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:12]
+        self._asset_hashes[filename] = (mtime, digest)
+        return digest
+
+    def _fingerprint_static_url(self, endpoint, values):
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            digest = self.asset_hash(values["filename"])
+            if digest:
+                values["v"] = digest
+
+    # Response processing
+
+    def _choose_encoding(self):
+        accepted = request.accept_encodings
+        if brotli is not None and accepted["br"]:
+            return "br"
+        if accepted["gzip"]:
+            return "gzip"
+        return None
+
+    def _compress(self, data, encoding):
+        if encoding == "br":
+            return brotli.compress(data)
+        return gzip.compress(data, compresslevel=self.gzip_level)
+
+    def _after_request(self, response):
+        if request.endpoint == "static":
+            return self._static_response(response)
+
+        if (
+            response.direct_passthrough
+            or response.is_streamed
+            or response.status_code != 200
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+
+        if response.mimetype == "application/json" and request.method in (
+            "GET",
+            "HEAD",
+        ):
+            response.add_etag(weak=True)
+            response.headers["Cache-Control"] = "private, no-cache"
+            response.make_conditional(request)
+            if response.status_code == 304:
+                return response
+
+        if response.mimetype in COMPRESSIBLE_TYPES:
+            self._compress_response(response)
+
+        return response
+
+    def _compress_response(self, response):
+        response.vary.add("Accept-Encoding")
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return
+
+        encoding = self._choose_encoding()
+        if not encoding:
+            return
+
+        response.set_data(self._compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+
+    def _static_response(self, response):
+        filename = request.view_args.get("filename", "")
+        version = request.args.get("v")
+
+        if response.status_code == 200 and version:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_MAX_AGE
+            response.cache_control.immutable = True
+            response.expires = None
+
+        if response.status_code != 200 or response.mimetype not in COMPRESSIBLE_TYPES:
+            return response
+
+        digest = self.asset_hash(filename)
+        encoding = self._choose_encoding()
+        response.vary.add("Accept-Encoding")
+        if not digest or not encoding:
+            return response
+
+        # Assets only change on deploy, so compress each version once
+        key = (filename, digest, encoding)
+        body = self._compressed_assets.get(key)
+        if body is None:
+            with open(os.path.join(self.static_folder, filename), "rb") as f:
+                data = f.read()
+            if len(data) < self.min_size:
+                return response
+            body = self._compress(data, encoding)
+            self._compressed_assets[key] = body
+
+        etag, _ = response.get_etag()
+        if hasattr(response.response, "close"):
+            response.response.close()
+        response.direct_passthrough = False
+        response.set_data(body)
+        if etag:
+            response.set_etag(etag, weak=True)
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+
+http_cache = HttpCache()
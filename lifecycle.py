@@ -0,0 +1,231 @@
+"""
+Class session lifecycle scheduler.
+
+A background thread in each worker keeps an index of today's sessions and
+the set of sessions that are active right now. It wakes up at the next
+start or end boundary (or every SESSION_SCHEDULER_INTERVAL seconds to pick
+up edits), moves class_session.status along scheduled -> active ->
+completed with set-based UPDATEs, and swaps in a fresh active set. Request
+handlers then answer "is this session running?" with a dictionary lookup.
+
+Edits made on another worker are noticed within a couple of seconds: a
+lookup compares the class_session counter with the one the index was built
+from, and when the index is older falls back to the database and wakes the
+thread to reload. The counter is read at most once per
+SESSION_SCHEDULER_CHECK_INTERVAL seconds per worker, unless the request has
+already read it for the fragment cache. Edits made in this worker reload
+the index straight away.
+"""
+
+import threading
+import time
+from datetime import datetime
+
+from flask import g, has_app_context
+from sqlalchemy import and_, or_, update
+
+from fragment_cache import bump, fragment_cache
+from models import db, ClassSession, ModelVersion
+
+
+class SessionScheduler:
+    def __init__(self, app=None):
+        self.app = None
+        self.interval = 30
+        self.check_interval = 2
+        self._checked_at = 0.0
+        self._sessions = {}  # id -> (course_id, start, end, status)
+        self._active = frozenset()
+        self._active_by_course = {}
+        self._loaded_for = None  # (date, class_session version)
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get("SESSION_SCHEDULER_INTERVAL", self.interval)
+        self.check_interval = app.config.get(
+            "SESSION_SCHEDULER_CHECK_INTERVAL", self.check_interval
+        )
+        app.jinja_env.globals["session_is_active"] = self.session_is_active
+        app.extensions["session_scheduler"] = self
+
+        if app.config.get("SESSION_SCHEDULER_ENABLED", True):
+            self.start()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="session-scheduler", daemon=True
+            )
+            self._thread.start()
+
+    def refresh(self):
+        """Reload the index soon, e.g. after a session has been edited"""
+        self._loaded_for = None
+        self._wakeup.set()
+
+    # Background loop
+
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    delay = self.tick()
+                    db.session.remove()
+            except Exception as e:
+                self.app.logger.warning("Session scheduler tick failed: %s", e)
+                delay = self.interval
+            self._wakeup.wait(timeout=delay)
+            self._wakeup.clear()
+
+    def tick(self, now=None):
+        """Apply due transitions; return seconds until the next boundary"""
+        now = now or datetime.now()
+        self._apply_transitions(now)
+        self._load(now)
+
+        active = set()
+        active_by_course = {}
+        next_boundary = None
+        for session_id, (course_id, start, end, status) in self._sessions.items():
+            if status == "cancelled":
+                continue
+            if start <= now <= end:
+                active.add(session_id)
+                active_by_course.setdefault(course_id, set()).add(session_id)
+            for boundary in (start, end):
+                if boundary > now and (
+                    next_boundary is None or boundary < next_boundary
+                ):
+                    next_boundary = boundary
+
+        with self._lock:
+            self._active = frozenset(active)
+            self._active_by_course = {
+                course_id: frozenset(ids) for course_id, ids in active_by_course.items()
+            }
+
+        delay = self.interval
+        if next_boundary is not None:
+            # is_active() treats the end minute as inclusive, so wake just after
+            delay = min(delay, (next_boundary - now).total_seconds() + 0.5)
+        return max(delay, 0.5)
+
+    def _apply_transitions(self, now):
+        today = now.date()
+        current_time = now.time()
+
+        started = db.session.execute(
+            update(ClassSession.__table__)
+            .where(
+                ClassSession.status == "scheduled",
+                ClassSession.date == today,
+                ClassSession.start_time <= current_time,
+                ClassSession.end_time >= current_time,
+            )
+            .values(status="active")
+        ).rowcount
+        finished = db.session.execute(
+            update(ClassSession.__table__)
+            .where(
+                ClassSession.status.in_(["scheduled", "active"]),
+                or_(
+                    ClassSession.date < today,
+                    and_(
+                        ClassSession.date == today,
+                        ClassSession.end_time < current_time,
+                    ),
+                ),
+            )
+            .values(status="completed")
+        ).rowcount
+
+        if started or finished:
+            bump("class_session")
+        db.session.commit()
+
+    def _load(self, now):
+        version = (
+            db.session.query(ModelVersion.version)
+            .filter_by(table_name="class_session")
+            .scalar()
+        )
+        key = (now.date(), version)
+        if key == self._loaded_for:
+            return
+
+        rows = db.session.query(
+            ClassSession.id,
+            ClassSession.course_id,
+            ClassSession.date,
+            ClassSession.start_time,
+            ClassSession.end_time,
+            ClassSession.status,
+        ).filter(ClassSession.date == now.date())
+
+        self._sessions = {
+            session_id: (
+                course_id,
+                datetime.combine(date, start_time),
+                datetime.combine(date, end_time),
+                status,
+            )
+            for session_id, course_id, date, start_time, end_time, status in rows
+        }
+        self._loaded_for = key
+
+    # Lookups
+
+    @property
+    def running(self):
+        return self._loaded_for is not None
+
+    def _current(self):
+        loaded_for = self._loaded_for
+        if loaded_for is None:
+            return False
+        if has_app_context():
+            # Free once the request has read the counters; otherwise a query,
+            # so only every check_interval seconds
+            checked = time.monotonic()
+            if (
+                "model_versions" not in g
+                and checked - self._checked_at < self.check_interval
+            ):
+                return True
+            self._checked_at = checked
+            version = fragment_cache.versions().get("class_session")
+            # A lagging replica can report an older counter; only a newer one
+            # means the index is stale
+            if version is not None and version > loaded_for[1]:
+                self.refresh()
+                return False
+        return True
+
+    def lookup(self, session_id):
+        """(course_id, is_active) for one of today's sessions, else None"""
+        if not self._current():
+            return None
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        return entry[0], session_id in self._active
+
+    def active_sessions(self, course_id=None):
+        if course_id is None:
+            return self._active
+        return self._active_by_course.get(course_id, frozenset())
+
+    def session_is_active(self, session):
+        """Template helper: index lookup with a fallback to the model"""
+        found = self.lookup(session.id)
+        if found is None:
+            return session.is_active()
+        return found[1]
+
+
+scheduler = SessionScheduler()
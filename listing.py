@@ -0,0 +1,167 @@
+"""
+Column-only read path for the JSON list endpoints.
+
+Each list is a single Core SELECT of exactly the columns that get
+serialized, with joins and counts done in SQL, so no ORM objects are built
+and nothing is lazy-loaded per row. Rows go straight from result tuples to
+dicts, formatting only the date and time columns, and the response body is
+encoded once with the standard json module.
+"""
+
+import json
+
+from flask import current_app
+from sqlalchemy import case, func, select
+
+from models import (
+    db,
+    User,
+    Course,
+    Enrollment,
+    ClassSession,
+    AttendanceRecord,
+    Announcement,
+)
+from unread import visible_to
+
+
+def _iso(value):
+    return value.isoformat()
+
+
+def _hh_mm(value):
+    return value.strftime("%H:%M")
+
+
+SESSION_FORMATS = {"date": _iso, "start_time": _hh_mm, "end_time": _hh_mm}
+
+
+def records(statement, formats=None):
+    """Run `statement` and return its rows as dicts keyed by column label"""
+    result = db.session.execute(statement)
+    keys = list(result.keys())
+    if not formats:
+        return [dict(zip(keys, row)) for row in result]
+
+    formatted = [(i, formats[key]) for i, key in enumerate(keys) if key in formats]
+    rows = []
+    for row in result:
+        row = list(row)
+        for i, fmt in formatted:
+            if row[i] is not None:
+                row[i] = fmt(row[i])
+        rows.append(dict(zip(keys, row)))
+    return rows
+
+
+def json_response(**payload):
+    body = json.dumps({"success": True, **payload}, separators=(",", ":"))
+    return current_app.response_class(body, mimetype="application/json")
+
+
+def courses():
+    return records(
+        select(
+            Course.id,
+            Course.course_code,
+            Course.course_title,
+            Course.lecturer_name,
+            Course.join_code,
+        )
+    )
+
+
+def class_sessions():
+    return records(
+        select(
+            ClassSession.id,
+            ClassSession.course_id,
+            Course.course_code,
+            Course.course_title,
+            ClassSession.date,
+            ClassSession.start_time,
+            ClassSession.end_time,
+            ClassSession.location,
+            ClassSession.status,
+        )
+        .join(Course, ClassSession.course_id == Course.id)
+        .order_by(ClassSession.date.desc(), ClassSession.start_time),
+        SESSION_FORMATS,
+    )
+
+
+def students(course_id=None):
+    enrollment_count = (
+        select(func.count(Enrollment.id))
+        .where(Enrollment.user_id == User.id)
+        .correlate(User)
+        .scalar_subquery()
+    )
+    query = select(
+        User.id,
+        User.full_name,
+        User.matric_number,
+        User.created_at,
+        enrollment_count.label("enrollment_count"),
+    )
+    if course_id:
+        query = query.join(Enrollment, Enrollment.user_id == User.id).where(
+            Enrollment.course_id == course_id
+        )
+    else:
+        query = query.where(User.role == "student")
+    return records(query, {"created_at": _iso})
+
+
+def live_roster(session_id, course_id):
+    """Students enrolled on the course, marked present or absent for the session"""
+    present = (
+        select(AttendanceRecord.id)
+        .where(
+            AttendanceRecord.user_id == User.id,
+            AttendanceRecord.class_session_id == session_id,
+            AttendanceRecord.status == "present",
+        )
+        .correlate(User)
+        .exists()
+    )
+    return records(
+        select(
+            User.id,
+            User.full_name.label("name"),
+            User.matric_number,
+            case((present, "present"), else_="absent").label("status"),
+        )
+        .join(Enrollment, Enrollment.user_id == User.id)
+        .where(Enrollment.course_id == course_id)
+        .order_by(Enrollment.id)
+    )
+
+
+def present_count(session_id):
+    return db.session.scalar(
+        select(func.count(func.distinct(AttendanceRecord.user_id))).where(
+            AttendanceRecord.class_session_id == session_id,
+            AttendanceRecord.status == "present",
+        )
+    )
+
+
+def announcements(user_id, role):
+    """Announcements visible to the user, newest first, without is_read"""
+    return records(
+        select(
+            Announcement.id,
+            Announcement.title,
+            Announcement.content,
+            Announcement.priority,
+            Announcement.created_at,
+            User.full_name.label("author"),
+            Course.course_code,
+        )
+        .join(User, Announcement.author_id == User.id)
+        .outerjoin(Course, Announcement.course_id == Course.id)
+        .where(visible_to(user_id, role))
+        .order_by(Announcement.created_at.desc()),
+        {"created_at": _iso},
+    )
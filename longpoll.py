@@ -0,0 +1,183 @@
+"""
+Long polling for the live pages.
+
+Endpoints that support it take ?wait=<seconds> and hold the request until
+their data changes or the wait runs out, so a client learns about a change
+as soon as it happens with one open request instead of polling every few
+seconds.
+
+Held requests do not query the database while they wait. One watcher
+thread per worker looks for new attendance events, new or deleted
+announcements and new read receipts every LONG_POLL_INTERVAL seconds, and
+only while something is waiting, and wakes the requests waiting on what
+changed (e.g. attendance for one class session, or one user's reads). A
+request that changes something itself can also wake this worker's waiters
+straight away with notify(). Those check the database once and either answer or keep
+waiting. A waiting request has handed its connection back to the pool, so
+thousands of them need no more connections than the ones being answered.
+
+A held request still occupies whatever serves it: a whole process under
+gunicorn's sync workers, a thread under gthread, a greenlet under gevent.
+gunicorn.conf.py therefore sets LONG_POLL_MAX_WAIT to 0 for sync workers,
+which makes these endpoints answer straight away.
+"""
+
+import threading
+import time
+
+from flask import request
+from sqlalchemy import func
+
+from models import db, Announcement, AnnouncementRead, AttendanceEvent
+
+
+def _attendance(state):
+    last = state.get("last")
+    if last is None:
+        state["last"] = db.session.query(func.max(AttendanceEvent.id)).scalar() or 0
+        return ()
+    rows = (
+        db.session.query(AttendanceEvent.class_session_id, func.max(AttendanceEvent.id))
+        .filter(AttendanceEvent.id > last)
+        .group_by(AttendanceEvent.class_session_id)
+        .all()
+    )
+    if rows:
+        state["last"] = max(latest for _, latest in rows)
+    return {("attendance", class_session_id) for class_session_id, _ in rows}
+
+
+def _announcements(state):
+    # The count as well as the latest id, so deletions are noticed too
+    latest = db.session.query(
+        func.max(Announcement.id), func.count(Announcement.id)
+    ).one()
+    changed = state.get("latest", latest) != latest
+    state["latest"] = latest
+    return {("announcements",)} if changed else ()
+
+
+def _reads(state):
+    last = state.get("last")
+    if last is None:
+        state["last"] = db.session.query(func.max(AnnouncementRead.id)).scalar() or 0
+        return ()
+    rows = (
+        db.session.query(AnnouncementRead.user_id, func.max(AnnouncementRead.id))
+        .filter(AnnouncementRead.id > last)
+        .group_by(AnnouncementRead.user_id)
+        .all()
+    )
+    if rows:
+        state["last"] = max(latest for _, latest in rows)
+    return {("announcement-reads", user_id) for user_id, _ in rows}
+
+
+# Each watch takes its own state dict and returns the keys that changed
+# since its last call
+WATCHES = (_attendance, _announcements, _reads)
+
+
+class LongPoll:
+    def __init__(self, app=None):
+        self.app = None
+        self.max_wait = 25.0
+        self.interval = 1.0
+        self._generations = {}
+        self._states = {watch: {} for watch in WATCHES}
+        self._waiting = 0
+        self._condition = threading.Condition()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_wait = app.config.get("LONG_POLL_MAX_WAIT", self.max_wait)
+        self.interval = app.config.get("LONG_POLL_INTERVAL", self.interval)
+        app.extensions["longpoll"] = self
+
+    def requested_wait(self):
+        """Seconds this request may be held, capped by LONG_POLL_MAX_WAIT"""
+        wait = request.args.get("wait", 0, type=float)
+        return max(0.0, min(wait, self.max_wait))
+
+    def wait_for(self, keys, changed, timeout=None):
+        """Hold the request until changed() is true, re-checking it each
+        time the watcher reports a change to one of `keys`.
+
+        Returns whether a change was seen within `timeout` seconds, which
+        defaults to the request's ?wait=.
+        """
+        if timeout is None:
+            timeout = self.requested_wait()
+        if timeout <= 0:
+            return changed()
+
+        self._start()
+        deadline = time.monotonic() + timeout
+        while True:
+            # Read before checking, so a change in between still wakes us
+            generation = self._generation(keys)
+            if changed():
+                return True
+            db.session.close()
+            with self._condition:
+                self._waiting += 1
+                try:
+                    while self._generation(keys) == generation:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return False
+                        self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+    def _generation(self, keys):
+        return tuple(self._generations.get(key, 0) for key in keys)
+
+    def notify(self, *keys):
+        """Wake this worker's requests waiting on any of `keys`"""
+        with self._condition:
+            for key in keys:
+                self._generations[key] = self._generations.get(key, 0) + 1
+            self._condition.notify_all()
+
+    # Watcher
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                # Take the starting point here, so nothing that happens
+                # after a waiter's first check can be missed
+                self._poll()
+                self._thread = threading.Thread(
+                    target=self._run, name="longpoll-watcher", daemon=True
+                )
+                self._thread.start()
+
+    def _poll(self):
+        changed = set()
+        for watch in WATCHES:
+            changed.update(watch(self._states[watch]))
+        if changed:
+            self.notify(*changed)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if not self._waiting:
+                continue
+            with self.app.app_context():
+                try:
+                    self._poll()
+                except Exception as e:
+                    self.app.logger.warning("Long poll watcher failed: %s", e)
+                finally:
+                    db.session.remove()
+
+
+longpoll = LongPoll()
@@ -0,0 +1,445 @@
+"""
+Prometheus metrics at /metrics.
+
+Each worker keeps its counters, gauges and histograms in memory and writes
+a snapshot of them to a small SQLite file in the instance folder every
+METRICS_FLUSH_INTERVAL seconds, one row per (worker pid, series). A scrape
+flushes the serving worker first and then sums every worker's rows, so the
+numbers cover the whole gunicorn pool. Rows of workers that have exited
+are retired on the next flush: their counters and histograms are folded
+into pid 0, so they keep counting towards the totals, and their gauges are
+dropped. A new worker does the same with rows left under its own pid by an
+earlier process, before it writes its first snapshot. Gauges of workers
+that stop reporting are left out of scrapes.
+
+Request latency, in-flight requests and status codes are recorded for
+every endpoint. Business metrics (check-ins, export durations) are
+recorded by the code that does the work, and worker memory, cache and
+connection pool figures are read when a snapshot is taken. Resident memory
+carries a pid label, so each worker is reported on its own rather than
+summed.
+
+If METRICS_TOKEN is set, a scrape must send it as a bearer token. Without
+it only scrapes from this host, not forwarded by a proxy, are answered.
+"""
+
+import bisect
+import hmac
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, abort, g, request
+
+from dbutil import LocalStore
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+EXPORT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sample (
+    pid INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    value REAL NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (pid, name, labels)
+);
+"""
+
+LOOPBACK = ("127.0.0.1", "::1")
+
+LE_LABEL = re.compile(r'(?:^|,)le="([^"]*)"')
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return ",".join(
+        f'{key}="{_escape(value)}"' for key, value in sorted(labels.items())
+    )
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    def __init__(self, registry, name, kind, help, buckets=None):
+        self.registry = registry
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.buckets = buckets
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _labels(**labels)
+        with self.registry.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self.registry.lock:
+            self._values[_labels(**labels)] = value
+
+    def observe(self, value, **labels):
+        key = _labels(**labels)
+        with self.registry.lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One slot per bucket, then +Inf, sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        """(series name, labels, value) rows in the exposition layout"""
+        if self.kind != "histogram":
+            for labels, value in self._values.items():
+                yield self.name, labels, value
+            return
+
+        for labels, counts in self._values.items():
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _number(bound)
+                yield f"{self.name}_bucket", f'{prefix}le="{le}"', cumulative
+            yield f"{self.name}_sum", labels, counts[-1]
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Metrics:
+    def __init__(self, app=None):
+        self.app = None
+        self.store = None
+        self.token = None
+        self.flush_interval = 5.0
+        self.lock = threading.Lock()
+        self._flushed_pid = None
+        self._metrics = []
+        self._collectors = []
+        self._scrape_collectors = []
+
+        self.requests = self.counter(
+            "http_requests_total",
+            "Requests handled, by endpoint, method and status code",
+        )
+        self.latency = self.histogram(
+            "http_request_duration_seconds", "Time spent handling requests"
+        )
+        self.in_flight = self.gauge(
+            "http_requests_in_flight", "Requests being handled right now"
+        )
+        self.checkins = self.counter(
+            "attendance_checkins_total", "Students checked in to a class session"
+        )
+        self.export_seconds = self.histogram(
+            "attendance_export_duration_seconds",
+            "Time taken to produce attendance exports",
+            buckets=EXPORT_BUCKETS,
+        )
+        # Per worker, since a sum across processes hides the one that grows
+        self.resident_memory = self.gauge(
+            "process_resident_memory_bytes", "Resident memory of each worker, by pid"
+        )
+        self.collector(self._resident_memory)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.token = app.config.get("METRICS_TOKEN")
+        self.flush_interval = app.config.get(
+            "METRICS_FLUSH_INTERVAL", self.flush_interval
+        )
+        self.store = LocalStore(os.path.join(app.instance_path, "metrics.db"), SCHEMA)
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule("/metrics", "metrics", self.scrape)
+        app.extensions["metrics"] = self
+
+        self._watch_extensions(app)
+
+        threading.Thread(target=self._run, name="metrics-flush", daemon=True).start()
+
+    def _watch_extensions(self, app):
+        """Cache, pool and limiter figures from extensions set up before us"""
+        fragments = app.extensions.get("fragment_cache")
+        if fragments is not None:
+            lookups = self.counter(
+                "fragment_cache_lookups_total", "Template fragment cache lookups"
+            )
+
+            @self.collector
+            def fragment_cache_lookups():
+                lookups.set(fragments.hits, result="hit")
+                lookups.set(fragments.misses, result="miss")
+
+        sqlalchemy = app.extensions.get("sqlalchemy")
+        if sqlalchemy is not None:
+            checked_out = self.gauge(
+                "db_pool_connections_in_use", "Database connections checked out"
+            )
+            pool_size = self.gauge("db_pool_size", "Database connection pool size")
+
+            @self.collector
+            def db_pool():
+                with app.app_context():
+                    engines = dict(sqlalchemy.engines)
+                for bind, engine in engines.items():
+                    pool = engine.pool
+                    bind = bind or "primary"
+                    if hasattr(pool, "checkedout"):
+                        checked_out.set(pool.checkedout(), bind=bind)
+                    if hasattr(pool, "size"):
+                        pool_size.set(pool.size(), bind=bind)
+
+        limiter = app.extensions.get("rate_limiter")
+        if limiter is not None:
+
+            @self.scrape_collector(
+                "rate_limit_requests_total",
+                "counter",
+                "Requests admitted or shed by the rate limiter",
+            )
+            def rate_limits():
+                return {
+                    _labels(endpoint=endpoint, outcome=outcome): value
+                    for endpoint, stats in limiter.counters().items()
+                    for outcome, value in stats.items()
+                }
+
+    # Registry
+
+    def _add(self, name, kind, help, buckets=None):
+        metric = Metric(self, name, kind, help, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self._add(name, "counter", help)
+
+    def gauge(self, name, help):
+        return self._add(name, "gauge", help)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._add(name, "histogram", help, tuple(buckets))
+
+    def collector(self, f):
+        """Register f() to refresh per-worker values before each snapshot"""
+        self._collectors.append(f)
+        return f
+
+    def scrape_collector(self, name, kind, help):
+        """Register f() -> {labels: value} for figures already shared by
+        all workers, which are reported as they are instead of summed"""
+
+        def decorator(f):
+            self._scrape_collectors.append((name, kind, help, f))
+            return f
+
+        return decorator
+
+    def _resident_memory(self):
+        try:
+            with open("/proc/self/statm") as f:
+                pages = int(f.read().split()[1])
+        except OSError:
+            return
+        self.resident_memory.set(pages * os.sysconf("SC_PAGE_SIZE"), pid=os.getpid())
+
+    # Request instrumentation
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+        self.in_flight.inc()
+
+    def _after_request(self, response):
+        start = g.get("metrics_start")
+        if start is not None:
+            endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+            self.latency.observe(time.perf_counter() - start, endpoint=endpoint)
+            self.requests.inc(
+                endpoint=endpoint,
+                method=request.method,
+                status=response.status_code,
+            )
+        return response
+
+    def _teardown_request(self, error=None):
+        if g.pop("metrics_start", None) is not None:
+            self.in_flight.dec()
+
+    # Snapshots
+
+    def flush(self):
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                self.app.logger.warning("Metrics collector failed: %s", e)
+
+        pid = os.getpid()
+        now = time.time()
+        with self.lock:
+            rows = [
+                (pid, name, labels, metric.kind, value, now)
+                for metric in self._metrics
+                for name, labels, value in metric.samples()
+            ]
+        conn = self.store.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            retired = [p for p in _pids(conn) if p not in (0, pid) and not _alive(p)]
+            if self._flushed_pid != pid:
+                # Left behind by an earlier process that had our pid
+                retired.append(pid)
+            for retired_pid in retired:
+                _retire(conn, retired_pid)
+            conn.executemany(
+                "INSERT INTO sample (pid, name, labels, kind, value, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (pid, name, labels) DO UPDATE SET "
+                "value = excluded.value, updated = excluded.updated",
+                rows,
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._flushed_pid = pid
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                self.app.logger.warning("Metrics flush failed: %s", e)
+
+    def _aggregate(self):
+        stale = time.time() - 3 * self.flush_interval
+        totals = {}
+        for name, labels, value in self.store.connect().execute(
+            "SELECT name, labels, SUM(value) FROM sample "
+            "WHERE kind != 'gauge' OR updated >= ? GROUP BY name, labels",
+            (stale,),
+        ):
+            totals.setdefault(name, []).append((labels, value))
+        return totals
+
+    def render(self):
+        self.flush()
+        totals = self._aggregate()
+
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if metric.kind == "histogram":
+                series = []
+                for suffix in ("_bucket", "_sum", "_count"):
+                    series.extend(
+                        (metric.name + suffix, labels, value)
+                        for labels, value in totals.get(metric.name + suffix, [])
+                    )
+                series.sort(key=_histogram_order)
+            else:
+                series = sorted(
+                    (metric.name, labels, value)
+                    for labels, value in totals.get(metric.name, [])
+                )
+            lines.extend(_line(*s) for s in series)
+
+        for name, kind, help, collect in self._scrape_collectors:
+            try:
+                values = collect()
+            except Exception as e:
+                self.app.logger.warning("Metrics collector %s failed: %s", name, e)
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(_line(name, labels, value) for labels, value in values.items())
+
+        return "\n".join(lines) + "\n"
+
+    def scrape(self):
+        if self.token:
+            supplied = request.headers.get("Authorization", "")
+            if not hmac.compare_digest(supplied, f"Bearer {self.token}"):
+                abort(401)
+        elif (
+            request.remote_addr not in LOOPBACK or "X-Forwarded-For" in request.headers
+        ):
+            abort(403)
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+
+def _pids(conn):
+    return [pid for (pid,) in conn.execute("SELECT DISTINCT pid FROM sample")]
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, but belongs to another user
+    return True
+
+
+def _retire(conn, pid):
+    """Fold a finished worker's counters and histograms into pid 0"""
+    conn.execute(
+        "INSERT INTO sample (pid, name, labels, kind, value, updated) "
+        "SELECT 0, name, labels, kind, value, updated FROM sample "
+        "WHERE pid = ? AND kind != 'gauge' "
+        "ON CONFLICT (pid, name, labels) DO UPDATE SET "
+        "value = value + excluded.value, updated = excluded.updated",
+        (pid,),
+    )
+    conn.execute("DELETE FROM sample WHERE pid = ?", (pid,))
+
+
+def _line(name, labels, value):
+    if labels:
+        return f"{name}{{{labels}}} {_number(value)}"
+    return f"{name} {_number(value)}"
+
+
+def _histogram_order(series):
+    name, labels, _ = series
+    match = LE_LABEL.search(labels)
+    base = LE_LABEL.sub("", labels).strip(",")
+    suffix_order = 0 if name.endswith("_bucket") else 1
+    le = float(match.group(1).replace("+Inf", "inf")) if match else 0
+    return base, suffix_order, le, name
+
+
+metrics = Metrics()
@@ -7,6 +7,47 @@ import sqlite3
 from datetime import datetime
 import os
 
+AUTOINCREMENT_TABLES = [
+    (
+        'class_session',
+        """
+            CREATE TABLE {table} (
+                id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+                course_id INTEGER NOT NULL,
+                date DATE NOT NULL,
+                start_time TIME NOT NULL,
+                end_time TIME NOT NULL,
+                location VARCHAR(100),
+                status VARCHAR(20),
+                created_at DATETIME,
+                FOREIGN KEY(course_id) REFERENCES course (id) ON DELETE CASCADE
+            )
+        """,
+        'id, course_id, date, start_time, end_time, location, status, created_at',
+        'archived_class_session',
+    ),
+    (
+        'attendance_record',
+        """
+            CREATE TABLE {table} (
+                id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                course_id INTEGER NOT NULL,
+                class_session_id INTEGER NOT NULL,
+                status VARCHAR(20) NOT NULL,
+                timestamp DATETIME,
+                marked_by VARCHAR(20),
+                CONSTRAINT unique_attendance UNIQUE (user_id, class_session_id),
+                FOREIGN KEY(user_id) REFERENCES user (id) ON DELETE CASCADE,
+                FOREIGN KEY(course_id) REFERENCES course (id) ON DELETE CASCADE,
+                FOREIGN KEY(class_session_id) REFERENCES class_session (id) ON DELETE CASCADE
+            )
+        """,
+        'id, user_id, course_id, class_session_id, status, timestamp, marked_by',
+        'archived_attendance_record',
+    ),
+]
+
 def migrate_database():
     db_path = 'attendance.db'
     
@@ -81,7 +122,36 @@ def migrate_database():
             print("✓ Created announcement_read table")
         else:
             print("✓ announcement_read table already exists")
-        
+
+        # Archived sessions and records keep their ids, so SQLite must not
+        # hand those ids out again once the rows leave the hot tables
+        for table, create_sql, columns, archive_table in AUTOINCREMENT_TABLES:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,))
+            row = cursor.fetchone()
+            if row and 'AUTOINCREMENT' not in row[0].upper():
+                print(f"Rebuilding {table} table with AUTOINCREMENT ids...")
+                cursor.execute(f"DROP TABLE IF EXISTS {table}_new")
+                cursor.execute(create_sql.format(table=f"{table}_new"))
+                cursor.execute(f"INSERT INTO {table}_new ({columns}) SELECT {columns} FROM {table}")
+                cursor.execute(f"DROP TABLE {table}")
+                cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+                highest = cursor.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0
+                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (archive_table,))
+                if cursor.fetchone():
+                    archived = cursor.execute(f"SELECT MAX(id) FROM {archive_table}").fetchone()[0] or 0
+                    highest = max(highest, archived)
+                cursor.execute("DELETE FROM sqlite_sequence WHERE name=?", (table,))
+                cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, highest))
+                print(f"✓ Rebuilt {table} table, next id {highest + 1}")
+            elif row:
+                print(f"✓ {table} table already uses AUTOINCREMENT ids")
+
+        # Indexes used by the date-ordered admin feeds and term archival
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_class_session_date ON class_session (date)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_attendance_record_timestamp ON attendance_record (timestamp)")
+        print("✓ class_session.date and attendance_record.timestamp indexes present")
+
         conn.commit()
         print("\n✅ Database migration completed successfully!")
         
@@ -2,7 +2,9 @@ from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timedelta
 import secrets
 
-db = SQLAlchemy()
+from replica import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -14,10 +16,10 @@ class User(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
-    enrollments = db.relationship('Enrollment', backref='user', lazy=True, cascade='all, delete-orphan')
-    attendance_records = db.relationship('AttendanceRecord', backref='user', lazy=True, cascade='all, delete-orphan')
+    enrollments = db.relationship('Enrollment', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    attendance_records = db.relationship('AttendanceRecord', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
     announcements = db.relationship('Announcement', backref='author', lazy=True)
-    notification_reads = db.relationship('AnnouncementRead', backref='user', lazy=True, cascade='all, delete-orphan')
+    notification_reads = db.relationship('AnnouncementRead', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<User {self.full_name} ({self.matric_number})>'
@@ -33,9 +35,9 @@ class Course(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
-    enrollments = db.relationship('Enrollment', backref='course', lazy=True, cascade='all, delete-orphan')
-    class_sessions = db.relationship('ClassSession', backref='course', lazy=True, cascade='all, delete-orphan')
-    attendance_records = db.relationship('AttendanceRecord', backref='course', lazy=True, cascade='all, delete-orphan')
+    enrollments = db.relationship('Enrollment', backref='course', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    class_sessions = db.relationship('ClassSession', backref='course', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    attendance_records = db.relationship('AttendanceRecord', backref='course', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
     
     def __init__(self, **kwargs):
         super(Course, self).__init__(**kwargs)
@@ -97,8 +99,8 @@ class Course(db.Model):
 
 class Enrollment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id', ondelete='CASCADE'), nullable=False)
     enrolled_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Unique constraint to prevent duplicate enrollments
@@ -109,14 +111,18 @@ class Enrollment(db.Model):
 
 class ClassSession(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
-    date = db.Column(db.Date, nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id', ondelete='CASCADE'), nullable=False)
+    date = db.Column(db.Date, nullable=False, index=True)
     start_time = db.Column(db.Time, nullable=False)
     end_time = db.Column(db.Time, nullable=False)
     location = db.Column(db.String(100))
     status = db.Column(db.String(20), default='scheduled')  # 'scheduled', 'active', 'completed', 'cancelled'
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Never reuse the id of an archived session on SQLite: the archive keeps
+    # it, and calendar feeds use it as the event UID
+    __table_args__ = {'sqlite_autoincrement': True}
+    
     def is_active(self):
         now = datetime.now()
         session_start = datetime.combine(self.date, self.start_time)
@@ -133,18 +139,21 @@ class ClassSession(db.Model):
 
 class AttendanceRecord(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
-    class_session_id = db.Column(db.Integer, db.ForeignKey('class_session.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id', ondelete='CASCADE'), nullable=False)
+    class_session_id = db.Column(db.Integer, db.ForeignKey('class_session.id', ondelete='CASCADE'), nullable=False)
     status = db.Column(db.String(20), nullable=False)  # 'present', 'absent'
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     marked_by = db.Column(db.String(20), default='system')  # 'student', 'admin', 'system'
     
     # Relationships
-    class_session = db.relationship('ClassSession', backref='attendance_records', lazy=True)
+    class_session = db.relationship('ClassSession', backref=db.backref('attendance_records', passive_deletes=True), lazy=True)
     
     # Unique constraint to prevent duplicate records for same student in same session
-    __table_args__ = (db.UniqueConstraint('user_id', 'class_session_id', name='unique_attendance'),)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'class_session_id', name='unique_attendance'),
+        {'sqlite_autoincrement': True},  # ids live on in the archive
+    )
     
     def __repr__(self):
         return f'<AttendanceRecord {self.user.full_name} - {self.status}>'
@@ -154,13 +163,13 @@ class Announcement(db.Model):
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=True)  # null = general announcement
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id', ondelete='SET NULL'), nullable=True)  # null = general announcement
     priority = db.Column(db.String(20), default='normal')  # 'low', 'normal', 'high', 'urgent'
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
-    course = db.relationship('Course', backref='announcements', lazy=True)
-    reads = db.relationship('AnnouncementRead', backref='announcement', lazy=True, cascade='all, delete-orphan')
+    course = db.relationship('Course', backref=db.backref('announcements', passive_deletes=True), lazy=True)
+    reads = db.relationship('AnnouncementRead', backref='announcement', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
     
     def is_read_by(self, user_id):
         return AnnouncementRead.query.filter_by(
@@ -173,8 +182,8 @@ class Announcement(db.Model):
 
 class AnnouncementRead(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    announcement_id = db.Column(db.Integer, db.ForeignKey('announcement.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    announcement_id = db.Column(db.Integer, db.ForeignKey('announcement.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     read_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Unique constraint to prevent duplicate reads
@@ -182,3 +191,103 @@ class AnnouncementRead(db.Model):
     
     def __repr__(self):
         return f'<AnnouncementRead {self.announcement_id} by {self.user_id}>'
+
+class AttendanceEvent(db.Model):
+    """Append-only log of attendance record changes for downstream sync"""
+    id = db.Column(db.Integer, primary_key=True)
+    op = db.Column(db.String(10), nullable=False)  # 'insert', 'update', 'delete'
+    record_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    course_id = db.Column(db.Integer, nullable=False)
+    class_session_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    timestamp = db.Column(db.DateTime)  # the record's own timestamp
+    marked_by = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<AttendanceEvent {self.id} {self.op} Record:{self.record_id}>'
+
+class UnreadCounter(db.Model):
+    """Number of visible announcements a user has not read yet"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    unread = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<UnreadCounter User:{self.user_id}={self.unread}>'
+
+class ArchivedClassSession(db.Model):
+    """ClassSession moved out of the hot table once its term is archived"""
+    id = db.Column(db.Integer, primary_key=True)  # same id as the original session
+    term = db.Column(db.String(20), nullable=False, index=True)
+    course_id = db.Column(db.Integer, nullable=False, index=True)
+    date = db.Column(db.Date, nullable=False, index=True)
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    location = db.Column(db.String(100))
+    status = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<ArchivedClassSession {self.id} ({self.term})>'
+
+class ArchivedAttendanceRecord(db.Model):
+    """AttendanceRecord moved out of the hot table once its term is archived"""
+    id = db.Column(db.Integer, primary_key=True)  # same id as the original record
+    term = db.Column(db.String(20), nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    course_id = db.Column(db.Integer, nullable=False, index=True)
+    class_session_id = db.Column(db.Integer, nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False)
+    timestamp = db.Column(db.DateTime)
+    marked_by = db.Column(db.String(20))
+    
+    def __repr__(self):
+        return f'<ArchivedAttendanceRecord {self.id} ({self.term})>'
+
+class AttendanceRollup(db.Model):
+    """Per-student, per-course attendance totals for an archived term"""
+    id = db.Column(db.Integer, primary_key=True)
+    term = db.Column(db.String(20), nullable=False)
+    course_id = db.Column(db.Integer, nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    session_count = db.Column(db.Integer, nullable=False, default=0)
+    present_count = db.Column(db.Integer, nullable=False, default=0)
+    absent_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (db.UniqueConstraint('term', 'course_id', 'user_id', name='unique_rollup'),)
+    
+    def __repr__(self):
+        return f'<AttendanceRollup {self.term} Course:{self.course_id} User:{self.user_id}>'
+
+class ModelVersion(db.Model):
+    """Change counter per table, used to key cached template fragments"""
+    table_name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<ModelVersion {self.table_name}={self.version}>'
+
+class CalendarVersion(db.Model):
+    """Change counter per course, used to key its cached calendar events"""
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id', ondelete='CASCADE'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<CalendarVersion Course:{self.course_id}={self.version}>'
+
+class PurgeJob(db.Model):
+    """Background deletion of a course or student with a large history"""
+    id = db.Column(db.Integer, primary_key=True)
+    target_type = db.Column(db.String(20), nullable=False)  # 'course' or 'student'
+    target_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'running', 'completed', 'failed'
+    total_rows = db.Column(db.Integer, nullable=False, default=0)
+    deleted_rows = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<PurgeJob {self.target_type}:{self.target_id} {self.status}>'
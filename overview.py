@@ -0,0 +1,156 @@
+"""
+Everything a student's landing pages show, in one response.
+
+GET /api/me/overview returns the enrolled courses with attendance rates,
+today's and upcoming class sessions and the unread announcement count,
+which the courses and announcements pages otherwise work out separately.
+The student dashboard is rendered from the same payload.
+
+The course list and timetable change rarely, so they are kept per user and
+reused until the course, class_session or enrollment counters in
+model_version move (see fragment_cache) or the day changes. Attendance
+rates come from one grouped query and the unread count from the per-user
+counter, both of which are cheap enough to read every time.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import case, func, select
+
+from models import db, Course, Enrollment, ClassSession, AttendanceRecord
+from fragment_cache import fragment_cache
+from listing import records, SESSION_FORMATS
+
+DEPENDS = ("course", "class_session", "enrollment")
+UPCOMING_LIMIT = 5
+
+
+def _sessions(user_id):
+    return (
+        select(
+            ClassSession.id,
+            ClassSession.course_id,
+            Course.course_code,
+            Course.course_title,
+            ClassSession.date,
+            ClassSession.start_time,
+            ClassSession.end_time,
+            ClassSession.location,
+            ClassSession.status,
+        )
+        .join(Course, ClassSession.course_id == Course.id)
+        .join(Enrollment, Enrollment.course_id == ClassSession.course_id)
+        .where(Enrollment.user_id == user_id)
+        .order_by(ClassSession.date, ClassSession.start_time)
+    )
+
+
+def _rate(present, total):
+    return round(present / total * 100, 1) if total else 0
+
+
+class StudentOverview:
+    def __init__(self, app=None, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_entries = app.config.get("OVERVIEW_CACHE_SIZE", self.max_entries)
+        app.extensions["student_overview"] = self
+
+    def schedule(self, user_id, today):
+        """Enrolled courses and sessions from today on, cached per user"""
+        versions = fragment_cache.versions()
+        key = (user_id, today, tuple(versions.get(t, 0) for t in DEPENDS))
+
+        with self._lock:
+            cached = self._entries.get(user_id)
+            if cached is not None and cached[0] == key:
+                self._entries.move_to_end(user_id)
+                return cached[1]
+
+        courses = records(
+            select(
+                Course.id,
+                Course.course_code,
+                Course.course_title,
+                Course.lecturer_name,
+            )
+            .join(Enrollment, Enrollment.course_id == Course.id)
+            .where(Enrollment.user_id == user_id)
+            .order_by(Enrollment.id)
+        )
+        today_sessions = records(
+            _sessions(user_id).where(ClassSession.date == today), SESSION_FORMATS
+        )
+        upcoming_sessions = records(
+            _sessions(user_id).where(ClassSession.date >= today).limit(UPCOMING_LIMIT),
+            SESSION_FORMATS,
+        )
+        schedule = {
+            "courses": courses,
+            "today_sessions": today_sessions,
+            "upcoming_sessions": upcoming_sessions,
+        }
+
+        with self._lock:
+            self._entries[user_id] = (key, schedule)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return schedule
+
+    def attendance(self, user_id):
+        """{course_id: (present, total)} over the user's attendance records"""
+        return {
+            course_id: (present, total)
+            for course_id, present, total in db.session.execute(
+                select(
+                    AttendanceRecord.course_id,
+                    func.sum(case((AttendanceRecord.status == "present", 1), else_=0)),
+                    func.count(),
+                )
+                .where(AttendanceRecord.user_id == user_id)
+                .group_by(AttendanceRecord.course_id)
+            )
+        }
+
+    def build(self, user_id, unread_count=None):
+        schedule = self.schedule(user_id, datetime.now().date())
+        attendance = self.attendance(user_id)
+
+        courses = []
+        present_overall = total_overall = 0
+        for course in schedule["courses"]:
+            present, total = attendance.get(course["id"], (0, 0))
+            present_overall += present
+            total_overall += total
+            courses.append(
+                {
+                    **course,
+                    "attended": present,
+                    "total_classes": total,
+                    "attendance_rate": _rate(present, total),
+                }
+            )
+
+        return {
+            "courses": courses,
+            "attendance_rate": _rate(present_overall, total_overall),
+            "today_sessions": schedule["today_sessions"],
+            "upcoming_sessions": schedule["upcoming_sessions"],
+            "unread_count": unread_count,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+student_overview = StudentOverview()
@@ -0,0 +1,383 @@
+"""
+On-demand profiling of single requests.
+
+An admin adds ?_profile=1 to a URL, or sends an X-Profile: 1 header, and
+that one request runs under cProfile with every SQL statement it issues
+timed alongside. The pstats dump and a JSON summary (slowest functions and
+the SQL log) are kept in instance/profiles, and the response carries an
+X-Profile-Id header pointing at them. The newest PROFILE_KEEP profiles are
+kept.
+
+With ?_profile=memory the request runs under tracemalloc instead. Its
+summary holds the peak traced memory and the lines that allocated the most
+memory still live when the request finished, which is where a response
+that is built up in memory shows up.
+
+Requests without the flag only pay for the flag check. The SQL timing
+hooks are attached the first time a profile is taken, and even then they
+only record on the thread being profiled.
+
+MEMORY_TRACKING keeps tracemalloc running all the time (one frame per
+allocation, roughly doubling allocation cost) and records the peak memory
+of every request by endpoint, logging a warning for any request above
+MEMORY_CEILING_MB. tracemalloc sees the whole process, so with threaded
+workers a peak can include concurrent requests.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import secrets
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from flask import g, request, session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from session_store import session_store
+
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 30
+MEMORY_FRAMES = 10
+
+PROFILE_MODES = {"1": "cpu", "cpu": "cpu", "memory": "memory"}
+
+# Allocations made by the profiler itself
+UNTRACED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class RequestProfiler:
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = True
+        self.keep = 50
+        self.directory = None
+        self.track_memory = False
+        self.memory_ceiling = None
+        self._memory_peaks = {}
+        self._memory_lock = threading.Lock()
+        self._memory_profiles = 0  # memory profiles in flight
+        self._started_tracing = False
+        self._tracing_lock = threading.Lock()
+        self._local = threading.local()
+        self._hooked = False
+        self._hook_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get("PROFILING_ENABLED", self.enabled)
+        self.keep = app.config.get("PROFILE_KEEP", self.keep)
+        self.directory = os.path.join(app.instance_path, "profiles")
+        self.track_memory = app.config.get("MEMORY_TRACKING", self.track_memory)
+        ceiling_mb = app.config.get("MEMORY_CEILING_MB")
+        self.memory_ceiling = ceiling_mb * 1024 * 1024 if ceiling_mb else None
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.extensions["request_profiler"] = self
+
+    def _mode(self):
+        if not self.enabled:
+            return None
+        flag = request.args.get("_profile") or request.headers.get("X-Profile")
+        return PROFILE_MODES.get(flag)
+
+    # SQL timing
+
+    def _hook_sql(self):
+        with self._hook_lock:
+            if self._hooked:
+                return
+            event.listen(Engine, "before_cursor_execute", self._before_execute)
+            event.listen(Engine, "after_cursor_execute", self._after_execute)
+            self._hooked = True
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, many):
+        if getattr(self._local, "queries", None) is not None:
+            self._local.started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, many):
+        queries = getattr(self._local, "queries", None)
+        if queries is not None:
+            queries.append(
+                {
+                    "statement": statement,
+                    "duration_ms": round(
+                        (time.perf_counter() - self._local.started) * 1000, 3
+                    ),
+                    "bind": conn.engine.url.database,
+                }
+            )
+
+    # Request hooks
+
+    def _before_request(self):
+        if self.track_memory:
+            tracemalloc.reset_peak()
+            g.memory_start = tracemalloc.get_traced_memory()[0]
+
+        mode = self._mode()
+        # The role from the role cache, not the one copied into the cookie
+        # at login, so a demoted admin can no longer profile
+        if mode is None or session_store.role(session.get("user_id")) != "admin":
+            return
+        self._hook_sql()
+        self._local.queries = []
+        g.profile_started = time.perf_counter()
+        if mode == "memory":
+            g.memory_profile = self._start_memory()
+        else:
+            g.profile = cProfile.Profile()
+            g.profile.enable()
+
+    def _after_request(self, response):
+        start = g.pop("memory_start", None)
+        if start is not None:
+            self._record_peak(tracemalloc.get_traced_memory()[1] - start)
+
+        profile = g.get("profile")
+        memory_profile = g.get("memory_profile")
+        if profile is None and memory_profile is None:
+            return response
+        elapsed = time.perf_counter() - g.profile_started
+        try:
+            if profile is not None:
+                profile.disable()
+                profile_id = self._save_cpu(profile, elapsed, self._local.queries)
+            else:
+                profile_id = self._save_memory(
+                    self._stop_memory(g.pop("memory_profile")),
+                    elapsed,
+                    self._local.queries,
+                )
+            response.headers["X-Profile-Id"] = profile_id
+        except Exception as e:
+            self.app.logger.warning("Could not save request profile: %s", e)
+        return response
+
+    def _teardown_request(self, error=None):
+        profile = g.pop("profile", None)
+        if profile is not None:
+            profile.disable()
+        memory_profile = g.pop("memory_profile", None)
+        if memory_profile is not None:
+            self._stop_memory(memory_profile)
+        self._local.queries = None
+
+    # Memory
+
+    def _start_memory(self):
+        # Tracing is shared by the whole process, so overlapping profiles are
+        # counted and the last one to finish stops it
+        with self._tracing_lock:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start(MEMORY_FRAMES)
+                self._started_tracing = True
+            self._memory_profiles += 1
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+        return {
+            "current": current,
+            # Already tracing: compare against what was live beforehand
+            "baseline": None if started else tracemalloc.take_snapshot(),
+        }
+
+    def _stop_memory(self, memory_profile):
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(UNTRACED)
+        with self._tracing_lock:
+            self._memory_profiles -= 1
+            if self._memory_profiles == 0 and self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+        baseline = memory_profile["baseline"]
+        if baseline is None:
+            stats = [
+                (stat.traceback, stat.size, stat.count)
+                for stat in snapshot.statistics("lineno")
+            ]
+        else:
+            stats = [
+                (stat.traceback, stat.size_diff, stat.count_diff)
+                for stat in snapshot.compare_to(
+                    baseline.filter_traces(UNTRACED), "lineno"
+                )
+                if stat.size_diff > 0
+            ]
+        stats.sort(key=lambda s: s[1], reverse=True)
+
+        return {
+            "peak_bytes": peak - memory_profile["current"],
+            "retained_bytes": current - memory_profile["current"],
+            "allocations": [
+                {
+                    "site": f"{traceback[0].filename}:{traceback[0].lineno}",
+                    "size_bytes": size,
+                    "count": count,
+                }
+                for traceback, size, count in stats[:TOP_ALLOCATIONS]
+            ],
+        }
+
+    def _record_peak(self, peak):
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        with self._memory_lock:
+            stats = self._memory_peaks.setdefault(
+                endpoint, {"requests": 0, "max_bytes": 0, "last_bytes": 0}
+            )
+            stats["requests"] += 1
+            stats["last_bytes"] = peak
+            stats["max_bytes"] = max(stats["max_bytes"], peak)
+        if self.memory_ceiling and peak > self.memory_ceiling:
+            self.app.logger.warning(
+                "%s %s peaked at %.1f MB of traced memory",
+                request.method,
+                request.full_path.rstrip("?"),
+                peak / (1024 * 1024),
+            )
+
+    def memory_peaks(self):
+        """Peak traced memory per endpoint in this worker, largest first"""
+        with self._memory_lock:
+            peaks = [
+                {"endpoint": endpoint, **stats}
+                for endpoint, stats in self._memory_peaks.items()
+            ]
+        return sorted(peaks, key=lambda p: p["max_bytes"], reverse=True)
+
+    # Storage
+
+    def _new_id(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return datetime.utcnow().strftime("%Y%m%d%H%M%S-") + secrets.token_hex(4)
+
+    def _save_cpu(self, profile, elapsed, queries):
+        profile_id = self._new_id()
+        profile.dump_stats(self.path(profile_id))
+
+        stats = pstats.Stats(profile, stream=io.StringIO())
+        functions = sorted(
+            (
+                {
+                    "function": f"{filename}:{line}({name})",
+                    "calls": calls,
+                    "own_ms": round(own * 1000, 3),
+                    "cumulative_ms": round(cumulative * 1000, 3),
+                }
+                for (filename, line, name), (
+                    _,
+                    calls,
+                    own,
+                    cumulative,
+                    _,
+                ) in stats.stats.items()
+            ),
+            key=lambda f: f["cumulative_ms"],
+            reverse=True,
+        )[:TOP_FUNCTIONS]
+
+        self._save_summary(profile_id, "cpu", elapsed, queries, functions=functions)
+        return profile_id
+
+    def _save_memory(self, memory, elapsed, queries):
+        profile_id = self._new_id()
+        self._save_summary(profile_id, "memory", elapsed, queries, **memory)
+        return profile_id
+
+    def _save_summary(self, profile_id, mode, elapsed, queries, **details):
+        summary = {
+            "id": profile_id,
+            "mode": mode,
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "endpoint": request.endpoint,
+            "created_at": datetime.utcnow().isoformat(),
+            "total_ms": round(elapsed * 1000, 3),
+            "sql_count": len(queries),
+            "sql_ms": round(sum(q["duration_ms"] for q in queries), 3),
+            **details,
+            "sql": queries,
+        }
+        with open(self._summary_path(profile_id), "w") as f:
+            json.dump(summary, f)
+        self._prune()
+
+    def _prune(self):
+        summaries = sorted(
+            name for name in os.listdir(self.directory) if name.endswith(".json")
+        )
+        for name in summaries[: -self.keep]:
+            profile_id = name[: -len(".json")]
+            for path in (self.path(profile_id), self._summary_path(profile_id)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def path(self, profile_id):
+        return os.path.join(self.directory, f"{profile_id}.prof")
+
+    def artifact(self, profile_id):
+        """Path of the pstats file for a CPU profile, or None"""
+        if self.summary(profile_id) is None:
+            return None
+        path = self.path(profile_id)
+        return path if os.path.exists(path) else None
+
+    def _summary_path(self, profile_id):
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    def summary(self, profile_id):
+        """The stored summary, or None for an unknown id"""
+        if not profile_id.replace("-", "").isalnum():
+            return None
+        try:
+            with open(self._summary_path(profile_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def recent(self):
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if name.endswith(".json"):
+                summary = self.summary(name[: -len(".json")])
+                if summary:
+                    profiles.append(
+                        {
+                            key: summary.get(key)
+                            for key in (
+                                "id",
+                                "mode",
+                                "method",
+                                "path",
+                                "created_at",
+                                "total_ms",
+                                "sql_count",
+                                "sql_ms",
+                                "peak_bytes",
+                            )
+                        }
+                    )
+        return profiles
+
+
+profiler = RequestProfiler()
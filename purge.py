@@ -0,0 +1,260 @@
+"""
+Deleting courses and students together with everything that hangs off them.
+
+Small deletions are done inline with a handful of set-based DELETEs in one
+transaction. When a course or student has more dependent rows than
+PURGE_INLINE_LIMIT, a PurgeJob is queued instead. A background thread
+deletes the dependent rows in batches of PURGE_BATCH_SIZE, each batch in
+its own short transaction so check-ins are never stuck behind one long
+write lock. Progress is stored on the job row, where any worker can read it.
+
+Dependent rows are always deleted explicitly rather than left to ON DELETE
+CASCADE. Databases created before the cascades were added keep their old
+foreign keys, and deleted attendance records have to reach the attendance
+event log.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select, update
+
+import attendance_events
+from checkin import enrollment_cache
+from fragment_cache import bump
+from models import (
+    db,
+    User,
+    Course,
+    Enrollment,
+    ClassSession,
+    AttendanceRecord,
+    Announcement,
+    AnnouncementRead,
+    ArchivedClassSession,
+    ArchivedAttendanceRecord,
+    AttendanceRollup,
+    PurgeJob,
+    UnreadCounter,
+)
+from unread import unread_counters
+
+# Jobs whose worker has not reported progress for this long are taken over
+STALE_JOB_AFTER = timedelta(minutes=5)
+
+
+def _dependents(target_type, target_id):
+    """(model, where clause) pairs in the order they must be deleted"""
+    if target_type == "course":
+        return [
+            (AttendanceRecord, AttendanceRecord.course_id == target_id),
+            (ClassSession, ClassSession.course_id == target_id),
+            (Enrollment, Enrollment.course_id == target_id),
+            (ArchivedAttendanceRecord, ArchivedAttendanceRecord.course_id == target_id),
+            (ArchivedClassSession, ArchivedClassSession.course_id == target_id),
+            (AttendanceRollup, AttendanceRollup.course_id == target_id),
+        ]
+    return [
+        (AttendanceRecord, AttendanceRecord.user_id == target_id),
+        (AnnouncementRead, AnnouncementRead.user_id == target_id),
+        (UnreadCounter, UnreadCounter.user_id == target_id),
+        (Enrollment, Enrollment.user_id == target_id),
+        (ArchivedAttendanceRecord, ArchivedAttendanceRecord.user_id == target_id),
+        (AttendanceRollup, AttendanceRollup.user_id == target_id),
+    ]
+
+
+def _target(target_type, target_id):
+    if target_type == "course":
+        return Course.query.get(target_id)
+    return User.query.filter_by(id=target_id, role="student").first()
+
+
+def _delete_target(target_type, target_id):
+    if target_type == "course":
+        # Course announcements become general ones, as before
+        db.session.execute(
+            update(Announcement)
+            .where(Announcement.course_id == target_id)
+            .values(course_id=None)
+            .execution_options(synchronize_session=False)
+        )
+        # Its enrollments and announcement audiences are gone
+        unread_counters.reset()
+        enrollment_cache.invalidate(target_id)
+    else:
+        enrollment_cache.invalidate()
+
+    target = _target(target_type, target_id)
+    if target is not None:
+        # Deleted through the ORM so the search index sees it
+        db.session.delete(target)
+    bump("enrollment", "class_session")
+
+
+def _delete_rows(model, where):
+    if model is AttendanceRecord:
+        return attendance_events.delete_records(where)
+    return db.session.execute(
+        delete(model).where(where).execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def count_dependents(target_type, target_id):
+    return sum(
+        db.session.execute(
+            select(func.count()).select_from(model).where(where)
+        ).scalar()
+        for model, where in _dependents(target_type, target_id)
+    )
+
+
+class Purger:
+    def __init__(self, app=None):
+        self.app = None
+        self.inline_limit = 2000
+        self.batch_size = 500
+        self.batch_pause = 0.05
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.inline_limit = app.config.get("PURGE_INLINE_LIMIT", self.inline_limit)
+        self.batch_size = app.config.get("PURGE_BATCH_SIZE", self.batch_size)
+        app.extensions["purger"] = self
+
+        # Pick up jobs left behind by a worker that exited mid-purge
+        threading.Thread(target=self._resume, name="purge-resume", daemon=True).start()
+
+    def delete(self, target_type, target_id):
+        """Delete now if small, otherwise queue a job. Returns the job or None."""
+        if count_dependents(target_type, target_id) <= self.inline_limit:
+            for model, where in _dependents(target_type, target_id):
+                _delete_rows(model, where)
+            _delete_target(target_type, target_id)
+            db.session.commit()
+            return None
+
+        existing = PurgeJob.query.filter(
+            PurgeJob.target_type == target_type,
+            PurgeJob.target_id == target_id,
+            PurgeJob.status.in_(["pending", "running"]),
+        ).first()
+        if existing:
+            return existing
+
+        job = PurgeJob(
+            target_type=target_type,
+            target_id=target_id,
+            total_rows=count_dependents(target_type, target_id),
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        self._start(job.id)
+        return job
+
+    def _start(self, job_id):
+        threading.Thread(
+            target=self._run, args=(job_id,), name=f"purge-{job_id}", daemon=True
+        ).start()
+
+    def _resume(self):
+        try:
+            with self.app.app_context():
+                stale = datetime.utcnow() - STALE_JOB_AFTER
+                job_ids = [
+                    job_id
+                    for (job_id,) in db.session.query(PurgeJob.id).filter(
+                        db.or_(
+                            PurgeJob.status == "pending",
+                            db.and_(
+                                PurgeJob.status == "running",
+                                PurgeJob.updated_at < stale,
+                            ),
+                        )
+                    )
+                ]
+                db.session.remove()
+            for job_id in job_ids:
+                self._start(job_id)
+        except Exception as e:
+            self.app.logger.warning("Could not resume purge jobs: %s", e)
+
+    def _claim(self, job_id):
+        # Only one worker gets to run a job
+        stale = datetime.utcnow() - STALE_JOB_AFTER
+        claimed = db.session.execute(
+            update(PurgeJob)
+            .where(
+                PurgeJob.id == job_id,
+                db.or_(
+                    PurgeJob.status == "pending",
+                    db.and_(PurgeJob.status == "running", PurgeJob.updated_at < stale),
+                ),
+            )
+            .values(status="running", updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        return claimed == 1
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            try:
+                if not self._claim(job_id):
+                    return
+                job = PurgeJob.query.get(job_id)
+
+                for model, where in _dependents(job.target_type, job.target_id):
+                    while True:
+                        batch = select(model.id).where(where).limit(self.batch_size)
+                        deleted = _delete_rows(model, model.id.in_(batch))
+                        job.deleted_rows += deleted
+                        job.updated_at = datetime.utcnow()
+                        db.session.commit()
+                        if deleted < self.batch_size:
+                            break
+                        time.sleep(self.batch_pause)
+
+                _delete_target(job.target_type, job.target_id)
+                job.status = "completed"
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                job = PurgeJob.query.get(job_id)
+                if job is not None:
+                    job.status = "failed"
+                    job.error = str(e)
+                    db.session.commit()
+                self.app.logger.error("Purge job %s failed: %s", job_id, e)
+            finally:
+                db.session.remove()
+
+
+def job_progress(job):
+    return {
+        "id": job.id,
+        "target_type": job.target_type,
+        "target_id": job.target_id,
+        "status": job.status,
+        "total_rows": job.total_rows,
+        "deleted_rows": job.deleted_rows,
+        "progress": round(
+            (
+                min(job.deleted_rows / job.total_rows * 100, 100)
+                if job.total_rows
+                else 100
+            ),
+            1,
+        ),
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+purger = Purger()
@@ -0,0 +1,232 @@
+"""
+Admission control for hot write endpoints.
+
+Each protected endpoint gets a token bucket per caller (the logged in user,
+or the client address before login) and an optional cap on how many
+requests may be in flight across all workers. State lives in a small local
+SQLite file next to the app database, so every gunicorn worker on the host
+shares the same buckets. Rejected requests get 429 with a Retry-After hint.
+Admitted and shed counts are kept per endpoint. A bucket that has refilled
+completely is the same as no bucket, so rows idle for that long are
+deleted every few minutes.
+
+If the limiter store itself is unavailable, requests are admitted rather
+than failed.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import (
+    current_app,
+    flash,
+    jsonify,
+    make_response,
+    render_template,
+    request,
+    session,
+)
+
+from dbutil import LocalStore
+
+# In-flight markers older than this are assumed to belong to a dead worker
+STALE_INFLIGHT_SECONDS = 120
+PURGE_INTERVAL = 300
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bucket (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS inflight (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    endpoint TEXT NOT NULL,
+    started REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_inflight_endpoint ON inflight (endpoint, started);
+CREATE TABLE IF NOT EXISTS counter (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class Limited(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    def __init__(self, app=None):
+        self.store = None
+        self.enabled = True
+        self._next_purge = {}
+        self._purge_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get("RATE_LIMIT_ENABLED", True)
+        path = app.config.get("RATE_LIMIT_STORAGE") or os.path.join(
+            app.instance_path, "ratelimit.db"
+        )
+        self.store = LocalStore(path, SCHEMA)
+        app.extensions["rate_limiter"] = self
+
+    def admit(self, endpoint, caller, rate, burst, concurrency=None):
+        """Take a token and an in-flight slot; return a ticket for release()"""
+        conn = self.store.connect()
+        now = time.time()
+        key = f"{endpoint}:{caller}"
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated FROM bucket WHERE key = ?", (key,)
+            ).fetchone()
+            tokens = (
+                burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            )
+
+            if tokens < 1:
+                self._count(conn, f"shed_rate:{endpoint}")
+                conn.execute("COMMIT")
+                raise Limited("rate", math.ceil((1 - tokens) / rate))
+
+            ticket = None
+            if concurrency:
+                conn.execute(
+                    "DELETE FROM inflight WHERE endpoint = ? AND started < ?",
+                    (endpoint, now - STALE_INFLIGHT_SECONDS),
+                )
+                (in_flight,) = conn.execute(
+                    "SELECT COUNT(*) FROM inflight WHERE endpoint = ?", (endpoint,)
+                ).fetchone()
+                if in_flight >= concurrency:
+                    self._count(conn, f"shed_concurrency:{endpoint}")
+                    conn.execute("COMMIT")
+                    raise Limited("concurrency", 1)
+                ticket = conn.execute(
+                    "INSERT INTO inflight (endpoint, started) VALUES (?, ?)",
+                    (endpoint, now),
+                ).lastrowid
+
+            conn.execute(
+                "INSERT INTO bucket (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, "
+                "updated = excluded.updated",
+                (key, tokens - 1, now),
+            )
+            self._count(conn, f"admitted:{endpoint}")
+            conn.execute("COMMIT")
+        except Limited:
+            raise
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._maybe_purge(conn, endpoint, rate, burst, now)
+        return ticket
+
+    def _maybe_purge(self, conn, endpoint, rate, burst, now):
+        """Drop this endpoint's buckets that have refilled to `burst`"""
+        if now < self._next_purge.get(endpoint, 0):
+            return
+        if not self._purge_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_purge[endpoint] = now + PURGE_INTERVAL
+            # Keys are "<endpoint>:<caller>"; ";" sorts right after ":"
+            conn.execute(
+                "DELETE FROM bucket WHERE key >= ? AND key < ? "
+                "AND tokens + (? - updated) * ? >= ?",
+                (f"{endpoint}:", f"{endpoint};", now, rate, burst),
+            )
+        finally:
+            self._purge_lock.release()
+
+    def release(self, ticket):
+        if ticket is not None:
+            self.store.connect().execute("DELETE FROM inflight WHERE id = ?", (ticket,))
+
+    def _count(self, conn, name):
+        conn.execute(
+            "INSERT INTO counter (name, value) VALUES (?, 1) "
+            "ON CONFLICT (name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def counters(self):
+        """{endpoint: {"admitted": n, "shed_rate": n, "shed_concurrency": n}}"""
+        stats = {}
+        for name, value in self.store.connect().execute(
+            "SELECT name, value FROM counter"
+        ):
+            kind, endpoint = name.split(":", 1)
+            stats.setdefault(
+                endpoint, {"admitted": 0, "shed_rate": 0, "shed_concurrency": 0}
+            )[kind] = value
+        return stats
+
+    def limit(
+        self, endpoint, rate, burst, concurrency=None, template=None, key_func=None
+    ):
+        """Decorator; rate is tokens per second refilled into each caller's bucket.
+
+        Callers are told apart by key_func, defaulting to the logged in user
+        or the client address. HTML endpoints pass the template to re-render
+        with a flash message when a request is turned away; API endpoints
+        get a JSON body.
+        """
+
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if not self.enabled or request.method in ("GET", "HEAD"):
+                    return f(*args, **kwargs)
+
+                if key_func:
+                    caller = key_func()
+                else:
+                    caller = session.get("user_id") or request.remote_addr
+                try:
+                    ticket = self.admit(endpoint, caller, rate, burst, concurrency)
+                except Limited as e:
+                    return self._limited_response(e, template)
+                except sqlite3.Error as e:
+                    current_app.logger.warning("Rate limiter unavailable: %s", e)
+                    return f(*args, **kwargs)
+
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    try:
+                        self.release(ticket)
+                    except sqlite3.Error as e:
+                        current_app.logger.warning("Rate limiter release failed: %s", e)
+
+            return decorated_function
+
+        return decorator
+
+    def _limited_response(self, error, template):
+        message = "Too many requests, please try again shortly."
+        if template:
+            flash(message, "error")
+            response = make_response(render_template(template), 429)
+        else:
+            response = make_response(
+                jsonify({"success": False, "message": message}), 429
+            )
+        response.headers["Retry-After"] = str(error.retry_after)
+        return response
+
+
+limiter = RateLimiter()
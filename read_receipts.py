@@ -0,0 +1,157 @@
+"""
+Write-behind buffer for announcement read receipts.
+
+Marking an announcement as read only appends a row to a small spool file in
+the instance folder, which every worker on the host shares. A background
+thread moves spooled receipts into announcement_read every
+READ_RECEIPT_FLUSH_INTERVAL seconds with one INSERT ... ON CONFLICT DO
+NOTHING, so scrolling through announcements no longer costs a write
+transaction on the main database per item.
+
+A receipt is removed from the spool only after the insert has committed, so
+a worker dying mid-flush leaves it to be flushed again. When more than
+READ_RECEIPT_MAX_PENDING receipts are waiting the request that adds one
+flushes inline. Readers merge pending_for() into what the database says,
+which keeps a user's own reads visible before they are flushed.
+"""
+
+import atexit
+import os
+import threading
+import time
+from datetime import datetime
+
+from dbutil import LocalStore, insert_for
+from models import db, User, Announcement, AnnouncementRead
+from unread import unread_counters
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipt (
+    announcement_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    read_at REAL NOT NULL,
+    PRIMARY KEY (announcement_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS ix_receipt_user ON receipt (user_id);
+"""
+
+
+class ReadReceiptBuffer:
+    def __init__(self, app=None):
+        self.app = None
+        self.store = None
+        self.interval = 1.0
+        self.max_pending = 5000
+        self.batch_size = 1000
+        self._flush_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get("READ_RECEIPT_FLUSH_INTERVAL", self.interval)
+        self.max_pending = app.config.get("READ_RECEIPT_MAX_PENDING", self.max_pending)
+        self.store = LocalStore(
+            os.path.join(app.instance_path, "read_receipts.db"), SCHEMA
+        )
+        app.extensions["read_receipts"] = self
+
+        threading.Thread(
+            target=self._run, name="read-receipt-flush", daemon=True
+        ).start()
+        atexit.register(self.drain)
+
+    def add(self, announcement_id, user_id):
+        conn = self.store.connect()
+        conn.execute(
+            "INSERT OR IGNORE INTO receipt (announcement_id, user_id, read_at) "
+            "VALUES (?, ?, ?)",
+            (announcement_id, user_id, time.time()),
+        )
+        (pending,) = conn.execute("SELECT COUNT(*) FROM receipt").fetchone()
+        if pending > self.max_pending:
+            self.flush()
+
+    def pending_for(self, user_id):
+        """Announcement ids this user has read that are not flushed yet"""
+        return {
+            announcement_id
+            for (announcement_id,) in self.store.connect().execute(
+                "SELECT announcement_id FROM receipt WHERE user_id = ?", (user_id,)
+            )
+        }
+
+    def flush(self):
+        """Move one batch into the database; return how many were taken"""
+        with self._flush_lock:
+            conn = self.store.connect()
+            rows = conn.execute(
+                "SELECT announcement_id, user_id, read_at FROM receipt LIMIT ?",
+                (self.batch_size,),
+            ).fetchall()
+            if not rows:
+                return 0
+
+            # Receipts for announcements or users deleted since are dropped
+            announcements = {
+                announcement_id
+                for (announcement_id,) in db.session.query(Announcement.id).filter(
+                    Announcement.id.in_({row[0] for row in rows})
+                )
+            }
+            users = {
+                user_id
+                for (user_id,) in db.session.query(User.id).filter(
+                    User.id.in_({row[1] for row in rows})
+                )
+            }
+            values = [
+                {
+                    "announcement_id": announcement_id,
+                    "user_id": user_id,
+                    "read_at": datetime.utcfromtimestamp(read_at),
+                }
+                for announcement_id, user_id, read_at in rows
+                if announcement_id in announcements and user_id in users
+            ]
+            try:
+                if values:
+                    inserted = db.session.execute(
+                        insert_for(AnnouncementRead)
+                        .values(values)
+                        .on_conflict_do_nothing(
+                            index_elements=["announcement_id", "user_id"]
+                        )
+                        .returning(
+                            AnnouncementRead.announcement_id, AnnouncementRead.user_id
+                        )
+                    ).all()
+                    unread_counters.mark_read(inserted)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+            conn.executemany(
+                "DELETE FROM receipt WHERE announcement_id = ? AND user_id = ?",
+                [(announcement_id, user_id) for announcement_id, user_id, _ in rows],
+            )
+            return len(rows)
+
+    def drain(self):
+        """Flush everything that is pending, e.g. when the worker exits"""
+        try:
+            with self.app.app_context():
+                while self.flush() == self.batch_size:
+                    pass
+                db.session.remove()
+        except Exception as e:
+            self.app.logger.warning("Read receipt flush failed: %s", e)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.drain()
+
+
+read_receipts = ReadReceiptBuffer()
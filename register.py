@@ -0,0 +1,239 @@
+"""
+Attendance register: students down the side, class sessions across the top.
+
+A course's sessions, roster and attendance records are each fetched with
+one column-only query. pandas then pivots the records into the
+student x session grid, and the P/A cells and totals are worked out on
+whole arrays at once, so no ORM object is built per record. Archived terms
+are read from the archive tables; otherwise live sessions are used,
+optionally limited to a date range.
+
+A session that has taken place (an earlier day, or marked completed) with
+no record for a student counts as absent. Sessions still to come are left
+blank, and cancelled sessions are left out.
+
+XLSX output uses openpyxl's write-only mode, which writes rows out as they
+are added instead of keeping a cell object for each. The first sheet is
+the register and the second has per-session totals. CSV output is the
+register sheet only and is generated row by row.
+"""
+
+import csv
+import io
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, PatternFill
+from sqlalchemy import or_, select
+
+from models import (
+    db,
+    User,
+    Course,
+    Enrollment,
+    ClassSession,
+    AttendanceRecord,
+    ArchivedClassSession,
+    ArchivedAttendanceRecord,
+)
+
+CSV_CHUNK_ROWS = 500
+
+TOTALS_HEADER = ["Present", "Absent", "Attendance %"]
+SESSIONS_HEADER = ["Date", "Start", "End", "Location"] + TOTALS_HEADER
+
+
+class RegisterError(Exception):
+    pass
+
+
+def _frame(statement, columns):
+    return pd.DataFrame(db.session.execute(statement).all(), columns=columns)
+
+
+def _rate(present, absent):
+    taken = present + absent
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(taken > 0, np.round(present / taken * 100, 1), 0.0)
+
+
+class Register:
+    def __init__(self, course, term, sessions, students, records, today):
+        self.course = course
+        self.term = term
+        self.sessions = sessions
+        self.students = students
+
+        # Student x session grid of raw statuses, NaN where nothing was recorded
+        grid = records.pivot(
+            index="user_id", columns="class_session_id", values="status"
+        ).reindex(index=students["id"], columns=sessions["id"])
+        statuses = grid.to_numpy(dtype=object)
+
+        # bool explicitly: masks built from an empty frame come out as object
+        held = (sessions["date"] < today).to_numpy(dtype=bool) | (
+            sessions["status"] == "completed"
+        ).to_numpy(dtype=bool)
+        present = statuses == "present"
+        absent = (statuses == "absent") | (pd.isna(grid).to_numpy(dtype=bool) & held)
+        self.cells = np.where(present, "P", np.where(absent, "A", ""))
+
+        self.student_present = present.sum(axis=1)
+        self.student_absent = absent.sum(axis=1)
+        self.session_present = present.sum(axis=0)
+        self.session_absent = absent.sum(axis=0)
+
+        # Dates alone, with the start time added where a date repeats
+        dates = [d.isoformat() for d in sessions["date"]]
+        repeated = sessions["date"].duplicated(keep=False).tolist()
+        self.labels = [
+            f"{label} {start:%H:%M}" if again else label
+            for label, start, again in zip(dates, sessions["start_time"], repeated)
+        ]
+
+    # Rows
+
+    def header(self):
+        return ["Matric Number", "Student Name"] + self.labels + TOTALS_HEADER
+
+    def rows(self):
+        rates = _rate(self.student_present, self.student_absent)
+        for i, (matric, name) in enumerate(
+            zip(self.students["matric_number"], self.students["full_name"])
+        ):
+            yield [matric, name, *self.cells[i].tolist()] + [
+                int(self.student_present[i]),
+                int(self.student_absent[i]),
+                float(rates[i]),
+            ]
+
+    def session_rows(self):
+        rates = _rate(self.session_present, self.session_absent)
+        for j, session in enumerate(self.sessions.itertuples(index=False)):
+            yield [
+                session.date.isoformat(),
+                session.start_time.strftime("%H:%M"),
+                session.end_time.strftime("%H:%M"),
+                session.location or "",
+                int(self.session_present[j]),
+                int(self.session_absent[j]),
+                float(rates[j]),
+            ]
+
+    # Output
+
+    def filename(self, extension):
+        name = f"register_{self.course.course_code}"
+        if self.term:
+            name += f"_{self.term}"
+        return f"{name}.{extension}"
+
+    def to_xlsx(self):
+        wb = Workbook(write_only=True)
+
+        ws = wb.create_sheet("Register")
+        ws.freeze_panes = "C2"
+        ws.column_dimensions["A"].width = 16
+        ws.column_dimensions["B"].width = 28
+        ws.append(self._header_cells(ws, self.header()))
+        for row in self.rows():
+            ws.append(row)
+
+        ws = wb.create_sheet("Sessions")
+        ws.freeze_panes = "A2"
+        ws.append(self._header_cells(ws, SESSIONS_HEADER))
+        for row in self.session_rows():
+            ws.append(row)
+
+        output = io.BytesIO()
+        wb.save(output)
+        return output.getvalue()
+
+    def _header_cells(self, ws, values):
+        font = Font(bold=True, color="FFFFFF")
+        fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+        cells = []
+        for value in values:
+            cell = WriteOnlyCell(ws, value=value)
+            cell.font = font
+            cell.fill = fill
+            cell.alignment = Alignment(horizontal="center")
+            cells.append(cell)
+        return cells
+
+    def csv_chunks(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.header())
+        for i, row in enumerate(self.rows(), 1):
+            writer.writerow(row)
+            if i % CSV_CHUNK_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+
+def build(course_id, term=None, start_date=None, end_date=None):
+    course = db.session.get(Course, course_id)
+    if course is None:
+        raise RegisterError("Course not found")
+
+    if term:
+        Session, Record = ArchivedClassSession, ArchivedAttendanceRecord
+        conditions = [Session.course_id == course_id, Session.term == term]
+    else:
+        Session, Record = ClassSession, AttendanceRecord
+        conditions = [Session.course_id == course_id]
+    conditions.append(or_(Session.status.is_(None), Session.status != "cancelled"))
+    if start_date:
+        conditions.append(Session.date >= start_date)
+    if end_date:
+        conditions.append(Session.date <= end_date)
+    session_ids = select(Session.id).where(*conditions)
+
+    sessions = _frame(
+        select(
+            Session.id,
+            Session.date,
+            Session.start_time,
+            Session.end_time,
+            Session.location,
+            Session.status,
+        )
+        .where(*conditions)
+        .order_by(Session.date, Session.start_time),
+        ["id", "date", "start_time", "end_time", "location", "status"],
+    )
+    if term and sessions.empty:
+        raise RegisterError(f"No archived sessions for {course.course_code} in {term}")
+
+    # Everyone enrolled now, plus anyone with a record who has since left
+    students = _frame(
+        select(User.id, User.matric_number, User.full_name)
+        .where(
+            or_(
+                User.id.in_(
+                    select(Enrollment.user_id).where(Enrollment.course_id == course_id)
+                ),
+                User.id.in_(
+                    select(Record.user_id).where(
+                        Record.class_session_id.in_(session_ids)
+                    )
+                ),
+            )
+        )
+        .order_by(User.full_name, User.matric_number),
+        ["id", "matric_number", "full_name"],
+    )
+    records = _frame(
+        select(Record.user_id, Record.class_session_id, Record.status).where(
+            Record.class_session_id.in_(session_ids)
+        ),
+        ["user_id", "class_session_id", "status"],
+    )
+
+    return Register(course, term, sessions, students, records, datetime.now().date())
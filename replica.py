@@ -0,0 +1,148 @@
+"""
+Routing reads to a read replica.
+
+When REPLICA_DATABASE_URL is set it becomes the "replica" bind. GET
+requests to routes decorated with @replica.reads then run their SELECTs
+against it; everything else, including any write those routes make, goes
+to the primary as before. The primary is used instead when:
+
+- the user wrote something in the last REPLICA_STICKY_SECONDS, so they
+  see their own changes
+- the request itself has already written
+- the replica is more than REPLICA_MAX_LAG seconds behind, checked at most
+  every REPLICA_LAG_CHECK_INTERVAL seconds per worker
+
+On PostgreSQL the lag comes from the standby's WAL replay position. Other
+databases, e.g. a copy of the SQLite file used to try this out locally,
+count as behind whenever their model_version counters differ from the
+primary's.
+"""
+
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.sql import Select
+
+PG_LAG = text(
+    "SELECT CASE"
+    " WHEN NOT pg_is_in_recovery() THEN 0"
+    " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())"
+    " END"
+)
+MODEL_VERSIONS = text("SELECT table_name, version FROM model_version")
+
+
+class RoutingSession(Session):
+    """Session that sends SELECTs to the replica while a request allows it"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and isinstance(clause, Select)
+            and not self._flushing
+            and not self.info.get("wrote")
+            and g.get("read_replica")
+        ):
+            return self._db.engines["replica"]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaRouter:
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.max_lag = 5.0
+        self.sticky_seconds = 10
+        self.check_interval = 2.0
+        self._healthy = False
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = "replica" in (app.config.get("SQLALCHEMY_BINDS") or {})
+        self.max_lag = app.config.get("REPLICA_MAX_LAG", self.max_lag)
+        self.sticky_seconds = app.config.get(
+            "REPLICA_STICKY_SECONDS", self.sticky_seconds
+        )
+        self.check_interval = app.config.get(
+            "REPLICA_LAG_CHECK_INTERVAL", self.check_interval
+        )
+        app.extensions["replica_router"] = self
+
+        if self.enabled:
+            db = app.extensions["sqlalchemy"]
+            event.listen(db.session, "do_orm_execute", self._on_execute)
+            event.listen(db.session, "after_flush", self._after_flush)
+            event.listen(db.session, "after_commit", self._after_commit)
+
+    # Read-your-writes
+
+    def _on_execute(self, orm_execute_state):
+        if not orm_execute_state.is_select:
+            orm_execute_state.session.info["wrote"] = True
+
+    def _after_flush(self, db_session, flush_context):
+        db_session.info["wrote"] = True
+
+    def _after_commit(self, db_session):
+        # Keep this user on the primary until the replica has caught up
+        if db_session.info.get("wrote") and has_request_context():
+            if "user_id" in session:
+                session["primary_until"] = time.time() + self.sticky_seconds
+
+    # Lag guard
+
+    def lag(self):
+        """Seconds the replica is behind the primary; infinity if unknown"""
+        db = self.app.extensions["sqlalchemy"]
+        replica_engine = db.engines["replica"]
+        with replica_engine.connect() as conn:
+            if replica_engine.dialect.name == "postgresql":
+                return float(conn.execute(PG_LAG).scalar() or 0)
+            replica_versions = dict(conn.execute(MODEL_VERSIONS).all())
+        with db.engine.connect() as conn:
+            primary_versions = dict(conn.execute(MODEL_VERSIONS).all())
+        return 0.0 if replica_versions == primary_versions else float("inf")
+
+    def healthy(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._healthy
+        with self._lock:
+            if now - self._checked_at >= self.check_interval:
+                try:
+                    self._healthy = self.lag() <= self.max_lag
+                except Exception as e:
+                    current_app.logger.warning("Replica lag check failed: %s", e)
+                    self._healthy = False
+                self._checked_at = now
+        return self._healthy
+
+    def use_replica(self):
+        return (
+            self.enabled
+            and request.method in ("GET", "HEAD")
+            and session.get("primary_until", 0) < time.time()
+            and self.healthy()
+        )
+
+    def reads(self, f):
+        """Decorator for routes whose GET requests may read from the replica"""
+
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            g.read_replica = self.use_replica()
+            return f(*args, **kwargs)
+
+        return decorated_function
+
+
+replica = ReplicaRouter()
@@ -0,0 +1,219 @@
+"""
+Long poll capacity and latency benchmark.
+
+Starts the app under gunicorn with each worker class in turn, opens
+--connections idle long polls on /api/announcements/unread-count, and while
+they are held times --probes short requests to the same endpoint. For each
+worker class it prints how many polls were held for the wait, how many
+only got a worker later (queued), how many were answered straight away or
+failed, and the p50 / p99 latency of the short requests.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python scripts/bench_longpoll.py \\
+        --matric ADM001 --password secret --connections 2000
+
+The account must exist in that database; the benchmark only reads. Pass
+--url to measure a server that is already running instead (the worker
+class is then whatever that server uses).
+"""
+
+import argparse
+import asyncio
+import http.cookiejar
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINT = "/api/announcements/unread-count"
+
+
+def login(url, matric, password):
+    """Cookie header for a logged-in session, and the current unread count"""
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    data = urllib.parse.urlencode({"matric_number": matric, "password": password})
+    opener.open(f"{url}/login", data.encode(), timeout=30).read()
+    cookie = "; ".join(f"{c.name}={c.value}" for c in jar)
+    if not cookie:
+        sys.exit("Login failed, check --matric and --password")
+
+    request = urllib.request.Request(f"{url}{ENDPOINT}", headers={"Cookie": cookie})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        try:
+            return cookie, json.loads(response.read())["unread_count"]
+        except (ValueError, KeyError):
+            # Redirected back to the login page
+            sys.exit("Login failed, check --matric and --password")
+
+
+async def get(host, port, path, cookie, timeout):
+    """Status code of one GET on a fresh connection"""
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port), timeout
+    )
+    try:
+        writer.write(
+            (
+                f"GET {path} HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode()
+        )
+        await writer.drain()
+        status = await asyncio.wait_for(reader.readline(), timeout)
+        await asyncio.wait_for(reader.read(), timeout)
+        return int(status.split()[1])
+    finally:
+        writer.close()
+
+
+async def hold(host, port, path, cookie, wait, results):
+    started = time.monotonic()
+    try:
+        status = await get(host, port, path, cookie, wait + 30)
+    except (OSError, asyncio.TimeoutError):
+        results["failed"] += 1
+        return
+    elapsed = time.monotonic() - started
+    if status != 200:
+        results["failed"] += 1
+    elif elapsed < wait * 0.9:
+        results["answered early"] += 1
+    elif elapsed > wait * 1.5:
+        results["queued"] += 1
+    else:
+        results["held"] += 1
+
+
+async def measure(url, cookie, unread, connections, wait, probes, ramp):
+    parsed = urllib.parse.urlsplit(url)
+    host, port = parsed.hostname, parsed.port or 80
+    results = {"held": 0, "queued": 0, "answered early": 0, "failed": 0}
+
+    poll_path = f"{ENDPOINT}?unread={unread}&wait={wait}"
+    polls = []
+    for i in range(connections):
+        polls.append(
+            asyncio.create_task(hold(host, port, poll_path, cookie, wait, results))
+        )
+        if i % 100 == 99:
+            await asyncio.sleep(ramp / max(connections // 100, 1))
+    await asyncio.sleep(1)
+
+    latencies = []
+    for _ in range(probes):
+        started = time.monotonic()
+        try:
+            await get(host, port, ENDPOINT, cookie, wait)
+            latencies.append(time.monotonic() - started)
+        except (OSError, asyncio.TimeoutError):
+            latencies.append(float(wait))
+
+    await asyncio.gather(*polls)
+    return results, latencies
+
+
+def start_server(worker_class, port, workers):
+    env = dict(os.environ, RATE_LIMIT_ENABLED="0")
+    if worker_class == "sync":
+        env["GUNICORN_THREADS"] = "1"
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-c",
+            "gunicorn.conf.py",
+            "-k",
+            worker_class,
+            "-w",
+            str(workers),
+            "-b",
+            f"127.0.0.1:{port}",
+            "app:app",
+        ],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"{url}/login", timeout=5).read()
+            return process, url
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    sys.exit(f"gunicorn with {worker_class} workers did not start")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def report(label, results, latencies):
+    print(
+        f"{label:>10}  held {results['held']:>6}  "
+        f"queued {results['queued']:>6}  "
+        f"answered early {results['answered early']:>6}  "
+        f"failed {results['failed']:>6}  "
+        f"p50 {statistics.median(latencies) * 1000:8.1f} ms  "
+        f"p99 {percentile(latencies, 99) * 1000:8.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--matric", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--wait", type=float, default=20)
+    parser.add_argument("--probes", type=int, default=200)
+    parser.add_argument("--ramp", type=float, default=5, help="seconds to open polls")
+    parser.add_argument(
+        "--worker-class", nargs="+", default=["sync", "gthread", "gevent"]
+    )
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--url", help="benchmark this running server instead")
+    args = parser.parse_args()
+
+    # Every held poll is an open socket here as well
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    runs = [(None, args.url)] if args.url else [(wc, None) for wc in args.worker_class]
+    for worker_class, url in runs:
+        process = None
+        if url is None:
+            process, url = start_server(worker_class, args.port, args.workers)
+        try:
+            cookie, unread = login(url, args.matric, args.password)
+            results, latencies = asyncio.run(
+                measure(
+                    url,
+                    cookie,
+                    unread,
+                    args.connections,
+                    args.wait,
+                    args.probes,
+                    args.ramp,
+                )
+            )
+            report(worker_class or url, results, latencies)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+
+if __name__ == "__main__":
+    main()
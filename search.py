@@ -0,0 +1,250 @@
+"""
+Full-text search over students, courses and announcements.
+
+Searchable text is copied into a single index table: an FTS5 virtual table
+on SQLite, or a tsvector column with GIN and trigram indexes on PostgreSQL.
+Rows are kept in step with the source tables from a session flush hook, so
+the index is written in the same transaction as the change itself.
+"""
+
+import re
+
+from sqlalchemy import event, text
+
+from models import db, User, Course, Announcement
+
+SEARCH_KINDS = ("student", "course", "announcement")
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _document(obj):
+    """Return (kind, ref_id, title, body) for an indexable object, or None"""
+    if isinstance(obj, User):
+        if obj.role != "student":
+            return None
+        return "student", obj.id, obj.full_name, obj.matric_number
+    if isinstance(obj, Course):
+        return (
+            "course",
+            obj.id,
+            f"{obj.course_code} {obj.course_title}",
+            obj.description or "",
+        )
+    if isinstance(obj, Announcement):
+        return "announcement", obj.id, obj.title, obj.content
+    return None
+
+
+def _doc_key(kind, ref_id):
+    # FTS5 can only look rows up efficiently by rowid, so fold the
+    # (kind, ref_id) pair into one
+    return ref_id * len(SEARCH_KINDS) + SEARCH_KINDS.index(kind)
+
+
+def _kind_of(obj):
+    if isinstance(obj, User):
+        return "student"
+    if isinstance(obj, Course):
+        return "course"
+    if isinstance(obj, Announcement):
+        return "announcement"
+    return None
+
+
+def _key_params(kind, ref_id):
+    return {"key": _doc_key(kind, ref_id), "kind": kind, "ref_id": ref_id}
+
+
+def _params(doc):
+    kind, ref_id, title, body = doc
+    params = _key_params(kind, ref_id)
+    params.update(title=title, body=body)
+    return params
+
+
+class SearchIndex:
+    def __init__(self, app=None):
+        self.dialect = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        with app.app_context():
+            self.dialect = db.engine.dialect.name
+            self.create_index()
+            if self._is_empty():
+                self.rebuild()
+
+        event.listen(db.session, "after_flush", self._after_flush)
+        app.extensions["search_index"] = self
+
+    # Schema
+
+    def create_index(self):
+        if self.dialect == "postgresql":
+            statements = [
+                "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+                """
+                CREATE TABLE IF NOT EXISTS search_document (
+                    kind VARCHAR(20) NOT NULL,
+                    ref_id INTEGER NOT NULL,
+                    title TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    tsv TSVECTOR GENERATED ALWAYS AS (
+                        setweight(to_tsvector('simple', title), 'A') ||
+                        setweight(to_tsvector('simple', body), 'B')
+                    ) STORED,
+                    PRIMARY KEY (kind, ref_id)
+                )
+                """,
+                "CREATE INDEX IF NOT EXISTS ix_search_document_tsv "
+                "ON search_document USING GIN (tsv)",
+                "CREATE INDEX IF NOT EXISTS ix_search_document_title_trgm "
+                "ON search_document USING GIN (title gin_trgm_ops)",
+            ]
+        else:
+            statements = ["""
+                CREATE VIRTUAL TABLE IF NOT EXISTS search_document USING fts5(
+                    kind UNINDEXED,
+                    ref_id UNINDEXED,
+                    title,
+                    body,
+                    tokenize = 'unicode61'
+                )
+                """]
+
+        with db.engine.begin() as conn:
+            for statement in statements:
+                conn.execute(text(statement))
+
+    def _is_empty(self):
+        with db.engine.connect() as conn:
+            return (
+                conn.execute(text("SELECT 1 FROM search_document LIMIT 1")).first()
+                is None
+            )
+
+    def rebuild(self):
+        """Re-index every searchable row from scratch"""
+        documents = []
+        for model in (User, Course, Announcement):
+            for obj in model.query.all():
+                doc = _document(obj)
+                if doc:
+                    documents.append(doc)
+
+        with db.engine.begin() as conn:
+            conn.execute(text("DELETE FROM search_document"))
+            if documents:
+                conn.execute(self._insert_sql(), [_params(d) for d in documents])
+
+    def _insert_sql(self):
+        if self.dialect == "postgresql":
+            return text(
+                "INSERT INTO search_document (kind, ref_id, title, body) "
+                "VALUES (:kind, :ref_id, :title, :body)"
+            )
+        return text(
+            "INSERT INTO search_document (rowid, kind, ref_id, title, body) "
+            "VALUES (:key, :kind, :ref_id, :title, :body)"
+        )
+
+    def _delete_sql(self):
+        if self.dialect == "postgresql":
+            return text(
+                "DELETE FROM search_document WHERE kind = :kind AND ref_id = :ref_id"
+            )
+        return text("DELETE FROM search_document WHERE rowid = :key")
+
+    # Incremental maintenance
+
+    def _after_flush(self, session, flush_context):
+        removed = []
+        upserts = []
+
+        for obj in session.deleted:
+            kind = _kind_of(obj)
+            if kind:
+                removed.append(_key_params(kind, obj.id))
+
+        changed = list(session.new) + [
+            obj
+            for obj in session.dirty
+            if session.is_modified(obj, include_collections=False)
+        ]
+        for obj in changed:
+            kind = _kind_of(obj)
+            if not kind:
+                continue
+            removed.append(_key_params(kind, obj.id))
+            doc = _document(obj)
+            if doc:
+                upserts.append(_params(doc))
+
+        if not removed and not upserts:
+            return
+
+        conn = session.connection()
+        if removed:
+            conn.execute(self._delete_sql(), removed)
+        if upserts:
+            conn.execute(self._insert_sql(), upserts)
+
+    # Queries
+
+    def search(self, query, kinds=SEARCH_KINDS, limit=20):
+        """Prefix search; every term must match the start of some word"""
+        terms = _TOKEN_RE.findall(query or "")
+        if not terms:
+            return []
+
+        kinds = [k for k in kinds if k in SEARCH_KINDS]
+        if not kinds:
+            return []
+
+        params = {"limit": limit}
+        kind_placeholders = []
+        for n, kind in enumerate(kinds):
+            params[f"kind{n}"] = kind
+            kind_placeholders.append(f":kind{n}")
+        kind_filter = f"kind IN ({', '.join(kind_placeholders)})"
+
+        if self.dialect == "postgresql":
+            params["tsquery"] = " & ".join(f"{t}:*" for t in terms)
+            params["raw"] = " ".join(terms)
+            sql = f"""
+                SELECT kind, ref_id, title, body,
+                       ts_rank(tsv, to_tsquery('simple', :tsquery)) AS rank
+                FROM search_document
+                WHERE {kind_filter}
+                  AND (tsv @@ to_tsquery('simple', :tsquery) OR title % :raw)
+                ORDER BY rank DESC, similarity(title, :raw) DESC
+                LIMIT :limit
+            """
+        else:
+            # Quote each term so FTS5 operators in user input are inert
+            params["match"] = " ".join(
+                '"{}"*'.format(t.replace('"', '""')) for t in terms
+            )
+            sql = f"""
+                SELECT kind, ref_id, title, body
+                FROM search_document
+                WHERE search_document MATCH :match AND {kind_filter}
+                ORDER BY bm25(search_document, 0, 0, 10.0, 1.0)
+                LIMIT :limit
+            """
+
+        rows = db.session.execute(text(sql), params).all()
+        return [
+            {
+                "type": row.kind,
+                "id": int(row.ref_id),
+                "title": row.title,
+                "body": row.body,
+            }
+            for row in rows
+        ]
+
+
+search_index = SearchIndex()
@@ -0,0 +1,248 @@
+"""
+Login sessions that every worker accepts.
+
+The cookie signing key is SECRET_KEY when set, otherwise a key generated
+once in the instance folder and shared by every worker on the host, so a
+session started on one worker is valid on the others and after a restart.
+
+With SESSION_STORE=local the session data itself lives in a small SQLite
+file on the host and the cookie carries only a signed random id. Logging
+out then really ends the session, and sessions idle for longer than
+SESSION_TTL seconds are dropped; expired rows are cleared out every few
+minutes. The default, SESSION_STORE=cookie, keeps Flask's signed cookies.
+
+Either way, user roles are cached in the same file for ROLE_CACHE_TTL
+seconds, so admin-only views check the role without a database query.
+A user whose role changes or who is deleted has their cached role and
+stored sessions removed when the change is committed.
+"""
+
+import os
+import secrets
+import threading
+import time
+
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from itsdangerous import BadSignature, Signer
+from sqlalchemy import event, inspect
+from werkzeug.datastructures import CallbackDict
+
+from checkin import load_or_create_secret
+from dbutil import LocalStore
+from models import db, User
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS session (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER,
+    data TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_session_expires ON session (expires);
+CREATE INDEX IF NOT EXISTS ix_session_user_id ON session (user_id);
+CREATE TABLE IF NOT EXISTS role (
+    user_id INTEGER PRIMARY KEY,
+    role TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+# An unchanged session's expiry is pushed back at most this often
+TOUCH_INTERVAL = 300
+PURGE_INTERVAL = 300
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.new = new
+        self.modified = False
+        self.user_id = self.get("user_id")
+
+
+class LocalSessionInterface(SessionInterface):
+    serializer = session_json_serializer
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt="session-id")
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            if sid:
+                row = self.store.load(sid)
+                if row is not None:
+                    data, expires = row
+                    return ServerSession(
+                        self.serializer.loads(data), sid=sid, expires=expires
+                    )
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not session.new and session.get("user_id") != session.user_id:
+            # New id on login or user switch, so an id planted before login
+            # never becomes an authenticated session
+            self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+            session.new = True
+
+        now = time.time()
+        touch = session.expires is None or (
+            now - (session.expires - self.store.ttl) > TOUCH_INTERVAL
+        )
+        if session.modified or touch:
+            self.store.save(
+                session.sid,
+                session.get("user_id"),
+                self.serializer.dumps(dict(session)),
+                now + self.store.ttl,
+            )
+
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                self._signer(app).sign(session.sid).decode(),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+        response.vary.add("Cookie")
+
+
+class SessionStore:
+    def __init__(self, app=None):
+        self.store = None
+        self.ttl = 7 * 24 * 60 * 60
+        self.role_ttl = 300
+        self._next_purge = 0
+        self._purge_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get("SECRET_KEY"):
+            app.config["SECRET_KEY"] = load_or_create_secret(
+                os.path.join(app.instance_path, "secret.key")
+            )
+        self.ttl = app.config.get("SESSION_TTL", self.ttl)
+        self.role_ttl = app.config.get("ROLE_CACHE_TTL", self.role_ttl)
+        self.store = LocalStore(os.path.join(app.instance_path, "sessions.db"), SCHEMA)
+
+        if app.config.get("SESSION_STORE", "cookie") == "local":
+            app.session_interface = LocalSessionInterface(self)
+
+        event.listen(db.session, "after_flush", self._after_flush)
+        event.listen(db.session, "after_commit", self._after_commit)
+        event.listen(db.session, "after_rollback", self._after_rollback)
+        app.extensions["session_store"] = self
+
+    # Sessions
+
+    def load(self, sid):
+        """(serialized data, expires) of a live session, or None"""
+        return (
+            self.store.connect()
+            .execute(
+                "SELECT data, expires FROM session WHERE id = ? AND expires > ?",
+                (sid, time.time()),
+            )
+            .fetchone()
+        )
+
+    def save(self, sid, user_id, data, expires):
+        self.store.connect().execute(
+            "INSERT INTO session (id, user_id, data, expires) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET user_id = excluded.user_id, "
+            "data = excluded.data, expires = excluded.expires",
+            (sid, user_id, data, expires),
+        )
+        self._maybe_purge()
+
+    def delete(self, sid):
+        self.store.connect().execute("DELETE FROM session WHERE id = ?", (sid,))
+
+    def _maybe_purge(self):
+        now = time.time()
+        if now < self._next_purge or not self._purge_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_purge = now + PURGE_INTERVAL
+            conn = self.store.connect()
+            conn.execute("DELETE FROM session WHERE expires <= ?", (now,))
+            conn.execute("DELETE FROM role WHERE expires <= ?", (now,))
+        finally:
+            self._purge_lock.release()
+
+    # Roles
+
+    def role(self, user_id):
+        """The user's role, or None if there is no such user"""
+        conn = self.store.connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT role FROM role WHERE user_id = ? AND expires > ?",
+            (user_id, now),
+        ).fetchone()
+        if row is not None:
+            return row[0]
+
+        role = db.session.query(User.role).filter_by(id=user_id).scalar()
+        if role is not None:
+            conn.execute(
+                "INSERT INTO role (user_id, role, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET role = excluded.role, "
+                "expires = excluded.expires",
+                (user_id, role, now + self.role_ttl),
+            )
+        return role
+
+    def forget_user(self, user_id):
+        """Drop a user's cached role and stored sessions"""
+        conn = self.store.connect()
+        conn.execute("DELETE FROM role WHERE user_id = ?", (user_id,))
+        conn.execute("DELETE FROM session WHERE user_id = ?", (user_id,))
+
+    def _after_flush(self, session, flush_context):
+        changed = {obj.id for obj in session.deleted if isinstance(obj, User)}
+        changed.update(
+            obj.id
+            for obj in session.dirty
+            if isinstance(obj, User) and inspect(obj).attrs.role.history.has_changes()
+        )
+        if changed:
+            session.info.setdefault("changed_users", set()).update(changed)
+
+    def _after_commit(self, session):
+        for user_id in session.info.pop("changed_users", ()):
+            self.forget_user(user_id)
+
+    def _after_rollback(self, session):
+        session.info.pop("changed_users", None)
+
+
+session_store = SessionStore()
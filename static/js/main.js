@@ -142,7 +142,7 @@ function updateElementStatus(element, status) {
 }
 
 // Attendance marking functionality
-async function markAttendance(sessionId) {
+async function markAttendance(sessionId, code = null) {
     const button = document.querySelector(`[data-session-id="${sessionId}"] .attendance-btn`);
     
     if (button) {
@@ -156,12 +156,21 @@ async function markAttendance(sessionId) {
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({
-                    session_id: sessionId
+                    session_id: sessionId,
+                    code: code
                 })
             });
             
             const data = await response.json();
             
+            if (data.code_required && code === null) {
+                const entered = prompt('Enter the check-in code shown in class');
+                if (entered) {
+                    return markAttendance(sessionId, entered);
+                }
+                throw new Error(data.message);
+            }
+            
             if (data.success) {
                 button.innerHTML = '<i class="fas fa-check"></i> Present';
                 button.classList.remove('btn-primary');
@@ -299,6 +308,73 @@ function closeModal(modalId) {
     }
 }
 
+// Check-in codes rotate, so the one shown in the live attendance modal is
+// fetched again each time it expires, for as long as the modal is open
+let checkinCodeTimer = null;
+
+function keepCheckinCodeFresh(sessionId, expiresIn) {
+    clearTimeout(checkinCodeTimer);
+
+    const refresh = async () => {
+        const modal = document.getElementById('live-attendance-modal');
+        const codeElement = document.getElementById('live-checkin-code');
+        if (!modal || modal.style.display === 'none' || !codeElement) {
+            return;
+        }
+
+        try {
+            const response = await fetch(`/api/admin/session/${sessionId}/checkin-code`);
+            const data = await response.json();
+            if (!data.success) {
+                // The session has ended or been cancelled
+                codeElement.textContent = '—';
+                return;
+            }
+            codeElement.textContent = data.code;
+            checkinCodeTimer = setTimeout(refresh, data.expires_in * 1000);
+        } catch (error) {
+            console.error('Error refreshing check-in code:', error);
+            checkinCodeTimer = setTimeout(refresh, 5000);
+        }
+    };
+
+    checkinCodeTimer = setTimeout(refresh, (expiresIn || 0) * 1000);
+}
+
+// The live attendance modal keeps one long poll open: the server holds it
+// until attendance for the session moves past `version` (or 25 seconds
+// pass), and render() is called with the new data when it has. Opening
+// the modal again stops the previous poll once it returns
+let liveAttendanceFollow = 0;
+
+async function followLiveAttendance(sessionId, version, render) {
+    const follow = ++liveAttendanceFollow;
+
+    while (follow === liveAttendanceFollow) {
+        const modal = document.getElementById('live-attendance-modal');
+        if (!modal || modal.style.display === 'none') {
+            break;
+        }
+
+        try {
+            const response = await fetch(
+                `/api/admin/session/${sessionId}/live-attendance?since=${version}&wait=25`
+            );
+            const data = await response.json();
+            if (!data.success || follow !== liveAttendanceFollow) {
+                break;
+            }
+            if (data.version !== version) {
+                version = data.version;
+                render(data);
+            }
+        } catch (error) {
+            console.error('Error following live attendance:', error);
+            await new Promise(resolve => setTimeout(resolve, 5000));
+        }
+    }
+}
+
 // Form validation
 function validateForm(formId) {
     const form = document.getElementById(formId);
@@ -0,0 +1,48 @@
+import os
+import sys
+import tempfile
+
+# app.py reads its configuration at import time
+_db_dir = tempfile.mkdtemp(prefix="attendance-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ["SESSION_SCHEDULER_ENABLED"] = "0"
+os.environ["RATE_LIMIT_ENABLED"] = "0"
+os.environ["MEMORY_TRACKING"] = "0"
+os.environ["PROFILING_ENABLED"] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from app import app as flask_app
+from models import db, User
+
+
+@pytest.fixture(scope="session")
+def app():
+    flask_app.config["TESTING"] = True
+    yield flask_app
+
+
+@pytest.fixture(scope="session")
+def admin_id(app):
+    with app.app_context():
+        admin = User(
+            full_name="Test Admin",
+            matric_number="ADMIN-TEST",
+            password="unused",
+            role="admin",
+        )
+        db.session.add(admin)
+        db.session.commit()
+        return admin.id
+
+
+@pytest.fixture
+def admin_client(app, admin_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = admin_id
+        session["user_role"] = "admin"
+        session["user_name"] = "Test Admin"
+    return client
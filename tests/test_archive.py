@@ -0,0 +1,102 @@
+"""
+Term archival. Archived sessions and records keep their ids, so ids freed
+by one archive run must never be handed out to rows archived by a later one.
+"""
+
+from datetime import date, time
+
+import pytest
+
+import archive
+from models import (
+    db,
+    User,
+    Course,
+    ClassSession,
+    AttendanceRecord,
+    ArchivedClassSession,
+    ArchivedAttendanceRecord,
+    AttendanceRollup,
+)
+
+TERMS = ("ARCH-T1", "ARCH-T2")
+
+
+@pytest.fixture
+def course(app):
+    with app.app_context():
+        student = User(
+            full_name="Archive Student",
+            matric_number="ARCH001",
+            password="unused",
+            role="student",
+        )
+        course = Course(
+            course_code="ARCH101",
+            course_title="Archive Course",
+            lecturer_name="Dr Test",
+        )
+        db.session.add_all([student, course])
+        db.session.commit()
+        ids = (course.id, student.id)
+
+    yield ids
+
+    # Exports include archived terms, so leave nothing behind for them
+    with app.app_context():
+        for model in (ArchivedAttendanceRecord, ArchivedClassSession, AttendanceRollup):
+            model.query.filter(model.term.in_(TERMS)).delete()
+        Course.query.filter_by(id=ids[0]).delete()
+        User.query.filter_by(id=ids[1]).delete()
+        db.session.commit()
+
+
+def _hold_session(course_id, student_id, day):
+    """One completed session on day with the student marked present"""
+    session = ClassSession(
+        course_id=course_id,
+        date=day,
+        start_time=time(9),
+        end_time=time(10),
+        status="completed",
+    )
+    db.session.add(session)
+    db.session.flush()
+    db.session.add(
+        AttendanceRecord(
+            user_id=student_id,
+            course_id=course_id,
+            class_session_id=session.id,
+            status="present",
+        )
+    )
+    db.session.commit()
+    return session.id
+
+
+def test_archiving_two_terms_in_a_row(app, course):
+    course_id, student_id = course
+    with app.app_context():
+        first_id = _hold_session(course_id, student_id, date(2001, 3, 1))
+        archive.archive_term(TERMS[0], date(2001, 1, 1), date(2001, 6, 30))
+
+        # Created after the first archive run, when its ids are free again
+        second_id = _hold_session(course_id, student_id, date(2001, 10, 1))
+        assert second_id != first_id
+
+        result = archive.archive_term(TERMS[1], date(2001, 7, 1), date(2001, 12, 31))
+        assert result["sessions_archived"] == 1
+        assert result["records_archived"] == 1
+
+        archived = dict(
+            db.session.query(ArchivedClassSession.id, ArchivedClassSession.term).filter(
+                ArchivedClassSession.term.in_(TERMS)
+            )
+        )
+        assert archived == {first_id: TERMS[0], second_id: TERMS[1]}
+        assert (
+            ArchivedAttendanceRecord.query.filter(
+                ArchivedAttendanceRecord.term.in_(TERMS)
+            ).count()
+            == 2
+        )
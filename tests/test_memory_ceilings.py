@@ -0,0 +1,150 @@
+"""
+Peak traced memory of the export and admin list endpoints at a fixed data
+size. A change that starts building a whole result in memory (or loading
+ORM objects per row) shows up here as a ceiling being crossed.
+"""
+
+import io
+import tracemalloc
+from datetime import date, datetime, time, timedelta
+
+import pytest
+from openpyxl import load_workbook
+from sqlalchemy import insert
+
+from models import db, User, Course, Enrollment, ClassSession, AttendanceRecord
+
+STUDENTS = 300
+COURSES = 3
+SESSIONS_PER_COURSE = 20  # 3 x 20 x 300 = 18,000 attendance records
+
+MB = 1024 * 1024
+
+# Ceilings are roughly 2x the peaks measured when they were set. Every export
+# format, XLSX included, stays near 3 MB however many rows match
+CEILINGS = {
+    "/api/admin/export-attendance": 6 * MB,
+    "/api/admin/export-attendance?format=csv": 6 * MB,
+    "/api/admin/export-attendance?format=ndjson": 6 * MB,
+    "/api/admin/export-attendance?format=parquet": 6 * MB,
+    "/api/students": MB * 3 // 4,
+    "/api/courses": MB // 8,
+    "/api/class-sessions": MB // 4,
+}
+
+
+@pytest.fixture(scope="module")
+def seeded(app):
+    with app.app_context():
+        db.session.execute(
+            insert(User),
+            [
+                {
+                    "full_name": f"Student {i:04d}",
+                    "matric_number": f"MEM{i:05d}",
+                    "password": "unused",
+                    "role": "student",
+                }
+                for i in range(STUDENTS)
+            ],
+        )
+        courses = [
+            Course(
+                course_code=f"MEM{c}",
+                course_title=f"Memory Course {c}",
+                lecturer_name="Dr Test",
+            )
+            for c in range(COURSES)
+        ]
+        db.session.add_all(courses)
+        db.session.flush()
+        student_ids = [
+            user_id
+            for (user_id,) in db.session.query(User.id).filter(
+                User.matric_number.like("MEM%")
+            )
+        ]
+
+        first_day = date(2026, 1, 5)
+        for course in courses:
+            db.session.execute(
+                insert(Enrollment),
+                [{"user_id": u, "course_id": course.id} for u in student_ids],
+            )
+            db.session.execute(
+                insert(ClassSession),
+                [
+                    {
+                        "course_id": course.id,
+                        "date": first_day + timedelta(days=d),
+                        "start_time": time(9),
+                        "end_time": time(10),
+                        "location": f"Room {course.id}",
+                        "status": "completed",
+                    }
+                    for d in range(SESSIONS_PER_COURSE)
+                ],
+            )
+        sessions = db.session.query(ClassSession.id, ClassSession.course_id).all()
+        db.session.execute(
+            insert(AttendanceRecord),
+            [
+                {
+                    "user_id": u,
+                    "course_id": course_id,
+                    "class_session_id": session_id,
+                    "status": "present" if (u + session_id) % 4 else "absent",
+                    "timestamp": datetime(2026, 1, 5, 9, 5),
+                }
+                for session_id, course_id in sessions
+                for u in student_ids
+            ],
+        )
+        db.session.commit()
+
+
+def _peak(client, url):
+    """(response, body size, peak traced bytes) for one GET.
+
+    The body is read chunk by chunk and thrown away, as a WSGI server
+    would send it, so a streamed response is not counted whole.
+    """
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        response = client.get(url, buffered=False)
+        size = 0
+        for chunk in response.response:
+            size += len(chunk)
+        response.close()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return response, size, peak
+
+
+@pytest.mark.parametrize("url", sorted(CEILINGS))
+def test_memory_ceiling(seeded, admin_client, url):
+    # Warm up once so one-off imports and caches don't count
+    admin_client.get(url).get_data()
+
+    response, size, peak = _peak(admin_client, url)
+
+    assert response.status_code == 200
+    assert size
+    assert (
+        peak < CEILINGS[url]
+    ), f"{url} peaked at {peak / MB:.2f} MB, ceiling {CEILINGS[url] / MB:.2f} MB"
+
+
+def test_streamed_exports_include_every_record(seeded, admin_client):
+    body = admin_client.get("/api/admin/export-attendance?format=ndjson").get_data()
+    assert body.count(b"\n") == STUDENTS * COURSES * SESSIONS_PER_COURSE
+
+
+def test_xlsx_export_includes_every_record(seeded, admin_client):
+    body = admin_client.get("/api/admin/export-attendance").get_data()
+    sheet = load_workbook(io.BytesIO(body), read_only=True)["Attendance Report"]
+    rows = sheet.iter_rows(values_only=True)
+    assert next(rows)[0] == "Date"
+    assert sum(1 for _ in rows) == STUDENTS * COURSES * SESSIONS_PER_COURSE
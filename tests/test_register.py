@@ -0,0 +1,156 @@
+"""
+Attendance register export: the student x session grid for one course.
+"""
+
+import csv
+import io
+from datetime import date, time, timedelta
+
+import pytest
+from openpyxl import load_workbook
+
+import register
+from models import db, User, Course, Enrollment, ClassSession, AttendanceRecord
+
+PAST = date(2025, 3, 3)
+FUTURE = date.today() + timedelta(days=30)
+
+
+@pytest.fixture
+def course(app):
+    with app.app_context():
+        course = Course(
+            course_code="REG101",
+            course_title="Register Course",
+            lecturer_name="Dr Test",
+        )
+        students = [
+            User(
+                full_name=f"Register Student {i}",
+                matric_number=f"REG00{i}",
+                password="unused",
+                role="student",
+            )
+            for i in range(2)
+        ]
+        db.session.add_all([course, *students])
+        db.session.flush()
+        db.session.add_all(
+            Enrollment(user_id=s.id, course_id=course.id) for s in students
+        )
+        db.session.commit()
+        ids = (course.id, [s.id for s in students])
+
+    yield ids
+
+    with app.app_context():
+        course_id, student_ids = ids
+        AttendanceRecord.query.filter_by(course_id=course_id).delete()
+        ClassSession.query.filter_by(course_id=course_id).delete()
+        Enrollment.query.filter_by(course_id=course_id).delete()
+        Course.query.filter_by(id=course_id).delete()
+        User.query.filter(User.id.in_(student_ids)).delete()
+        db.session.commit()
+
+
+def _session(course_id, day, hour, status="scheduled"):
+    session = ClassSession(
+        course_id=course_id,
+        date=day,
+        start_time=time(hour),
+        end_time=time(hour + 1),
+        status=status,
+    )
+    db.session.add(session)
+    db.session.flush()
+    return session.id
+
+
+def _csv(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    return list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+
+
+def test_course_without_sessions(app, course, admin_client):
+    course_id, _ = course
+    url = f"/api/admin/export-register?course_id={course_id}"
+
+    rows = _csv(admin_client, url + "&format=csv")
+    assert rows[0] == ["Matric Number", "Student Name"] + register.TOTALS_HEADER
+    assert rows[1:] == [
+        ["REG000", "Register Student 0", "0", "0", "0.0"],
+        ["REG001", "Register Student 1", "0", "0", "0.0"],
+    ]
+
+    response = admin_client.get(url)
+    assert response.status_code == 200
+    workbook = load_workbook(io.BytesIO(response.get_data()))
+    assert workbook.sheetnames == ["Register", "Sessions"]
+
+
+def test_date_range_without_sessions(app, course, admin_client):
+    course_id, _ = course
+    with app.app_context():
+        _session(course_id, PAST, 9, status="completed")
+        db.session.commit()
+
+    rows = _csv(
+        admin_client,
+        f"/api/admin/export-register?course_id={course_id}&format=csv"
+        "&start_date=2020-01-01&end_date=2020-12-31",
+    )
+    assert len(rows[0]) == 2 + len(register.TOTALS_HEADER)
+    assert len(rows) == 3
+
+
+def test_grid(app, course):
+    course_id, (first, second) = course
+    with app.app_context():
+        morning = _session(course_id, PAST, 9)
+        afternoon = _session(course_id, PAST, 14)
+        _session(course_id, PAST + timedelta(days=1), 9, status="cancelled")
+        _session(course_id, FUTURE, 9)
+        db.session.add_all(
+            [
+                AttendanceRecord(
+                    user_id=first,
+                    course_id=course_id,
+                    class_session_id=morning,
+                    status="present",
+                ),
+                AttendanceRecord(
+                    user_id=second,
+                    course_id=course_id,
+                    class_session_id=afternoon,
+                    status="present",
+                ),
+            ]
+        )
+        db.session.commit()
+
+        grid = register.build(course_id)
+
+    # Same-day sessions get their start time; cancelled ones are left out
+    assert grid.header()[2:5] == [
+        "2025-03-03 09:00",
+        "2025-03-03 14:00",
+        FUTURE.isoformat(),
+    ]
+    # No record for a held session is an absence, upcoming ones stay blank
+    assert list(grid.rows()) == [
+        ["REG000", "Register Student 0", "P", "A", "", 1, 1, 50.0],
+        ["REG001", "Register Student 1", "A", "P", "", 1, 1, 50.0],
+    ]
+    assert [row[4:] for row in grid.session_rows()] == [
+        [1, 1, 50.0],
+        [1, 1, 50.0],
+        [0, 0, 0.0],
+    ]
+
+
+def test_unknown_archived_term(app, course):
+    course_id, _ = course
+    with app.app_context(), pytest.raises(register.RegisterError):
+        register.build(course_id, term="NO-SUCH-TERM")
@@ -0,0 +1,208 @@
+"""
+Unread announcement counters.
+
+unread_counter keeps one row per user with the number of visible
+announcements they have not read. A row is built from the announcement
+tables the first time it is asked for, then maintained in place:
+
+- a new announcement adds one for everyone in its audience
+- a deleted announcement drops its audience's rows so they are rebuilt
+- receipts flushed from the read buffer subtract the ones they cover
+- mark-all-read sets the count to zero
+- enrollment changes drop the affected users' rows so they are rebuilt
+
+Reading a badge count is then a single primary key lookup.
+
+A rebuild is one INSERT ... SELECT on the primary in its own short
+transaction, so reads (including ones routed to the replica) never commit
+the request's session. On PostgreSQL rebuilds hold a shared advisory lock
+and new announcements an exclusive one, so a row cannot be built from a
+snapshot that misses an announcement whose increment skipped it because
+the row did not exist yet. SQLite serializes writers anyway.
+"""
+
+from collections import Counter
+
+from sqlalchemy import delete, event, func, literal, or_, select, text, true, update
+
+from dbutil import insert_for
+from models import db, User, Enrollment, Announcement, AnnouncementRead, UnreadCounter
+
+
+def visible_to(user_id, role):
+    """Filter on Announcement matching what the user gets to see"""
+    if role == "admin":
+        return true()
+    return or_(
+        Announcement.course_id.is_(None),
+        Announcement.course_id.in_(
+            select(Enrollment.course_id).where(Enrollment.user_id == user_id)
+        ),
+    )
+
+
+# Advisory lock key shared by rebuilds and new announcements
+REBUILD_LOCK = 7300451
+
+
+def _lock(conn, shared):
+    if conn.dialect.name == "postgresql":
+        function = "pg_advisory_xact_lock_shared" if shared else "pg_advisory_xact_lock"
+        conn.execute(text(f"SELECT {function}(:key)"), {"key": REBUILD_LOCK})
+
+
+def _audience(course_id):
+    """Filter on UnreadCounter for the users an announcement is shown to"""
+    if course_id is None:
+        return true()
+    return or_(
+        UnreadCounter.user_id.in_(
+            select(Enrollment.user_id).where(Enrollment.course_id == course_id)
+        ),
+        UnreadCounter.user_id.in_(select(User.id).where(User.role == "admin")),
+    )
+
+
+class UnreadCounters:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        event.listen(db.session, "after_flush", self._after_flush)
+        app.extensions["unread_counters"] = self
+
+    def _after_flush(self, session, flush_context):
+        conn = session.connection()
+        for obj in session.new:
+            if isinstance(obj, Announcement):
+                _lock(conn, shared=False)
+                self._announced(conn, obj.course_id)
+        for obj in session.deleted:
+            if isinstance(obj, Announcement):
+                # Whether each user had read it went with its receipts
+                conn.execute(delete(UnreadCounter).where(_audience(obj.course_id)))
+
+        users = {
+            obj.user_id
+            for obj in list(session.new) + list(session.deleted)
+            if isinstance(obj, Enrollment)
+        }
+        if users:
+            conn.execute(delete(UnreadCounter).where(UnreadCounter.user_id.in_(users)))
+
+    def _announced(self, conn, course_id):
+        conn.execute(
+            update(UnreadCounter)
+            .where(_audience(course_id))
+            .values(unread=UnreadCounter.unread + 1)
+        )
+
+    def _rebuild(self, user_id):
+        with db.engine.begin() as conn:
+            role = conn.execute(select(User.role).where(User.id == user_id)).scalar()
+            if role is None:
+                return 0
+            _lock(conn, shared=True)
+
+            visible = visible_to(user_id, role)
+            total = select(func.count(Announcement.id)).where(visible).scalar_subquery()
+            read = (
+                select(func.count(AnnouncementRead.id))
+                .join(Announcement, AnnouncementRead.announcement_id == Announcement.id)
+                .where(AnnouncementRead.user_id == user_id, visible)
+                .scalar_subquery()
+            )
+            conn.execute(
+                insert_for(UnreadCounter)
+                .from_select(
+                    ["user_id", "unread"],
+                    # SQLite needs a WHERE here to parse the ON CONFLICT
+                    select(literal(user_id), total - read).where(true()),
+                )
+                .on_conflict_do_nothing(index_elements=["user_id"])
+            )
+            return conn.execute(
+                select(UnreadCounter.unread).where(UnreadCounter.user_id == user_id)
+            ).scalar()
+
+    def count(self, user_id, pending=()):
+        """Unread count, less receipts still waiting in the read buffer"""
+        unread = (
+            db.session.query(UnreadCounter.unread).filter_by(user_id=user_id).scalar()
+        )
+        if unread is None:
+            unread = self._rebuild(user_id)
+
+        if pending:
+            already_read = {
+                announcement_id
+                for (announcement_id,) in db.session.query(
+                    AnnouncementRead.announcement_id
+                ).filter(
+                    AnnouncementRead.user_id == user_id,
+                    AnnouncementRead.announcement_id.in_(pending),
+                )
+            }
+            unread -= len(set(pending) - already_read)
+        return max(unread, 0)
+
+    def mark_read(self, receipts):
+        """Subtract newly inserted (announcement_id, user_id) receipts.
+
+        Runs in the caller's transaction. Receipts for announcements the
+        user cannot see were never counted, so they are skipped.
+        """
+        if not receipts:
+            return
+        user_ids = {user_id for _, user_id in receipts}
+        courses = dict(
+            db.session.query(Announcement.id, Announcement.course_id).filter(
+                Announcement.id.in_(
+                    {announcement_id for announcement_id, _ in receipts}
+                )
+            )
+        )
+        admins = {
+            user_id
+            for (user_id,) in db.session.query(User.id).filter(
+                User.id.in_(user_ids), User.role == "admin"
+            )
+        }
+        enrolled = set(
+            db.session.query(Enrollment.user_id, Enrollment.course_id).filter(
+                Enrollment.user_id.in_(user_ids),
+                Enrollment.course_id.in_(set(courses.values()) - {None}),
+            )
+        )
+
+        counts = Counter(
+            user_id
+            for announcement_id, user_id in receipts
+            if announcement_id in courses
+            and (
+                courses[announcement_id] is None
+                or user_id in admins
+                or (user_id, courses[announcement_id]) in enrolled
+            )
+        )
+        for user_id, read in counts.items():
+            db.session.execute(
+                update(UnreadCounter)
+                .where(UnreadCounter.user_id == user_id)
+                .values(unread=UnreadCounter.unread - read)
+            )
+
+    def mark_all_read(self, user_id):
+        db.session.execute(
+            update(UnreadCounter)
+            .where(UnreadCounter.user_id == user_id)
+            .values(unread=0)
+        )
+
+    def reset(self):
+        """Drop every counter, e.g. after announcements change audience"""
+        db.session.execute(delete(UnreadCounter))
+
+
+unread_counters = UnreadCounters()